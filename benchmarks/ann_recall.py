@@ -0,0 +1,65 @@
+"""
+Recall and speed of the approximate candidate generators against exact all-pairs search.
+
+    PYTHONPATH=. python benchmarks/ann_recall.py --entities 20000 --dim 256
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from llmgraph.general.candidates import RandomProjectionLSH, similar_pairs
+
+
+def make_embeddings(
+    n: int, dim: int, alias_rate: float = 0.3, noise: float = 0.25, seed: int = 0
+) -> np.ndarray:
+    """
+    Random entity embeddings where a fraction of the rows are noisy aliases of earlier rows
+    """
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((n, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    for i in range(1, n):
+        if rng.random() < alias_rate:
+            base = matrix[rng.integers(0, i)]
+            alias = base + noise * rng.standard_normal(dim).astype(np.float32) / np.sqrt(dim)
+            matrix[i] = alias / np.linalg.norm(alias)
+    return matrix
+
+
+def timed_pairs(candidates, matrix: np.ndarray, threshold: float) -> tuple[set, float]:
+    start = time.perf_counter()
+    pairs = {(i, j) for i, j, _ in candidates(matrix, threshold)}
+    return pairs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--tables", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--bits", type=int, nargs="+", default=[8, 12, 16])
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    matrix = make_embeddings(args.entities, args.dim)
+    exact, exact_time = timed_pairs(similar_pairs, matrix, args.threshold)
+    print(f"exact: pairs={len(exact)} time={exact_time:.2f}s")
+    print(f"{'tables':>6} {'bits':>4} {'recall':>7} {'pairs':>8} {'time':>8}")
+    for num_tables in args.tables:
+        for num_bits in args.bits:
+            lsh = RandomProjectionLSH(
+                num_tables=num_tables, num_bits=num_bits, top_k=args.top_k
+            )
+            approx, approx_time = timed_pairs(lsh, matrix, args.threshold)
+            recall = len(exact & approx) / len(exact) if exact else 1.0
+            print(
+                f"{num_tables:>6} {num_bits:>4} {recall:>7.3f} {len(approx):>8} {approx_time:>7.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark of the rectangle merging of PDF pages against the pairwise reference implementation.
+
+    PYTHONPATH=. python benchmarks/merge_rects.py --pdf paper.pdf
+    PYTHONPATH=. python benchmarks/merge_rects.py --paths 2000
+
+With a PDF, the drawings and images of each page are merged as in `_parse_rects`. Without one,
+synthetic drawing-heavy pages are used: charts made of many short paths, and tables of horizontal lines.
+"""
+
+import argparse
+import random
+import time
+
+import shapely.geometry as sg
+
+from llmgraph.general.parse_pdf import (
+    _merge_rects,
+    _is_near,
+    _is_horizontal_near,
+    _union_rects,
+)
+
+
+def reference_merge_rects(rect_list, distance=20, horizontal_distance=None):
+    """
+    The pairwise merge, repeated until stable
+    """
+    merged = True
+    while merged:
+        merged = False
+        new_rect_list = []
+        while rect_list:
+            rect = rect_list.pop(0)
+            for other_rect in rect_list:
+                if _is_near(rect, other_rect, distance) or (
+                    horizontal_distance
+                    and _is_horizontal_near(rect, other_rect, horizontal_distance)
+                ):
+                    rect = _union_rects(rect, other_rect)
+                    rect_list.remove(other_rect)
+                    merged = True
+            new_rect_list.append(rect)
+        rect_list = new_rect_list
+    return rect_list
+
+
+def synthetic_page(num_paths: int, rng: random.Random) -> list:
+    """
+    A page of 595x842 with a few charts of short paths, table lines and scattered marks
+    """
+    rects = []
+    charts = [(rng.uniform(20, 350), rng.uniform(20, 650)) for _ in range(4)]
+    for _ in range(num_paths):
+        x, y = rng.choice(charts)
+        x0, y0 = x + rng.uniform(0, 200), y + rng.uniform(0, 150)
+        rects.append(sg.box(x0, y0, x0 + rng.uniform(0, 8), y0 + rng.uniform(0, 8)))
+    for row in range(20):
+        y = 700 + row * 6
+        rects.append(sg.box(60, y, 540, y))
+    for _ in range(num_paths // 20):
+        x0, y0 = rng.uniform(0, 590), rng.uniform(0, 840)
+        rects.append(sg.box(x0, y0, x0 + 2, y0 + 2))
+    return rects
+
+
+def pdf_pages(path: str) -> list[list]:
+    import fitz
+
+    pages = []
+    with fitz.open(path) as doc:
+        for page in doc:
+            rects = [sg.box(*d["rect"]) for d in page.get_drawings()]
+            rects += [sg.box(*i["bbox"]) for i in page.get_image_info()]
+            pages.append(rects)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", type=str, default=None)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--paths", type=int, default=1000)
+    parser.add_argument("--skip-reference", action="store_true")
+    args = parser.parse_args()
+
+    if args.pdf:
+        pages = pdf_pages(args.pdf)
+    else:
+        rng = random.Random(0)
+        pages = [synthetic_page(args.paths, rng) for _ in range(args.pages)]
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages)} rectangles")
+
+    for name, merge in [
+        ("indexed", _merge_rects),
+        ("reference", reference_merge_rects),
+    ]:
+        if name == "reference" and args.skip_reference:
+            continue
+        start = time.perf_counter()
+        results = [merge(list(rects), 10, 100) for rects in pages]
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name}: {elapsed:.3f}s, {sum(len(r) for r in results)} merged rectangles"
+        )
+        if name == "indexed":
+            indexed = results
+        else:
+            same = sum(
+                [r.bounds for r in a] == [r.bounds for r in b]
+                for a, b in zip(indexed, results)
+            )
+            print(f"same result on {same}/{len(pages)} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Microbenchmark of the ER response parser over a corpus of LLM responses.
+
+    PYTHONPATH=. python benchmarks/parse_er.py --corpus responses.jsonl
+
+The corpus is a JSON Lines file with one {"response": "..."} object per line, e.g. responses
+collected from the debug logs. Without a corpus, synthetic responses in the prompt format are used.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from llmgraph.general.parse_text_er import parse_rawtext_to_er
+
+
+def load_corpus(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["response"] for line in f if line.strip()]
+
+
+def make_corpus(n: int, seed: int = 0) -> list[str]:
+    """
+    Synthetic responses with 10-40 entities and relationships each
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        names = [f"Entity {rng.randint(0, 10000)}" for _ in range(rng.randint(10, 40))]
+        lines = ["Entities:"]
+        for name in names:
+            properties = json.dumps({"role": "example"}) if rng.random() < 0.5 else "{}"
+            references = json.dumps([f"{name} appears in the text."])
+            lines.append(f"- <{name}, Concept, {properties}, {references}>")
+        lines.append("Relationships:")
+        for _ in range(len(names)):
+            start, end = rng.sample(names, 2)
+            references = json.dumps([f"{start} relates to {end}."])
+            lines.append(f"- <{start}, RELATED_TO, {end}, {{}}, {references}>")
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", type=str, default=None)
+    parser.add_argument("--responses", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else make_corpus(args.responses)
+    size = sum(len(text) for text in corpus)
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        es = rs = 0
+        for text in corpus:
+            entities, relationships = parse_rawtext_to_er(text)
+            es += len(entities)
+            rs += len(relationships)
+        best = min(best, time.perf_counter() - start)
+    print(
+        f"responses={len(corpus)} entities={es} relationships={rs} "
+        f"best={best:.3f}s {len(corpus) / best:.0f} responses/s {size / best / 1e6:.1f} MB/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Ingest a directory or a manifest of markdown and PDF documents into one graph.
+
+    python ingest.py docs/ --processes 8
+    python ingest.py manifest.txt --runs-dir runs
+    python ingest.py manifest.txt --runs-dir runs --resume 20240101120000-1a2b3c
+    python ingest.py docs/ --runs-dir runs --previous 20240101120000-1a2b3c
+
+With --runs-dir (or LLMGRAPH_RUN_DIR), the run is checkpointed and its result is saved to
+result.json in the run directory, with the chunk id range of each document.
+The PDFs are rendered under --image-dir, by default the pdf directory of the run or ./pdf,
+and the image paths of the result are relative to it.
+"""
+
+import argparse
+
+from llmgraph.general.ingest import collect_documents, ingest_documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("source", type=str, help="a directory or a manifest file")
+    parser.add_argument(
+        "--strategy", type=str, default="gleaning", choices=["gleaning", "single_shot"]
+    )
+    parser.add_argument(
+        "--runs-dir", type=str, default=None, help="the directory of the checkpoints"
+    )
+    parser.add_argument("--resume", type=str, default=None, help="the run id to resume")
+    parser.add_argument(
+        "--previous", type=str, default=None, help="the run id to re-ingest from"
+    )
+    parser.add_argument(
+        "--image-dir", type=str, default=None, help="the directory of the PDF images"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=4000, help="the characters per chunk"
+    )
+    parser.add_argument(
+        "--over-lap", type=int, default=200, help="the characters shared by chunks"
+    )
+    parser.add_argument(
+        "--token-budget", type=int, default=None, help="the estimated tokens per chunk"
+    )
+    parser.add_argument(
+        "--token-overlap",
+        type=int,
+        default=100,
+        help="the estimated tokens shared by chunks, with --token-budget",
+    )
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--gpt-worker", type=int, default=4)
+    args = parser.parse_args()
+
+    paths = collect_documents(args.source)
+    es, rs, imgs = ingest_documents(
+        paths,
+        strategy=args.strategy,
+        resume=args.resume,
+        processes=args.processes,
+        gpt_worker=args.gpt_worker,
+        previous=args.previous,
+        token_budget=args.token_budget,
+        runs_dir=args.runs_dir,
+        chunk_size=args.chunk_size,
+        over_lap=args.over_lap,
+        token_overlap=args.token_overlap,
+        image_dir=args.image_dir,
+    )
+    print(
+        f"Ingested {len(paths)} documents: {len(es)} entities, {len(rs)} relationships, {len(imgs)} images"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Content-addressed on-disk cache for LLM responses.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+log = logging.getLogger("llmgraph")
+
+
+def make_cache_key(model: str, messages: list) -> str:
+    """
+    Hash the model and the messages (including image parts) into a cache key
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of LLM responses stored as one file per entry.
+    The least recently used entries are evicted when the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name[: -len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        log.debug(
+            f"Loaded response cache from {self.cache_dir}, entries: {len(self._index)}, bytes: {self._total_bytes}"
+        )
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            log.debug(f"Evicted response cache entry {key}")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the cached response of the key, or None if it is not cached
+        """
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = json.load(f)["content"]
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                log.warning(f"Invalid response cache entry {key}, exception: {e}")
+                self._total_bytes -= self._index.pop(key)
+                self.misses += 1
+                return None
+            os.utime(path)
+            self._index.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def set(self, key: str, content: str):
+        """
+        Store the response of the key
+        """
+        data = json.dumps({"content": content}, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total_bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def invalidate(self, key: str):
+        """
+        Remove the cached response of the key
+        """
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        Remove all cached responses
+        """
+        with self._lock:
+            for key in list(self._index.keys()):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._index.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Get the hit/miss counters and the size of the cache
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+            }
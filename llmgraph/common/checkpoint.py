@@ -0,0 +1,209 @@
+"""
+Checkpoints of the ingestion pipeline, so that a failed run resumes from the completed work.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from ..dataclass import Entity, Relationship, Image
+
+log = logging.getLogger("llmgraph")
+
+
+class RunCheckpoint:
+    """
+    The checkpoints of one run, stored in the run directory `<root>/<run_id>`.
+    The results of each stage are appended to `<stage>.jsonl` one record per completed item
+    (chunk, image, merge group), so that an interrupted stage only redoes the unfinished items.
+    With `fsync`, every record is synced to disk before the item counts as completed.
+    """
+
+    def __init__(self, run_id: str = None, root: str = None, fsync: bool = False):
+        if root is None:
+            root = os.getenv("LLMGRAPH_RUN_DIR", "runs")
+        if run_id is None:
+            run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.run_id = run_id
+        self.root = root
+        self.run_dir = os.path.join(root, run_id)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(self.run_dir, exist_ok=True)
+
+    @classmethod
+    def open(
+        cls, runs_dir: str = None, resume: str = None
+    ) -> Optional["RunCheckpoint"]:
+        """
+        Open the checkpoint of a new run, or of the run `resume`, in `runs_dir` or LLMGRAPH_RUN_DIR.
+        Without either directory the run is not checkpointed and None is returned.
+        """
+        if runs_dir is None:
+            runs_dir = os.getenv("LLMGRAPH_RUN_DIR")
+        if runs_dir is None:
+            if resume:
+                raise ValueError(
+                    f"Cannot resume run {resume}: no runs_dir and LLMGRAPH_RUN_DIR is not set"
+                )
+            return None
+        if resume:
+            return cls.existing(resume, runs_dir)
+        return cls(root=runs_dir)
+
+    @classmethod
+    def existing(cls, run_id: str, root: str = None) -> "RunCheckpoint":
+        """
+        Open the checkpoints of a previous run
+        """
+        if root is None:
+            root = os.getenv("LLMGRAPH_RUN_DIR", "runs")
+        if not os.path.isdir(os.path.join(root, run_id)):
+            raise ValueError(f"Run {run_id} does not exist in {root}")
+        return cls(run_id, root)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.run_dir, name)
+
+    def check_source(
+        self,
+        source: str,
+        text: str = None,
+        digest: str = None,
+        settings: dict = None,
+    ):
+        """
+        Record the source document and the `settings` (strategy, split parameters) of the run,
+        or check that a resumed run reads the same document with the same settings.
+        The document is identified by the sha256 `digest` of its content, or of its `text`.
+        """
+        if digest is None:
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        settings = settings or {}
+        path = self._path("meta.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["sha256"] != digest:
+                raise ValueError(
+                    f"Run {self.run_id} was started on a different document: {meta['source']}"
+                )
+            if "settings" not in meta:
+                log.warning(f"Run {self.run_id} has no recorded settings to check")
+                return
+            previous = meta["settings"]
+            changed = sorted(
+                key
+                for key in set(previous) | set(settings)
+                if previous.get(key) != settings.get(key)
+            )
+            if changed:
+                raise ValueError(
+                    f"Run {self.run_id} was started with different settings: "
+                    + ", ".join(
+                        f"{key}={previous.get(key)!r}, now {settings.get(key)!r}"
+                        for key in changed
+                    )
+                )
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"source": source, "sha256": digest, "settings": settings},
+                f,
+                ensure_ascii=False,
+            )
+
+    def records(self, stage: str) -> list[dict]:
+        """
+        Get the records of the completed items of the stage
+        """
+        path = self._path(f"{stage}.jsonl")
+        if not os.path.exists(path):
+            return []
+        records = []
+        with self._lock, open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # the last line is truncated if the run was killed while writing it
+                    log.warning(f"Skip invalid checkpoint record of stage {stage}")
+        if records:
+            log.info(
+                f"Resume stage {stage} of run {self.run_id}, {len(records)} records"
+            )
+        return records
+
+    def append(self, stage: str, record: dict):
+        """
+        Append the record of a completed item of the stage
+        """
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self._path(f"{stage}.jsonl"), "a", encoding="utf-8") as f:
+            f.write(line)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load_embeddings(self) -> dict[str, np.ndarray]:
+        path = self._path("embeddings.npz")
+        if not os.path.exists(path):
+            return {}
+        with np.load(path, allow_pickle=False) as data:
+            return dict(zip(data["names"].tolist(), data["matrix"]))
+
+    def save_embeddings(self, embeddings: dict[str, np.ndarray]):
+        names = list(embeddings.keys())
+        matrix = (
+            np.stack([embeddings[name] for name in names])
+            if names
+            else np.zeros((0, 0))
+        )
+        tmp_path = self._path("embeddings.tmp.npz")
+        np.savez(tmp_path, names=np.array(names, dtype=str), matrix=matrix)
+        os.replace(tmp_path, self._path("embeddings.npz"))
+
+    def load_result(
+        self,
+    ) -> Optional[tuple[list["Entity"], list["Relationship"], list["Image"]]]:
+        """
+        Get the final result of a finished run
+        """
+        path = self._path("result.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        return (
+            [Entity.from_dict(e) for e in result["entities"]],
+            [Relationship.from_dict(r) for r in result["relationships"]],
+            [Image.from_dict(i) for i in result["images"]],
+        )
+
+    def save_result(
+        self,
+        entities: list["Entity"],
+        relationships: list["Relationship"],
+        images: list["Image"],
+        **extra,
+    ):
+        """
+        Save the final result of the run, with `extra` information such as the documents
+        """
+        result = {
+            "entities": [e.to_dict() for e in entities],
+            "relationships": [r.to_dict() for r in relationships],
+            "images": [i.to_dict() for i in images],
+            **extra,
+        }
+        tmp_path = self._path("result.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path("result.json"))
@@ -0,0 +1,102 @@
+"""
+Adaptive concurrency control of batch LLM stages.
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+from .ratelimit import RateLimiter
+
+log = logging.getLogger("llmgraph")
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the number of tasks in flight.
+    The limit grows by about one per window of `limit` successful tasks, and is multiplied by
+    `backoff` when a task fails, or when the shared rate limiter retried a request of the task:
+    429s, timeouts, connection errors and 5xx responses are retried there and never raised.
+    The latency is not a signal, the tasks of a stage vary in size; decreases happen at most once
+    per average task latency, so a burst of failures only backs off once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        backoff: float = 0.5,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._stats = {"tasks": 0, "failures": 0, "decreases": 0, "peak_limit": initial}
+
+    def _retries(self) -> int:
+        return self.rate_limiter.stats()["retries"] if self.rate_limiter else 0
+
+    def _acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def _decrease(self, now: float, reason: str):
+        window = self._latency or 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._stats["decreases"] += 1
+        log.info(f"Decrease concurrency to {int(self.limit)}, reason: {reason}")
+
+    def _release(self, latency: float, failed: bool, retried: bool):
+        with self._cond:
+            self._in_flight -= 1
+            self._stats["tasks"] += 1
+            now = time.monotonic()
+            self._latency = (
+                latency
+                if self._latency is None
+                else 0.8 * self._latency + 0.2 * latency
+            )
+            if failed or retried:
+                self._stats["failures"] += int(failed)
+                self._decrease(now, "retried" if retried else "failed")
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                self._stats["peak_limit"] = max(
+                    self._stats["peak_limit"], int(self.limit)
+                )
+            self._cond.notify_all()
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run the task once the number of tasks in flight is below the limit
+        """
+        self._acquire()
+        retries = self._retries()
+        start = time.perf_counter()
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(
+                time.perf_counter() - start, failed, self._retries() > retries
+            )
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._stats, limit=int(self.limit))
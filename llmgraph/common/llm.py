@@ -1,35 +1,368 @@
 import os
-from typing import Callable, Any
-from openai import OpenAI
+import time
+import asyncio
+import logging
+import weakref
+from typing import Callable, Any, Optional
+import numpy as np
+import openai
+from openai import OpenAI, AsyncOpenAI
 
+from .cache import ResponseCache, make_cache_key
+from .usage import UsageTracker
+from .ratelimit import RateLimiter, default_rate_limiter, estimate_message_tokens
+from .tools import estimate_tokens
+
+log = logging.getLogger("llmgraph")
+
+
+def _rejects_stream_options(error: openai.BadRequestError) -> bool:
+    return "stream_options" in str(error)
+
+
+def _start_attempt(callback: Callable[[str], Any], attempts: int):
+    if attempts == 1:
+        if hasattr(callback, "mark"):
+            callback.mark()
+    elif hasattr(callback, "reset"):
+        callback.reset()
+
+
+def _read_chunk(chunk, callback: Callable[[str], Any], parts: list[str]):
+    """
+    Pass the content of a stream chunk to the callback and collect it, returns the usage of the chunk
+    """
+    if chunk.choices and chunk.choices[0].delta.content is not None:
+        if callback:
+            callback(chunk.choices[0].delta.content)
+        parts.append(chunk.choices[0].delta.content)
+    return chunk.usage
+
+
+class _ChatClient:
+    """
+    The configuration and the chat bookkeeping shared by `LLM` and `AsyncLLM`
+    """
 
-class LLM:
     def __init__(
         self,
         api_key: str = None,
         base_url: str = None,
+        cache: Optional[ResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        stream_usage: bool = True,
     ):
         self.api_key = api_key if api_key else os.getenv("OPENAI_API_KEY")
         self.base_url = base_url if base_url else os.getenv("OPENAI_BASE_URL")
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        if cache is None and os.getenv("LLMGRAPH_CACHE_DIR"):
+            cache = ResponseCache(os.getenv("LLMGRAPH_CACHE_DIR"))
+        self.cache = cache
+        self.usage = UsageTracker()
+        self.stream_usage = stream_usage
+        self.rate_limiter = (
+            rate_limiter
+            if rate_limiter
+            else default_rate_limiter(self.base_url, self.api_key)
+        )
+
+    def _stream_options_rejected(self, error: openai.BadRequestError) -> bool:
+        """
+        Turn `stream_usage` off if the server rejected `stream_options`
+        """
+        if not _rejects_stream_options(error):
+            return False
+        log.warning(f"stream_options rejected, token usage is not accounted: {error}")
+        self.stream_usage = False
+        return True
+
+    def _cache_key(self, model: str, messages: list, use_cache: bool) -> Optional[str]:
+        if self.cache is None or not use_cache:
+            return None
+        return make_cache_key(model, messages)
+
+    def _cached_response(
+        self,
+        key: Optional[str],
+        callback: Callable[[str], Any],
+        refresh: bool,
+        tag: str,
+    ) -> Optional[str]:
+        """
+        The cached response of the chat, passed to the callback, or None if it is to be requested
+        """
+        if key is None:
+            return None
+        if refresh:
+            self.cache.invalidate(key)
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            if callback:
+                callback(cached)
+            self.usage.record(tag, 0.0, cached=True)
+        return cached
+
+    def _record_chat(self, tag: str, start: float, estimated: int, usage: Any):
+        """
+        Account the usage of a requested chat, and correct the token estimate of the rate limiter
+        """
+        self.usage.record(
+            tag,
+            time.perf_counter() - start,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+        if usage:
+            self.rate_limiter.adjust(usage.prompt_tokens - estimated)
+
+
+class LLM(_ChatClient):
+    """
+    Streaming chat and embedding client. With `stream_usage`, the token usage of the chat
+    responses is requested with `stream_options` and accounted in `self.usage`; it is turned
+    off if the server rejects `stream_options`.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        cache: Optional[ResponseCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        stream_usage: bool = True,
+    ):
+        super().__init__(api_key, base_url, cache, rate_limiter, stream_usage)
+        # retries are done by the rate limiter, so that 429s slow down every client sharing it
+        self.client = OpenAI(
+            api_key=self.api_key, base_url=self.base_url, max_retries=0
+        )
+
+    def _create_stream(self, model: str, messages: list):
+        if self.stream_usage:
+            try:
+                return self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+            except openai.BadRequestError as e:
+                if not self._stream_options_rejected(e):
+                    raise
+        return self.client.chat.completions.create(
+            model=model, messages=messages, stream=True
+        )
 
     def chat(
-        self, messages: list, callback: Callable[[str], Any], model: str = "gpt-4o-mini"
+        self,
+        messages: list,
+        callback: Callable[[str], Any],
+        model: str = "gpt-4o-mini",
+        use_cache: bool = True,
+        refresh: bool = False,
+        tag: str = "chat",
     ) -> str:
-        stream = self.client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-        )
-        content = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                if callback:
-                    callback(chunk.choices[0].delta.content)
-                content += chunk.choices[0].delta.content
+        """
+        Chat with the model. If a response cache is configured, `use_cache=False` bypasses it
+        and `refresh=True` ignores the cached response and overwrites it.
+        Tokens and latency are accounted under `tag` in `self.usage`.
+        A request failing mid-stream is sent again. If they exist, `callback.mark()` is called before
+        the response is streamed and `callback.reset()` before it is streamed again.
+        """
+        key = self._cache_key(model, messages, use_cache)
+        cached = self._cached_response(key, callback, refresh, tag)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        estimated = estimate_message_tokens(messages)
+        attempts = 0
+
+        def request() -> tuple[str, Any]:
+            nonlocal attempts
+            attempts += 1
+            _start_attempt(callback, attempts)
+            parts: list[str] = []
+            usage = None
+            for chunk in self._create_stream(model, messages):
+                usage = _read_chunk(chunk, callback, parts) or usage
+            return "".join(parts), usage
 
+        content, usage = self.rate_limiter.call(request, estimated)
+        self._record_chat(tag, start, estimated, usage)
+        if key is not None and content:
+            self.cache.set(key, content)
         return content
 
     def embed(self, text: str, model: str = "text-embedding-ada-002") -> str:
-        emb = self.client.embeddings.create(model=model, input=[text])
+        start = time.perf_counter()
+        emb = self.rate_limiter.call(
+            lambda: self.client.embeddings.create(model=model, input=[text]),
+            estimate_tokens(text),
+        )
+        self.usage.record("embed", time.perf_counter() - start, emb.usage.prompt_tokens)
+        return emb.data[0].embedding
+
+    def embed_many(
+        self,
+        texts: list[str],
+        model: str = "text-embedding-ada-002",
+        batch_size: int = 512,
+    ) -> np.ndarray:
+        """
+        Embed the texts with multi-input requests of at most `batch_size` inputs.
+        Returns a matrix whose i-th row is the embedding of texts[i].
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        rows: list[list[float]] = []
+        for i in range(0, len(texts), batch_size):
+            start = time.perf_counter()
+            batch = texts[i : i + batch_size]
+            emb = self.rate_limiter.call(
+                lambda batch=batch: self.client.embeddings.create(
+                    model=model, input=batch
+                ),
+                sum(estimate_tokens(text) for text in batch),
+            )
+            self.usage.record(
+                "embed", time.perf_counter() - start, emb.usage.prompt_tokens
+            )
+            rows.extend(d.embedding for d in sorted(emb.data, key=lambda d: d.index))
+        return np.array(rows, dtype=np.float32).reshape(len(texts), -1)
+
+
+class AsyncLLM(_ChatClient):
+    """
+    Asyncio-native client. The requests of an instance on the same event loop share one
+    semaphore, so each loop can keep up to `max_concurrency` requests in flight.
+    See `LLM` for `stream_usage`.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        cache: Optional[ResponseCache] = None,
+        max_concurrency: int = 64,
+        rate_limiter: Optional[RateLimiter] = None,
+        stream_usage: bool = True,
+    ):
+        super().__init__(api_key, base_url, cache, rate_limiter, stream_usage)
+        # retries are done by the rate limiter, so that 429s slow down every client sharing it
+        self.client = AsyncOpenAI(
+            api_key=self.api_key, base_url=self.base_url, max_retries=0
+        )
+        self.max_concurrency = max_concurrency
+        # a semaphore is bound to the loop it first waits on, so each loop gets its own
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """
+        The semaphore of the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def _create_stream(self, model: str, messages: list):
+        if self.stream_usage:
+            try:
+                return await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+            except openai.BadRequestError as e:
+                if not self._stream_options_rejected(e):
+                    raise
+        return await self.client.chat.completions.create(
+            model=model, messages=messages, stream=True
+        )
+
+    async def chat(
+        self,
+        messages: list,
+        callback: Callable[[str], Any],
+        model: str = "gpt-4o-mini",
+        use_cache: bool = True,
+        refresh: bool = False,
+        tag: str = "chat",
+    ) -> str:
+        """
+        Chat with the model, see `LLM.chat`
+        """
+        key = self._cache_key(model, messages, use_cache)
+        cached = self._cached_response(key, callback, refresh, tag)
+        if cached is not None:
+            return cached
+
+        async with self.semaphore:
+            start = time.perf_counter()
+            estimated = estimate_message_tokens(messages)
+            attempts = 0
+
+            async def request() -> tuple[str, Any]:
+                nonlocal attempts
+                attempts += 1
+                _start_attempt(callback, attempts)
+                parts: list[str] = []
+                usage = None
+                async for chunk in await self._create_stream(model, messages):
+                    usage = _read_chunk(chunk, callback, parts) or usage
+                return "".join(parts), usage
+
+            content, usage = await self.rate_limiter.async_call(request, estimated)
+            self._record_chat(tag, start, estimated, usage)
+
+        if key is not None and content:
+            self.cache.set(key, content)
+        return content
+
+    async def embed(self, text: str, model: str = "text-embedding-ada-002") -> str:
+        async with self.semaphore:
+            start = time.perf_counter()
+            emb = await self.rate_limiter.async_call(
+                lambda: self.client.embeddings.create(model=model, input=[text]),
+                estimate_tokens(text),
+            )
+            self.usage.record(
+                "embed", time.perf_counter() - start, emb.usage.prompt_tokens
+            )
         return emb.data[0].embedding
+
+    async def embed_many(
+        self,
+        texts: list[str],
+        model: str = "text-embedding-ada-002",
+        batch_size: int = 512,
+    ) -> np.ndarray:
+        """
+        Embed the texts with concurrent multi-input requests, see `LLM.embed_many`
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        async def embed_batch(batch: list[str]) -> list[list[float]]:
+            async with self.semaphore:
+                start = time.perf_counter()
+                emb = await self.rate_limiter.async_call(
+                    lambda: self.client.embeddings.create(model=model, input=batch),
+                    sum(estimate_tokens(text) for text in batch),
+                )
+                self.usage.record(
+                    "embed", time.perf_counter() - start, emb.usage.prompt_tokens
+                )
+            return [d.embedding for d in sorted(emb.data, key=lambda d: d.index)]
+
+        batches = await asyncio.gather(
+            *[
+                embed_batch(texts[i : i + batch_size])
+                for i in range(0, len(texts), batch_size)
+            ]
+        )
+        rows = [row for batch in batches for row in batch]
+        return np.array(rows, dtype=np.float32).reshape(len(texts), -1)
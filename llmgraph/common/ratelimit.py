@@ -0,0 +1,222 @@
+"""
+Process-wide rate limiting of LLM requests.
+Requests and estimated prompt tokens per minute are limited by token buckets, requests
+rejected with 429 are retried with exponential backoff and pause every caller of the limiter.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import openai
+
+from .tools import estimate_tokens
+
+log = logging.getLogger("llmgraph")
+
+IMAGE_TOKENS = 765
+"""The estimated prompt tokens of an image part"""
+
+
+def estimate_message_tokens(messages: list) -> int:
+    """
+    Estimate the prompt tokens of chat messages, including text and image parts
+    """
+    tokens = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += estimate_tokens(content) + 4
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += estimate_tokens(part.get("text", ""))
+        tokens += 4
+    return tokens
+
+
+class TokenBucket:
+    """
+    A bucket of `capacity` units refilled continuously over one minute.
+    Callers reserve units up front, the balance may go negative and later callers wait for it.
+    """
+
+    def __init__(self, capacity: float, now: Optional[float] = None):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.balance = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Reserve the amount and return the seconds to wait before using it
+        """
+        self.balance = min(
+            self.capacity, self.balance + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        self.balance -= min(amount, self.capacity)
+        return max(0.0, -self.balance / self.rate)
+
+
+class RateLimiter:
+    """
+    Limit the requests per minute (`rpm`) and the prompt tokens per minute (`tpm`) of all
+    LLM clients sharing this limiter. A limit of None means unlimited.
+    `clock` and `sleep` default to `time.monotonic` and `time.sleep`.
+    """
+
+    RETRY_ERRORS = (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        # a connection dropped while a response is streamed
+        httpx.TransportError,
+    )
+
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Any] = time.sleep,
+    ):
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = TokenBucket(rpm, clock()) if rpm else None
+        self.tokens = TokenBucket(tpm, clock()) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._stats = {
+            "requests": 0,
+            "estimated_tokens": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "throttled": 0,
+            "retries": 0,
+        }
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = self.clock()
+            wait = max(0.0, self._paused_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            self._stats["requests"] += 1
+            self._stats["estimated_tokens"] += tokens
+            if wait > 0:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += wait
+            return wait
+
+    def adjust(self, tokens: int):
+        """
+        Consume (or give back) tokens once the actual usage of a request is known
+        """
+        if self.tokens is None or tokens == 0:
+            return
+        with self._lock:
+            self.tokens.balance -= tokens
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        delay *= 0.5 + random.random() / 2
+        if isinstance(error, openai.RateLimitError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+            with self._lock:
+                self._stats["throttled"] += 1
+                # pause every caller, not only the throttled one
+                self._paused_until = max(self._paused_until, self.clock() + delay)
+        with self._lock:
+            self._stats["retries"] += 1
+        return delay
+
+    def call(self, request: Callable[[], Any], tokens: int = 0) -> Any:
+        """
+        Wait for the rate limits and send the request, retrying with backoff on 429 and transient errors.
+        A streamed response should be read inside `request`, so that an error mid-stream retries it.
+        """
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait > 0:
+                self.sleep(wait)
+            try:
+                return request()
+            except self.RETRY_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                log.warning(
+                    f"LLM request failed: {e}, retry {attempt + 1} in {delay:.1f}s"
+                )
+                self.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def async_call(
+        self, request: Callable[[], Awaitable[Any]], tokens: int = 0
+    ) -> Any:
+        """
+        Async variant of `call`
+        """
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await request()
+            except self.RETRY_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                log.warning(
+                    f"LLM request failed: {e}, retry {attempt + 1} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+_default_limiters: dict[tuple[Optional[str], Optional[str]], RateLimiter] = {}
+_default_limiter_lock = threading.Lock()
+
+
+def default_rate_limiter(
+    base_url: Optional[str] = None, api_key: Optional[str] = None
+) -> RateLimiter:
+    """
+    The limiter shared by the clients of the process with the same base URL and API key,
+    configured by LLMGRAPH_RPM and LLMGRAPH_TPM
+    """
+    with _default_limiter_lock:
+        limiter = _default_limiters.get((base_url, api_key))
+        if limiter is None:
+            rpm = os.getenv("LLMGRAPH_RPM")
+            tpm = os.getenv("LLMGRAPH_TPM")
+            limiter = RateLimiter(
+                rpm=int(rpm) if rpm else None, tpm=int(tpm) if tpm else None
+            )
+            _default_limiters[(base_url, api_key)] = limiter
+        return limiter
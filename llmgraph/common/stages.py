@@ -0,0 +1,54 @@
+"""
+Run the stages of a pipeline as a dependency graph.
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable
+
+log = logging.getLogger("llmgraph")
+
+
+def _run_stage(name: str, fn: Callable[..., Any], inputs: dict[str, Any]) -> Any:
+    start = time.perf_counter()
+    result = fn(**inputs)
+    log.info(f"Finished stage {name} in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def run_stages(
+    stages: dict[str, tuple[Callable[..., Any], list[str]]],
+) -> dict[str, Any]:
+    """
+    Run the stages `name: (fn, dependencies)` and get the result of each stage.
+    A stage starts as soon as its dependencies finish and is called with their results as keyword
+    arguments, so independent stages run concurrently and the latency is that of the longest path.
+    """
+    for name, (_, deps) in stages.items():
+        unknown = [d for d in deps if d not in stages]
+        if unknown:
+            raise ValueError(f"Unknown dependencies of stage {name}: {unknown}")
+
+    pending = dict(stages)
+    results: dict[str, Any] = {}
+    with ThreadPoolExecutor(
+        max_workers=max(len(stages), 1), thread_name_prefix="stage"
+    ) as executor:
+        running = {}
+        while pending or running:
+            ready = [
+                name
+                for name, (_, deps) in pending.items()
+                if all(d in results for d in deps)
+            ]
+            for name in ready:
+                fn, deps = pending.pop(name)
+                inputs = {d: results[d] for d in deps}
+                running[executor.submit(_run_stage, name, fn, inputs)] = name
+            if not running:
+                raise ValueError(f"Cyclic dependencies of stages: {list(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
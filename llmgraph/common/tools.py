@@ -1,12 +1,21 @@
 import base64
+import hashlib
 import os
 from functools import lru_cache
 
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "examples",
+)
+
 
 @lru_cache
-def encode_image(image_path: str) -> str:
-    parent_path = os.path.abspath(os.path.join(os.environ.get("PYTHONPATH"), os.pardir))
-    image_path = parent_path + "/examples/" + image_path
+def encode_image(image_path: str, image_dir: str = None) -> str:
+    """
+    Encode an image as a data URL, a relative path is relative to `image_dir`,
+    by default the examples directory
+    """
+    image_path = os.path.join(image_dir or EXAMPLES_DIR, image_path)
     with open(image_path, "rb") as image_file:
         image_data = image_file.read()
 
@@ -16,6 +25,17 @@ def encode_image(image_path: str) -> str:
     return image_url
 
 
+def file_digest(path: str) -> str:
+    """
+    Get the sha256 of a file, read in blocks
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
 def shorten_string(text: str, head_length: int, tail_length: int) -> str:
     """
     Shorten the string by keeping the head and tail of the string
@@ -60,3 +80,12 @@ def merge_nearby_text(text: list[str]) -> str:
         merged_text += current_text[len(overlap) :]
 
     return merged_text
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of the text without a tokenizer:
+    about 4 ASCII characters per token, one token per other character (e.g. CJK)
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
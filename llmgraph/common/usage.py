@@ -0,0 +1,61 @@
+"""
+Token and latency accounting of LLM calls.
+"""
+
+import threading
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    """The number of calls, including the cached ones"""
+
+    cached_calls: int = 0
+    """The number of calls answered by the response cache"""
+
+    prompt_tokens: int = 0
+    """The prompt tokens reported by the API"""
+
+    completion_tokens: int = 0
+    """The completion tokens reported by the API"""
+
+    latency: float = 0.0
+    """The total latency of the calls in seconds"""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class UsageTracker:
+    """
+    Thread-safe usage counters of LLM calls, grouped by a tag such as the extraction strategy
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: dict[str, Usage] = {}
+
+    def record(
+        self,
+        tag: str,
+        latency: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached: bool = False,
+    ):
+        with self._lock:
+            usage = self._usage.setdefault(tag, Usage())
+            usage.calls += 1
+            usage.cached_calls += int(cached)
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+            usage.latency += latency
+
+    def get(self, tag: str) -> Usage:
+        with self._lock:
+            return Usage(**asdict(self._usage.get(tag, Usage())))
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            return {tag: usage.to_dict() for tag, usage in self._usage.items()}
@@ -2,6 +2,7 @@
 This module contains the Chunk dataclass.
 """
 
+import hashlib
 from dataclasses import dataclass
 
 
@@ -16,15 +17,29 @@ class Chunk:
     length: int
     """The length of the chunk"""
 
+    hash: str = ""
+    """The hash of the text, stable across splits of edited documents"""
+
+    def __post_init__(self):
+        if not self.hash:
+            self.hash = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
+
     @classmethod
     def from_dict(cls, d: dict) -> "Chunk":
         """
         Creates a chunk from a dictionary.
         """
-        return Chunk(id=d["id"], text=d["text"], length=d["length"])
+        return Chunk(
+            id=d["id"], text=d["text"], length=d["length"], hash=d.get("hash", "")
+        )
 
     def to_dict(self) -> dict:
         """
         Converts the chunk to a dictionary.
         """
-        return {"id": self.id, "text": self.text, "length": self.length}
+        return {
+            "id": self.id,
+            "text": self.text,
+            "length": self.length,
+            "hash": self.hash,
+        }
@@ -3,3 +3,4 @@ Process Text To ER
 """
 
 from .extract import pipeline
+from .ingest import ingest_documents, collect_documents
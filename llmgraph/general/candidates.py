@@ -0,0 +1,119 @@
+"""
+Candidate generators for entity deduplication.
+A candidate generator takes the embedding matrix and a similarity threshold and yields
+(i, j, similarity) for the pairs i < j that should be connected in the similarity graph.
+"""
+
+import logging
+from typing import Iterator
+
+import numpy as np
+
+log = logging.getLogger("llmgraph")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scale every row of the matrix to unit length, zero rows are left as they are
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similar_pairs(
+    matrix: np.ndarray, threshold: float = 0.9, block_size: int = 1024
+) -> Iterator[tuple[int, int, float]]:
+    """
+    Yield (i, j, similarity) for every pair i < j whose cosine similarity exceeds the threshold.
+    The similarity matrix is computed block by block, so memory is bounded by block_size * n.
+    """
+    normed = normalize_rows(np.asarray(matrix, dtype=np.float32))
+    n = normed.shape[0]
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        sims = normed[start:end] @ normed[start:].T
+        # keep only the upper triangle, j > i
+        sims[np.tril_indices(end - start, m=n - start)] = -np.inf
+        rows, cols = np.nonzero(sims > threshold)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            yield start + r, start + c, float(sims[r, c])
+
+
+class RandomProjectionLSH:
+    """
+    Approximate candidate generator using random-projection (SimHash) LSH.
+    Rows are hashed by the signs of `num_bits` random projections in each of `num_tables` tables;
+    only rows sharing a bucket are compared exactly. For every row, at most `top_k` neighbours
+    above the threshold are kept.
+    More tables raise the recall, more bits shrink the buckets and the work per table.
+    """
+
+    def __init__(
+        self,
+        num_tables: int = 16,
+        num_bits: int = 12,
+        top_k: int = 10,
+        seed: int = 0,
+    ):
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.top_k = top_k
+        self.seed = seed
+
+    def _bucket_pairs(
+        self, normed: np.ndarray, threshold: float, found: dict[tuple[int, int], float]
+    ):
+        rng = np.random.default_rng(self.seed)
+        weights = 1 << np.arange(self.num_bits, dtype=np.int64)
+        for _ in range(self.num_tables):
+            planes = rng.standard_normal((normed.shape[1], self.num_bits)).astype(
+                np.float32
+            )
+            codes = ((normed @ planes) > 0).astype(np.int64) @ weights
+            order = np.argsort(codes, kind="stable")
+            _, starts, counts = np.unique(
+                codes[order], return_index=True, return_counts=True
+            )
+            shared = counts > 1
+            for start, count in zip(starts[shared].tolist(), counts[shared].tolist()):
+                idx = order[start : start + count]
+                for a, b, sim in similar_pairs(normed[idx], threshold):
+                    i, j = sorted((int(idx[a]), int(idx[b])))
+                    found[(i, j)] = sim
+
+    def __call__(
+        self, matrix: np.ndarray, threshold: float = 0.9
+    ) -> Iterator[tuple[int, int, float]]:
+        normed = normalize_rows(np.asarray(matrix, dtype=np.float32))
+        found: dict[tuple[int, int], float] = {}
+        self._bucket_pairs(normed, threshold, found)
+
+        neighbours: dict[int, list[tuple[float, int]]] = {}
+        for (i, j), sim in found.items():
+            neighbours.setdefault(i, []).append((sim, j))
+            neighbours.setdefault(j, []).append((sim, i))
+        kept: set[tuple[int, int]] = set()
+        for i, ns in neighbours.items():
+            for _, j in sorted(ns, reverse=True)[: self.top_k]:
+                kept.add((min(i, j), max(i, j)))
+        log.debug(
+            f"LSH candidates: rows {normed.shape[0]}, pairs found {len(found)}, kept {len(kept)}"
+        )
+        for i, j in sorted(kept):
+            yield i, j, found[(i, j)]
+
+
+def recall_against_exact(
+    matrix: np.ndarray,
+    candidates,
+    threshold: float = 0.9,
+) -> float:
+    """
+    The fraction of the exact pairs above the threshold that the candidate generator finds
+    """
+    exact = {(i, j) for i, j, _ in similar_pairs(matrix, threshold)}
+    if not exact:
+        return 1.0
+    approx = {(i, j) for i, j, _ in candidates(matrix, threshold)}
+    return len(exact & approx) / len(exact)
@@ -0,0 +1,186 @@
+"""
+Incremental store of entities and relationships.
+Chunk results are ingested as they arrive instead of being accumulated into lists and merged in bulk.
+Entity names are resolved case-insensitively through a union-find over aliases.
+"""
+
+import copy
+import logging
+from typing import Union
+
+from ..dataclass import Entity, Relationship
+from ..common.tools import remove_duplicates
+
+log = logging.getLogger("llmgraph")
+
+
+def _own_copy(item: Union["Entity", "Relationship"]) -> Union["Entity", "Relationship"]:
+    """
+    Copy an entity or relationship with its own lists and properties, the store merges into them
+    """
+    item = copy.copy(item)
+    item.references = list(item.references)
+    item.properties = dict(item.properties)
+    item.images = list(item.images)
+    item.chunks = list(item.chunks)
+    return item
+
+
+class EntityStore:
+    """
+    Entities are keyed by (canonical name, label) and relationships by (start, type, end),
+    all upper-cased. References, images and chunks are merged incrementally.
+    The store keeps copies, the entities and relationships added are never modified.
+    """
+
+    def __init__(self):
+        self._parent: dict[str, str] = {}
+        self._display: dict[str, str] = {}  # root -> display name of the entity
+        self._entities: dict[tuple, "Entity"] = {}
+        self._entity_keys: dict[str, list[tuple]] = {}  # root -> entity keys
+        self._relationships: dict[tuple, "Relationship"] = {}
+        self._rel_keys: dict[str, set[tuple]] = {}  # root -> relationship keys
+        self._seen: dict[tuple, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def find(self, name: str) -> str:
+        """
+        Get the canonical key of an entity name
+        """
+        node = name.upper()
+        root = node
+        while self._parent.get(root, root) != root:
+            root = self._parent[root]
+        while node != root:
+            self._parent[node], node = root, self._parent[node]
+        return root
+
+    def _merge_items(self, key: tuple, target, field_name: str, items: list):
+        seen_key = (key, field_name)
+        if seen_key not in self._seen:
+            setattr(target, field_name, remove_duplicates(getattr(target, field_name)))
+            self._seen[seen_key] = set(getattr(target, field_name))
+        seen_items = self._seen[seen_key]
+        merged = getattr(target, field_name)
+        for item in items:
+            if item not in seen_items:
+                seen_items.add(item)
+                merged.append(item)
+
+    def _merge_fields(self, key: tuple, target, source):
+        target.properties.update(source.properties)
+        for field_name in ("references", "images", "chunks"):
+            self._merge_items(key, target, field_name, getattr(source, field_name))
+
+    def _put_entity(self, root: str, entity: "Entity"):
+        key = (root, entity.label.upper())
+        if key in self._entities:
+            self._merge_fields(key, self._entities[key], entity)
+            return
+        if root in self._display:
+            entity.name = self._display[root]
+        else:
+            self._display[root] = entity.name
+        self._entities[key] = entity
+        self._entity_keys.setdefault(root, []).append(key)
+
+    def _rel_key(self, r: "Relationship") -> tuple:
+        return (self.find(r.start), r.type.upper(), self.find(r.end))
+
+    def _put_relationship(self, r: "Relationship"):
+        key = self._rel_key(r)
+        if key in self._relationships:
+            self._merge_fields(key, self._relationships[key], r)
+            return
+        self._relationships[key] = r
+        self._rel_keys.setdefault(key[0], set()).add(key)
+        self._rel_keys.setdefault(key[2], set()).add(key)
+
+    def add_entity(self, entity: "Entity"):
+        self._put_entity(self.find(entity.name), _own_copy(entity))
+
+    def add_relationship(self, relationship: "Relationship"):
+        self._put_relationship(_own_copy(relationship))
+
+    def add_image(self, name: str, path: str) -> bool:
+        """
+        Associate an image with the entities named `name`, False if there is no such entity
+        """
+        keys = self._entity_keys.get(self.find(name))
+        if not keys:
+            return False
+        for key in keys:
+            self._merge_items(key, self._entities[key], "images", [path])
+        return True
+
+    def add(self, es: list["Entity"], rs: list["Relationship"]):
+        """
+        Ingest the entities and relationships extracted from one chunk or image
+        """
+        for e in es:
+            self.add_entity(e)
+        for r in rs:
+            self.add_relationship(r)
+
+    def union(self, alias: str, canonical: str):
+        """
+        Merge the entity named `alias` into the entity named `canonical`
+        """
+        ra, rc = self.find(alias), self.find(canonical)
+        if ra == rc:
+            return
+        self._parent[ra] = rc
+        self._display.setdefault(rc, canonical)
+        self._display.pop(ra, None)
+        log.debug(f"Union entity {alias} into {canonical}")
+
+        for key in self._entity_keys.pop(ra, []):
+            for field_name in ("references", "images", "chunks"):
+                self._seen.pop((key, field_name), None)
+            self._put_entity(rc, self._entities.pop(key))
+
+        for key in self._rel_keys.pop(ra, set()):
+            if key not in self._relationships:
+                continue
+            r = self._relationships.pop(key)
+            for name in (key[0], key[2]):
+                self._rel_keys.get(name, set()).discard(key)
+            for field_name in ("references", "images", "chunks"):
+                self._seen.pop((key, field_name), None)
+            self._put_relationship(r)
+
+    def get(self, name: str) -> list["Entity"]:
+        """
+        Get the entities named `name` or one of its aliases, one per label
+        """
+        return [
+            self._entities[key] for key in self._entity_keys.get(self.find(name), [])
+        ]
+
+    def entities(self) -> list["Entity"]:
+        return list(self._entities.values())
+
+    def relationships(self) -> list["Relationship"]:
+        """
+        Get the relationships whose endpoints are existing entities, with canonical endpoint names
+        """
+        result: list["Relationship"] = []
+        for (start, _, end), r in self._relationships.items():
+            if start not in self._entity_keys or end not in self._entity_keys:
+                log.warning(
+                    "Invalid relationship, start or end not in existing entities: "
+                    "(start, type, end) = %s",
+                    (r.start, r.type, r.end),
+                )
+                continue
+            if r.start != self._display[start] or r.end != self._display[end]:
+                r = copy.copy(r)
+                r.start = self._display[start]
+                r.end = self._display[end]
+            result.append(r)
+        return result
+
+    def to_er(self) -> tuple[list["Entity"], list["Relationship"]]:
+        return self.entities(), self.relationships()
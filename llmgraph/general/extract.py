@@ -10,10 +10,19 @@ Extract entities and relationships from text
 8. merge entities and relationships from text and images
 """
 
+import os
+import re
+import copy
+import asyncio
 import logging
+import threading
 import concurrent.futures
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO, Union
 from functools import partial
-from langchain_text_splitters import MarkdownTextSplitter
+from langchain_text_splitters import (
+    MarkdownTextSplitter,
+    RecursiveCharacterTextSplitter,
+)
 
 from ..dataclass import Chunk, Entity, Relationship, Image
 from ..multimodal import (
@@ -22,27 +31,145 @@ from ..multimodal import (
     batch_extract_image_attri,
     batch_extract_er_from_images,
 )
-from ..common.llm import LLM
+from ..common.llm import LLM, AsyncLLM
+from ..common.concurrency import AdaptiveConcurrency
+from ..common.checkpoint import RunCheckpoint
+from ..common.stages import run_stages
+from ..common.tools import estimate_tokens, file_digest
 from .prompts import (
     EXTRACT_ENTITY_REL_P,
     CONTINUE_EXTRACT_P,
     IF_COTINUE_P,
 )
-from .parse_text_er import parse_rawtext_to_er, merge_er, extract_acronym
-from .merge_er import merge_er_by_llm
+from .parse_text_er import (
+    parse_rawtext_to_er,
+    extract_acronym,
+    StreamingERParser,
+)
+from .merge_er import merge_store_by_llm
+from .entity_store import EntityStore
 
 log = logging.getLogger("llmgraph")
 
+# image references on one line, so that a document read line by line protects the same references
+_IMAGE_REF_RE = re.compile(r"!\[[^\]\n]*\]\([^)\n]*\)")
+_IMAGE_PLACEHOLDER_RE = re.compile("\ue000(\\d+)\ue001")
+_HEADING_RE = re.compile(r"#{1,6} [^\n]*")
+# markdown boundaries, then sentence ends (CJK text has no spaces), then words, then characters
+# but not inside an image placeholder (nor a number), whose characters are measured as one reference
+_TOKEN_SPLIT_SEPARATORS = [
+    r"\n#{1,6} ",
+    r"```\n",
+    r"\n\*\*\*+\n",
+    r"\n---+\n",
+    r"\n___+\n",
+    r"\n\n",
+    r"\n",
+    r"(?<=[。！？；.!?;] )|(?<=[。！？；])",
+    r" ",
+    r"(?<!\ue000)(?!\ue001)(?:(?<!\d)|(?!\d))",
+]
+
+
+class _ImageRefs:
+    """
+    Replace the image references by placeholders while splitting, so they are never cut
+    """
+
+    def __init__(self):
+        self.refs: list[str] = []
+
+    def _placeholder(self, match: re.Match) -> str:
+        self.refs.append(match.group(0))
+        return f"\ue000{len(self.refs) - 1}\ue001"
+
+    def protect(self, text: str) -> str:
+        return _IMAGE_REF_RE.sub(self._placeholder, text)
+
+    def restore(self, s: str) -> str:
+        if "\ue000" not in s:
+            return s
+        return _IMAGE_PLACEHOLDER_RE.sub(lambda m: self.refs[int(m.group(1))], s)
+
+
+def _make_splitter(
+    chunk_size: int,
+    over_lap: int,
+    token_budget: Optional[int],
+    token_overlap: int,
+    refs: Optional[_ImageRefs],
+) -> RecursiveCharacterTextSplitter:
+    if token_budget is None:
+        return MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=over_lap)
+    return RecursiveCharacterTextSplitter(
+        separators=_TOKEN_SPLIT_SEPARATORS,
+        is_separator_regex=True,
+        chunk_size=token_budget,
+        chunk_overlap=token_overlap,
+        length_function=lambda s: estimate_tokens(refs.restore(s)),
+    )
+
+
+def _glue_headings(chunks: Iterable[str], token_budget: int) -> Iterator[str]:
+    """
+    Keep a heading split off alone with the text following it. The tokens of the heading are
+    reserved first: a chunk that does not fit in the rest of the budget is split again to fit.
+    """
+    heading = ""
+    for chunk in chunks:
+        if _HEADING_RE.fullmatch(chunk.strip()):
+            heading += chunk.strip() + "\n\n"
+            continue
+        if heading and estimate_tokens(heading + chunk) > token_budget:
+            rest_budget = token_budget - estimate_tokens(heading)
+            if rest_budget > 0:
+                first, *rest = _split_protected(chunk, rest_budget, 0)
+                yield heading + first
+                yield from _glue_headings(rest, token_budget)
+            else:
+                yield heading.strip()
+                yield chunk
+        else:
+            yield heading + chunk
+        heading = ""
+    if heading:
+        yield heading.strip()
+
+
+def _split_protected(text: str, token_budget: int, token_overlap: int) -> list[str]:
+    """
+    Split the text into chunks of at most `token_budget` estimated tokens, the image references
+    are replaced by placeholders while splitting so they are never cut
+    """
+    refs = _ImageRefs()
+    splitter = _make_splitter(0, 0, token_budget, token_overlap, refs)
+    return [refs.restore(chunk) for chunk in splitter.split_text(refs.protect(text))]
+
+
+def _split_by_tokens(text: str, token_budget: int, token_overlap: int) -> list[str]:
+    """
+    Split the text at markdown boundaries, then at sentence ends, into chunks of at most
+    `token_budget` estimated tokens. The image references are never cut, and a heading is kept
+    with the text following it.
+    """
+    chunks = _split_protected(text, token_budget, token_overlap)
+    return list(_glue_headings(chunks, token_budget))
+
 
 def split_document(
-    text: str, chunk_size: int = 4000, over_lap: int = 200
+    text: str,
+    chunk_size: int = 4000,
+    over_lap: int = 200,
+    token_budget: int = None,
+    token_overlap: int = 100,
 ) -> list["Chunk"]:
     """
-    Split the text into chunks
+    Split the text into chunks of at most `chunk_size` characters.
+    With `token_budget`, the chunks are filled up to `token_budget` estimated prompt tokens instead,
+    so that the chunks of CJK and English documents cost about the same.
     """
     result_chunk: list["Chunk"] = []
-    splitter = MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=over_lap)
-    chunks = splitter.split_text(text)
+    chunks = _split_text(text, chunk_size, over_lap, token_budget, token_overlap)
     for i, chunk in enumerate(chunks):
         c = Chunk(id=i, text=chunk, length=len(chunk))
         result_chunk.append(c)
@@ -50,28 +177,199 @@ def split_document(
     return result_chunk
 
 
-def extract_acronym_extities(
-    text: str, llm: LLM
-) -> tuple[list["Entity"], list["Relationship"]]:
+def _split_text(
+    text: str,
+    chunk_size: int,
+    over_lap: int,
+    token_budget: Optional[int],
+    token_overlap: int,
+) -> list[str]:
+    if token_budget is None:
+        splitter = MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=over_lap)
+        return splitter.split_text(text)
+    return _split_by_tokens(text, token_budget, token_overlap)
+
+
+# pylint: disable=protected-access
+# the lazy split follows the steps of `RecursiveCharacterTextSplitter.split_text`
+
+
+def _top_separator(
+    lines: Iterable[str], splitter: RecursiveCharacterTextSplitter
+) -> tuple[str, list[str]]:
     """
-    Extract entities from acronyms in text
+    Get the separator the splitter splits the whole text with, and the separators of the
+    pieces too long, reading the text line by line. A separator spans at most two lines.
+    """
+    separators = splitter._separators
+    patterns = []
+    for s in separators:
+        if not s:
+            break
+        patterns.append(re.compile(s if splitter._is_separator_regex else re.escape(s)))
+    found = len(patterns)
+    previous = ""
+    for line in lines:
+        window = previous + line
+        for i in range(found):
+            if patterns[i].search(window):
+                found = i
+                break
+        if found == 0:
+            break
+        previous = line
+    if found < len(patterns):
+        return separators[found], separators[found + 1 :]
+    return separators[min(found, len(separators) - 1)], []
+
+
+def _iter_pieces(lines: Iterable[str], pattern: re.Pattern) -> Iterator[str]:
+    """
+    Split the text at the matches of the separator, each piece starting with its separator.
+    A piece is complete once the next match is found, only the last piece is buffered.
+    """
+    buffer = ""
+    floor = 0  # the end of the last match, the scan resumes there
+    for line in lines:
+        # a match starts at most at the last line break of the text read before
+        scan = max(floor, len(buffer) - 1, 0)
+        buffer += line
+        cut = 0
+        for match in pattern.finditer(buffer, scan):
+            if match.start() > cut:
+                yield buffer[cut : match.start()]
+                cut = match.start()
+            floor = match.end()
+        buffer, floor = buffer[cut:], floor - cut
+    if buffer:
+        yield buffer
+
+
+def _iter_split(
+    lines: Iterable[str],
+    splitter: RecursiveCharacterTextSplitter,
+    separator: str,
+    new_separators: list[str],
+) -> Iterator[str]:
+    """
+    Split the text read line by line like `splitter.split_text`: the pieces of the top-level
+    separator are merged into chunks as they are read, and a piece too long is split on its own.
+    """
+    if separator:
+        pattern = re.compile(
+            separator if splitter._is_separator_regex else re.escape(separator)
+        )
+        pieces = _iter_pieces(lines, pattern)
+    else:
+        pieces = (ch for line in lines for ch in line)
+    size, overlap = splitter._chunk_size, splitter._chunk_overlap
+    length = splitter._length_function
+    current: list[str] = []
+    total = 0
+    for piece in pieces:
+        piece_length = length(piece)
+        if piece_length >= size:
+            if current:
+                yield from filter(None, [splitter._join_docs(current, "")])
+                current, total = [], 0
+            if new_separators:
+                yield from splitter._split_text(piece, new_separators)
+            else:
+                yield piece
+            continue
+        if current and total + piece_length > size:
+            yield from filter(None, [splitter._join_docs(current, "")])
+            while total > overlap or (total + piece_length > size and total > 0):
+                total -= length(current[0])
+                current = current[1:]
+        current.append(piece)
+        total += piece_length
+    if current:
+        yield from filter(None, [splitter._join_docs(current, "")])
+
+
+# pylint: enable=protected-access
+
+
+def iter_document_chunks(
+    file: Union[str, TextIO],
+    chunk_size: int = 4000,
+    over_lap: int = 200,
+    token_budget: int = None,
+    token_overlap: int = 100,
+) -> Iterator["Chunk"]:
+    """
+    Split a document file (a path or a text stream) into the same chunks as `split_document`, lazily.
+    The file is read twice line by line: once to find the separator of the top-level pieces, once
+    to merge the pieces into chunks as they are read. Only the chunk being filled and the piece being
+    read are held, a text stream that can not seek back is read whole.
+    """
+    if isinstance(file, str):
+        with open(file, "r", encoding="utf-8") as f:
+            yield from iter_document_chunks(
+                f, chunk_size, over_lap, token_budget, token_overlap
+            )
+        return
+    if not file.seekable():
+        yield from split_document(
+            file.read(), chunk_size, over_lap, token_budget, token_overlap
+        )
+        return
+
+    refs = _ImageRefs() if token_budget is not None else None
+    splitter = _make_splitter(chunk_size, over_lap, token_budget, token_overlap, refs)
+
+    def lines(protect_refs: Optional[_ImageRefs]) -> Iterator[str]:
+        for line in file:
+            yield protect_refs.protect(line) if protect_refs else line
+
+    position = file.tell()
+    separator, new_separators = _top_separator(
+        lines(_ImageRefs() if refs else None), splitter
+    )
+    file.seek(position)
+    chunks = _iter_split(lines(refs), splitter, separator, new_separators)
+    if refs is not None:
+        chunks = _glue_headings((refs.restore(chunk) for chunk in chunks), token_budget)
+    for chunk_id, text in enumerate(chunks):
+        yield Chunk(id=chunk_id, text=text, length=len(text))
+
+
+def _acronym_messages(text: str, acronyms: list[tuple[str, str]]) -> list[dict]:
+    """
+    Build the messages to extract entities from acronyms in text
     """
-    entities: list["Entity"] = []
-    acronyms = extract_acronym(text)
     prompt = "Full name and acronym:\n"
     prompt += ", ".join(
         [f"({full_text}, {acronym})" for full_text, acronym in acronyms]
     )
     prompt += "\nThe Text:\n" + text
 
-    messages = [
+    return [
         {"role": "system", "content": EXTRACT_ENTITY_REL_P},
         {"role": "user", "content": prompt},
     ]
 
-    res = llm.chat(messages=messages, callback=None, model="gpt-4o-mini")
+
+def _parse_acronym_er(
+    res: str, acronyms: list[tuple[str, str]]
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Parse the llm response of acronym extraction, replacing acronyms with their full names
+    """
     log.debug(f"Extracted entities from acronyms in text, llm response: {res}")
     entities, rels = parse_rawtext_to_er(res)
+    return _resolve_acronyms(entities, rels, acronyms)
+
+
+def _resolve_acronyms(
+    entities: list["Entity"],
+    rels: list["Relationship"],
+    acronyms: list[tuple[str, str]],
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Replace acronyms in the entity names and relationship ends with their full names
+    """
     full_acronyms_dict = dict(acronyms)  #  {full_text: acronym }
     acronyms_full_dict = {acronym: full_text for full_text, acronym in acronyms}
 
@@ -90,21 +388,76 @@ def extract_acronym_extities(
     return entities, rels
 
 
-def extract_er_from_chunk(
+def extract_acronym_extities(
+    text: str, llm: LLM, tag: str = "extract:acronym"
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities from acronyms in text
+    """
+    acronyms = extract_acronym(text)
+    messages = _acronym_messages(text, acronyms)
+    res = llm.chat(messages=messages, callback=None, model="gpt-4o-mini", tag=tag)
+    return _parse_acronym_er(res, acronyms)
+
+
+async def async_extract_acronym_extities(
+    text: str, llm: AsyncLLM, tag: str = "extract:acronym"
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities from acronyms in text with the async client
+    """
+    acronyms = extract_acronym(text)
+    messages = _acronym_messages(text, acronyms)
+    res = await llm.chat(messages=messages, callback=None, model="gpt-4o-mini", tag=tag)
+    return _parse_acronym_er(res, acronyms)
+
+
+def _streaming_parser(
+    doc: "Chunk",
+    on_item: Optional[Callable[[Union["Entity", "Relationship"]], Any]],
+    acronyms: list[tuple[str, str]] = None,
+) -> StreamingERParser:
+    """
+    A parser of the extraction output of a chunk. With `on_item`, every entity or relationship
+    is also passed to it as soon as its tuple closes: a copy with the chunk id and the
+    `acronyms` resolved, the acronym entities of the gleaning strategy are not known yet.
+    """
+    if on_item is None:
+        return StreamingERParser()
+
+    def emit(item: Union["Entity", "Relationship"]):
+        item = copy.copy(item)
+        item.properties = dict(item.properties)
+        item.chunks = item.chunks + [doc.id]
+        if acronyms:
+            if isinstance(item, Entity):
+                _resolve_acronyms([item], [], acronyms)
+            else:
+                _resolve_acronyms([], [item], acronyms)
+        on_item(item)
+
+    return StreamingERParser(on_item=emit)
+
+
+def _glean_er_from_chunk(
     doc: "Chunk",
     llm: "LLM",
-    loop_num: int = 1,
-) -> tuple[list["Entity"], list["Relationship"]]:
+    loop_num: int,
+    on_item: Callable[[Union["Entity", "Relationship"]], Any] = None,
+) -> StreamingERParser:
     """
-    Extract entities and relationships from each chunk
+    Run the gleaning conversation of a chunk: the initial extraction and `loop_num`
+    continue/if-continue turns, returning the parser fed with the extraction output
     """
     messages = [
         {"role": "system", "content": EXTRACT_ENTITY_REL_P},
         {"role": "user", "content": doc.text},
     ]
 
-    raw_res = llm.chat(messages=messages, callback=None, model="gpt-4o-mini")
-    llm_output = raw_res or ""
+    parser = _streaming_parser(doc, on_item)
+    raw_res = llm.chat(
+        messages=messages, callback=parser, model="gpt-4o-mini", tag="extract:gleaning"
+    )
     log.debug(
         f"Extracted entities and relationships from chunk {doc.id}, llm response: {raw_res}"
     )
@@ -113,8 +466,12 @@ def extract_er_from_chunk(
             {"role": "assistant", "content": raw_res},
             {"role": "user", "content": CONTINUE_EXTRACT_P},
         ]
-        raw_res = llm.chat(messages=messages, callback=None, model="gpt-4o-mini")
-        llm_output += raw_res or ""
+        raw_res = llm.chat(
+            messages=messages,
+            callback=parser,
+            model="gpt-4o-mini",
+            tag="extract:gleaning",
+        )
         log.debug(
             f"Extract ER from chunk {doc.id} in LOOP {i+1}, messages: {messages} llm response: {raw_res}"
         )
@@ -122,17 +479,92 @@ def extract_er_from_chunk(
             {"role": "assistant", "content": raw_res},
             {"role": "user", "content": IF_COTINUE_P},
         ]
-        raw_res = llm.chat(messages=messages, callback=None, model="gpt-4o-mini")
+        raw_res = llm.chat(
+            messages=messages,
+            callback=None,
+            model="gpt-4o-mini",
+            tag="extract:gleaning",
+        )
         log.debug(
             f"IF continue extracte ER from chunk {doc.id} in LOOP {i+1}, messages: {messages} llm response: {raw_res}"
         )
         if "NO" in raw_res or "no" in raw_res:
             break
 
-    log.debug(f"Extract ER from chunk {doc.id}, llm output: {llm_output}")
-    entities, relationships = parse_rawtext_to_er(llm_output)
+    return parser
+
+
+def extract_er_from_chunk(
+    doc: "Chunk",
+    llm: "LLM",
+    loop_num: int = 1,
+    on_item: Callable[[Union["Entity", "Relationship"]], Any] = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities and relationships from each chunk with the gleaning strategy:
+    the gleaning conversation and a separate acronym extraction, running concurrently.
+    `on_item` receives the entities and relationships while they are generated,
+    see `_streaming_parser`.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="acronym"
+    ) as executor:
+        acronym_future = executor.submit(
+            extract_acronym_extities, doc.text, llm, "extract:gleaning"
+        )
+        parser = _glean_er_from_chunk(doc, llm, loop_num, on_item)
+        es2, rs2 = acronym_future.result()
+    return _merge_chunk_er(doc, *parser.result(), es2, rs2)
+
+
+def _single_shot_messages(doc: "Chunk", acronyms: list[tuple[str, str]]) -> list[dict]:
+    """
+    Build the messages of the single-shot extraction, with the regex acronyms as hints
+    """
+    if not acronyms:
+        return [
+            {"role": "system", "content": EXTRACT_ENTITY_REL_P},
+            {"role": "user", "content": doc.text},
+        ]
+    return _acronym_messages(doc.text, acronyms)
+
+
+def extract_er_from_chunk_single_shot(
+    doc: "Chunk",
+    llm: "LLM",
+    on_item: Callable[[Union["Entity", "Relationship"]], Any] = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities and relationships from each chunk with the single-shot strategy:
+    one call with the acronyms found by `extract_acronym` injected as hints.
+    `on_item` receives the entities and relationships while they are generated.
+    """
+    acronyms = extract_acronym(doc.text)
+    parser = _streaming_parser(doc, on_item, acronyms)
+    raw_res = llm.chat(
+        messages=_single_shot_messages(doc, acronyms),
+        callback=parser,
+        model="gpt-4o-mini",
+        tag="extract:single_shot",
+    )
+    log.debug(
+        f"Extracted entities and relationships from chunk {doc.id} in single shot, llm response: {raw_res}"
+    )
+    entities, relationships = _resolve_acronyms(*parser.result(), acronyms)
+    return _merge_chunk_er(doc, entities, relationships, [], [])
+
+
+def _merge_chunk_er(
+    doc: "Chunk",
+    entities: list["Entity"],
+    relationships: list["Relationship"],
+    es2: list["Entity"],
+    rs2: list["Relationship"],
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Join the entities parsed from the extraction output of a chunk with the acronym entities
+    """
 
-    es2, rs2 = extract_acronym_extities(doc.text, llm)
     log.info(
         f"Extract {len(es2)} entities and {len(rs2)} relationships from acronyms text, chunk {doc.id}"
     )
@@ -165,22 +597,192 @@ def extract_er_from_chunk(
     return entities, relationships
 
 
+async def _async_glean_er_from_chunk(
+    doc: "Chunk", llm: "AsyncLLM", loop_num: int
+) -> StreamingERParser:
+    """
+    Run the gleaning conversation of a chunk with the async client
+    """
+    messages = [
+        {"role": "system", "content": EXTRACT_ENTITY_REL_P},
+        {"role": "user", "content": doc.text},
+    ]
+
+    parser = StreamingERParser()
+    raw_res = await llm.chat(
+        messages=messages, callback=parser, model="gpt-4o-mini", tag="extract:gleaning"
+    )
+    for i in range(1, loop_num + 1, 1):
+        messages += [
+            {"role": "assistant", "content": raw_res},
+            {"role": "user", "content": CONTINUE_EXTRACT_P},
+        ]
+        raw_res = await llm.chat(
+            messages=messages,
+            callback=parser,
+            model="gpt-4o-mini",
+            tag="extract:gleaning",
+        )
+        messages += [
+            {"role": "assistant", "content": raw_res},
+            {"role": "user", "content": IF_COTINUE_P},
+        ]
+        raw_res = await llm.chat(
+            messages=messages,
+            callback=None,
+            model="gpt-4o-mini",
+            tag="extract:gleaning",
+        )
+        log.debug(
+            f"IF continue extracte ER from chunk {doc.id} in LOOP {i+1}, llm response: {raw_res}"
+        )
+        if "NO" in raw_res or "no" in raw_res:
+            break
+
+    return parser
+
+
+async def async_extract_er_from_chunk(
+    doc: "Chunk",
+    llm: "AsyncLLM",
+    loop_num: int = 1,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities and relationships from each chunk with the async client,
+    the gleaning conversation and the acronym extraction run concurrently
+    """
+    parser, (es2, rs2) = await asyncio.gather(
+        _async_glean_er_from_chunk(doc, llm, loop_num),
+        async_extract_acronym_extities(doc.text, llm, "extract:gleaning"),
+    )
+    return _merge_chunk_er(doc, *parser.result(), es2, rs2)
+
+
+async def async_extract_er_from_chunk_single_shot(
+    doc: "Chunk",
+    llm: "AsyncLLM",
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities and relationships from each chunk in single shot with the async client
+    """
+    acronyms = extract_acronym(doc.text)
+    parser = StreamingERParser()
+    await llm.chat(
+        messages=_single_shot_messages(doc, acronyms),
+        callback=parser,
+        model="gpt-4o-mini",
+        tag="extract:single_shot",
+    )
+    entities, relationships = _resolve_acronyms(*parser.result(), acronyms)
+    return _merge_chunk_er(doc, entities, relationships, [], [])
+
+
+EXTRACT_STRATEGIES = {
+    "gleaning": extract_er_from_chunk,
+    "single_shot": extract_er_from_chunk_single_shot,
+}
+ASYNC_EXTRACT_STRATEGIES = {
+    "gleaning": async_extract_er_from_chunk,
+    "single_shot": async_extract_er_from_chunk_single_shot,
+}
+
+
+def _get_strategy(strategies: dict, strategy: str):
+    if strategy not in strategies:
+        raise ValueError(
+            f"Unknown extraction strategy {strategy}, expected one of {list(strategies)}"
+        )
+    return strategies[strategy]
+
+
 def batch_extract_er_execute(
-    chunks: list[Chunk], llm: "LLM", batch_size: int = 5
+    chunks: list[Chunk],
+    llm: "LLM",
+    batch_size: int = 5,
+    store: EntityStore = None,
+    strategy: str = "gleaning",
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
 ) -> tuple[list[Entity], list[Relationship]]:
     """
-    Extract entities and relationships from each chunk in batch
+    Extract entities and relationships from each chunk in batch with the strategy in `EXTRACT_STRATEGIES`.
+    The entities and relationships are ingested into the store as soon as they are generated,
+    and the results of each chunk again when it finishes, with its acronyms as aliases.
+    With a controller, the concurrency adapts up to its max limit instead of the fixed `batch_size`.
+    With a checkpoint, the results of each chunk are saved and the chunks done by a previous run are skipped.
+    The error of a failed chunk is raised once the other chunks are finished and saved.
     """
-    results = []
+    extract = _get_strategy(EXTRACT_STRATEGIES, strategy)
+    if store is None:
+        store = EntityStore()
+    store_lock = threading.Lock()
+
+    def on_item(item: Union["Entity", "Relationship"]):
+        with store_lock:
+            if isinstance(item, Entity):
+                store.add_entity(item)
+            else:
+                store.add_relationship(item)
+
+    done: set[int] = set()
+    if checkpoint:
+        for record in checkpoint.records("chunks"):
+            done.add(record["chunk"])
+            store.add(
+                [Entity.from_dict(e) for e in record["entities"]],
+                [Relationship.from_dict(r) for r in record["relationships"]],
+            )
     with concurrent.futures.ThreadPoolExecutor(
-        max_workers=batch_size, thread_name_prefix="text_er"
+        max_workers=controller.max_limit if controller else batch_size,
+        thread_name_prefix="text_er",
     ) as executor:
-        futures = []
+        futures = {}
         for chunk in chunks:
-            partial_func = partial(extract_er_from_chunk, chunk, llm)
-            futures.append(executor.submit(partial_func))
+            if chunk.id in done:
+                continue
+            partial_func = partial(extract, chunk, llm, on_item=on_item)
+            if controller:
+                partial_func = partial(controller.run, partial_func)
+            futures[executor.submit(partial_func)] = chunk
+        error = None
         for future in concurrent.futures.as_completed(futures):
-            results.append(future.result())
+            try:
+                es, rs = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                # keep recording the other chunks, so that a resumed run skips them
+                error = error or e
+                continue
+            if checkpoint:
+                checkpoint.append(
+                    "chunks",
+                    {
+                        "chunk": futures[future].id,
+                        "hash": futures[future].hash,
+                        "entities": [e.to_dict() for e in es],
+                        "relationships": [r.to_dict() for r in rs],
+                    },
+                )
+            with store_lock:
+                store.add(es, rs)
+                # the entities streamed before their acronym was resolved
+                for e in es:
+                    if e.properties.get("acroyum"):
+                        store.union(e.properties["acroyum"], e.name)
+    if error is not None:
+        raise error
+
+    return store.to_er()
+
+
+async def async_batch_extract_er_execute(
+    chunks: list[Chunk], llm: "AsyncLLM", strategy: str = "gleaning"
+) -> tuple[list[Entity], list[Relationship]]:
+    """
+    Extract entities and relationships from all chunks concurrently on one event loop,
+    the concurrency is bounded by the semaphore of the client
+    """
+    extract = _get_strategy(ASYNC_EXTRACT_STRATEGIES, strategy)
+    results = await asyncio.gather(*[extract(chunk, llm) for chunk in chunks])
     es: list[Entity] = []
     rs: list[Relationship] = []
     for res in results:
@@ -191,20 +793,27 @@ def batch_extract_er_execute(
 
 
 def process_text_er(
-    chunks: list["Chunk"], llm: "LLM"
+    chunks: list["Chunk"],
+    llm: "LLM",
+    store: EntityStore = None,
+    strategy: str = "gleaning",
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
 ) -> tuple[list["Entity"], list["Relationship"]]:
     """
     Process text entities and relationships
     """
-    es: list["Entity"] = []
-    rs: list["Relationship"] = []
-    batch_size = len(chunks) if len(chunks) < 8 else 8
-    es, rs = batch_extract_er_execute(chunks, llm, batch_size)
-    log.info(f"Extracted {len(es)} entities and {len(rs)} relationships from text")
-    log.debug(f"Entities: {es}, Relationships: {rs}")
-    es, rs = merge_er(es, rs)
+    batch_size = min(len(chunks), 8) if isinstance(chunks, list) else 8
+    es, rs = batch_extract_er_execute(
+        chunks, llm, batch_size, store, strategy, controller, checkpoint
+    )
+    usage = llm.usage.get(f"extract:{strategy}")
     log.info(
-        f"Merged entities and relationships. Entities: {len(es)}, Relationships: {len(rs)}"
+        f"Extraction strategy {strategy}: {usage.calls} calls, {usage.prompt_tokens} prompt tokens, "
+        + f"{usage.completion_tokens} completion tokens, {usage.latency:.1f}s total latency"
+    )
+    log.info(
+        f"Extracted and merged entities and relationships from text. Entities: {len(es)}, Relationships: {len(rs)}"
     )
     es_str = "\n".join([str(e.to_dict()) for e in es])
     rs_str = "\n".join([str(r.to_dict()) for r in rs])
@@ -214,11 +823,15 @@ def process_text_er(
     return es, rs
 
 
-def process_image_er(
-    chunks: list["Chunk"], llm: "LLM"
-) -> tuple[list["Entity"], list["Relationship"], list["Image"]]:
+def process_image_attri(
+    chunks: list["Chunk"],
+    llm: "LLM",
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
+    image_dir: str = None,
+) -> list["Image"]:
     """
-    Process image entities and relationships
+    Process the images of the chunks and their attributes, the image paths are relative to `image_dir`
     """
     images: list["Image"] = []
     for chunk in chunks:
@@ -227,12 +840,45 @@ def process_image_er(
     images = merge_images(images)
     log.info(f"Merged images. Images: {len(images)}")
     log.debug(f"Merged Images: {images}")
-    images = batch_extract_image_attri(images, chunks, llm)
+    images = batch_extract_image_attri(
+        images,
+        chunks,
+        llm,
+        controller=controller,
+        checkpoint=checkpoint,
+        image_dir=image_dir,
+    )
     log.debug(f"Extracted attributes from images: {images}")
-    es, rs = batch_extract_er_from_images(images, chunks, llm)
+    return images
+
+
+def process_image_er(
+    chunks: list["Chunk"],
+    llm: "LLM",
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
+    images: list["Image"] = None,
+    image_dir: str = None,
+) -> tuple[list["Entity"], list["Relationship"], list["Image"]]:
+    """
+    Process image entities and relationships, of the `images` given by `process_image_attri`
+    or of all images of the chunks
+    """
+    if images is None:
+        images = process_image_attri(chunks, llm, controller, checkpoint, image_dir)
+    es, rs = batch_extract_er_from_images(
+        images,
+        chunks,
+        llm,
+        controller=controller,
+        checkpoint=checkpoint,
+        image_dir=image_dir,
+    )
     log.info(f"Extracted {len(es)} entities and {len(rs)} relationships from images")
     log.debug(f"Image Entities: {es}, Relationships: {rs}")
-    es, rs = merge_er(es, rs)
+    store = EntityStore()
+    store.add(es, rs)
+    es, rs = store.to_er()
     log.info(
         f"Merged Image entities and relationships. Entities: {len(es)}, Relationships: {len(rs)}"
     )
@@ -240,30 +886,166 @@ def process_image_er(
     return es, rs, images
 
 
-def pipeline(
-    doc_path: str,
+def seed_checkpoint(
+    checkpoint: RunCheckpoint, previous: RunCheckpoint, chunks: list["Chunk"]
+):
+    """
+    Seed the checkpoint of a re-ingest with the results of a previous run of the edited documents.
+    The chunks are matched by content hash, so only the changed chunks and the images around them are
+    extracted again, and the entities and relationships only found in removed chunks are retracted.
+    The merge decisions of unchanged entity groups and the name embeddings are reused as well.
+    """
+    if checkpoint.records("chunks"):
+        log.info(f"Run {checkpoint.run_id} is already seeded")
+        return
+    previous_records = [r for r in previous.records("chunks") if "hash" in r]
+    by_hash = {r["hash"]: r for r in previous_records}
+    previous_hashes = {r["chunk"]: r["hash"] for r in previous_records}
+    new_ids = {c.hash: c.id for c in chunks}
+
+    def remap(item: dict, old_id: int, new_id: int) -> dict:
+        return dict(item, chunks=[new_id if c == old_id else c for c in item["chunks"]])
+
+    reused = 0
+    for chunk in chunks:
+        record = by_hash.get(chunk.hash)
+        if record is None:
+            continue
+        reused += 1
+        checkpoint.append(
+            "chunks",
+            {
+                "chunk": chunk.id,
+                "hash": chunk.hash,
+                "entities": [
+                    remap(e, record["chunk"], chunk.id) for e in record["entities"]
+                ],
+                "relationships": [
+                    remap(r, record["chunk"], chunk.id) for r in record["relationships"]
+                ],
+            },
+        )
+
+    # an image is reused if it occurs in the same chunks, which are all unchanged
+    images = merge_images([img for c in chunks for img in extract_images_from_chunk(c)])
+    hashes = {c.id: c.hash for c in chunks}
+    image_hashes = {img.path: {hashes[c] for c in img.chunks} for img in images}
+    reused_images: set[str] = set()
+    for record in previous.records("image_attri"):
+        old_chunks = record["image"]["chunks"]
+        if any(c not in previous_hashes for c in old_chunks):
+            continue
+        old_hashes = {previous_hashes[c] for c in old_chunks}
+        if image_hashes.get(record["path"]) != old_hashes:
+            continue
+        image = dict(
+            record["image"], chunks=[new_ids[previous_hashes[c]] for c in old_chunks]
+        )
+        checkpoint.append("image_attri", {"path": record["path"], "image": image})
+        reused_images.add(record["path"])
+    for record in previous.records("image_er"):
+        if record["path"] in reused_images:
+            checkpoint.append("image_er", record)
+
+    for record in previous.records("merge"):
+        checkpoint.append("merge", record)
+    checkpoint.save_embeddings(previous.load_embeddings())
+    removed = len(set(by_hash) - set(new_ids))
+    log.info(
+        f"Seeded run {checkpoint.run_id} from run {previous.run_id}: reused {reused}/{len(chunks)} chunks, "
+        + f"{len(reused_images)}/{len(images)} images, {removed} chunks removed"
+    )
+
+
+def extract_graph(
+    chunks: Iterable["Chunk"],
+    llm: "LLM",
+    strategy: str = "gleaning",
+    checkpoint: RunCheckpoint = None,
+    image_dir: str = None,
 ) -> tuple[list["Entity"], list["Relationship"], list["Image"]]:
     """
-    Extract entities and relationships from text
-    """
-    with open(doc_path, "r", encoding="utf-8") as f:
-        text = f.read()
-    chunks = split_document(text)
-    log.info(f"Split the text into {len(chunks)} chunks")
-    llm = LLM()
-    entities = []
-    relationships = []
-    entities, relationships = process_text_er(chunks, llm)
-    ies, irs, images = process_image_er(chunks, llm)
+    Extract and merge the entities, relationships and images of the chunks into one graph.
+    The chunk ids must be unique, the chunks may come from several documents.
+    The image paths of the chunks are relative to `image_dir`, see `encode_image`.
+    The chunks may be a lazy iterator such as `iter_document_chunks`: text extraction starts on
+    the first chunk, and image extraction starts once all chunks are split. The split chunks are
+    kept for the context of the images.
+    """
+    _get_strategy(EXTRACT_STRATEGIES, strategy)
+    # one controller per stage, the tasks of different stages take very different times
+    controllers = {
+        stage: AdaptiveConcurrency(rate_limiter=llm.rate_limiter)
+        for stage in ("text_er", "image_attri", "image_er")
+    }
+    store = EntityStore()
+    split_done = threading.Event()
+    split_complete = threading.Event()
+    if isinstance(chunks, list):
+        text_chunks = chunks
+        split_complete.set()
+        split_done.set()
+    else:
+        stream, chunks = chunks, []
+
+        def collect() -> Iterator["Chunk"]:
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+                split_complete.set()
+            finally:
+                split_done.set()
+
+        text_chunks = collect()
+
+    def text_er_stage() -> tuple[list["Entity"], list["Relationship"]]:
+        try:
+            return process_text_er(
+                text_chunks, llm, store, strategy, controllers["text_er"], checkpoint
+            )
+        finally:
+            # the text stage may fail before or while splitting, never leave the image stage waiting
+            split_done.set()
+
+    def image_attri_stage() -> list["Image"]:
+        split_done.wait()
+        if not split_complete.is_set():
+            log.warning("Skip image extraction, the document was not split completely")
+            return []
+        return process_image_attri(
+            chunks, llm, controllers["image_attri"], checkpoint, image_dir
+        )
+
+    # image extraction only needs the chunks, so it runs concurrently with text extraction
+    results = run_stages(
+        {
+            "text_er": (text_er_stage, []),
+            "image_attri": (image_attri_stage, []),
+            "image_er": (
+                lambda image_attri: process_image_er(
+                    chunks,
+                    llm,
+                    controllers["image_er"],
+                    checkpoint,
+                    image_attri,
+                    image_dir,
+                ),
+                ["image_attri"],
+            ),
+        }
+    )
+    ies, irs, images = results["image_er"]
     for img in images:
-        for e in entities:
-            if e.name in img.text_snippets:
-                e.images.append(img.path)
-    entities.extend(ies)
-    relationships.extend(irs)
-    entities, relationships = merge_er(entities, relationships)
-    entities, relationships = merge_er_by_llm(entities, relationships, llm)
-    entities, relationships = merge_er(entities, relationships)
+        for snippet in img.text_snippets:
+            store.add_image(snippet, img.path)
+    store.add(ies, irs)
+    merge_store_by_llm(store, llm, checkpoint=checkpoint)
+    entities, relationships = store.to_er()
+    log.info(f"LLM usage by tag: {llm.usage.summary()}")
+    log.info(f"LLM rate limiter: {llm.rate_limiter.stats()}")
+    for stage, controller in controllers.items():
+        log.info(f"Adaptive concurrency of stage {stage}: {controller.stats()}")
     log.info(
         "Finished extracting ER Image from text, Entities: %d, Relationships: %d, Image: %d",
         len(entities),
@@ -277,3 +1059,76 @@ def pipeline(
         f"Extracted Entities And Relationships:\nEntities:\n{entities_str}\nRelationships:\n{relationships_str}\nImages:\n{images_str}"
     )
     return entities, relationships, images
+
+
+def pipeline(
+    doc_path: str,
+    strategy: str = "gleaning",
+    resume: str = None,
+    previous: str = None,
+    token_budget: int = None,
+    stream: bool = False,
+    runs_dir: str = None,
+    chunk_size: int = 4000,
+    over_lap: int = 200,
+    token_overlap: int = 100,
+) -> tuple[list["Entity"], list["Relationship"], list["Image"]]:
+    """
+    Extract entities and relationships from text.
+    `strategy` selects how each chunk is extracted, "gleaning" or "single_shot".
+    The text is split into chunks by `split_document` with `chunk_size`, `over_lap`,
+    `token_budget` and `token_overlap`.
+    `stream=True` reads and splits the document lazily with `iter_document_chunks`, so that
+    extraction starts on the first chunk instead of after reading and splitting the whole document.
+    With `runs_dir` (or LLMGRAPH_RUN_DIR), the results of each stage are checkpointed in a run
+    directory, `resume=run_id` resumes a failed run with the same document and settings and
+    skips the work it completed.
+    `previous=run_id` re-ingests an edited document incrementally, see `seed_checkpoint`.
+    """
+    split_args = {
+        "chunk_size": chunk_size,
+        "over_lap": over_lap,
+        "token_budget": token_budget,
+        "token_overlap": token_overlap,
+    }
+    checkpoint = RunCheckpoint.open(runs_dir, resume)
+    if previous and checkpoint is None:
+        raise ValueError(
+            "Re-ingesting a previous run needs runs_dir or LLMGRAPH_RUN_DIR"
+        )
+    if not stream:
+        with open(doc_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    if checkpoint:
+        checkpoint.check_source(
+            doc_path,
+            digest=file_digest(doc_path),
+            settings={"strategy": strategy, **split_args},
+        )
+        log.info(f"Run {checkpoint.run_id}, checkpoints in {checkpoint.run_dir}")
+        result = checkpoint.load_result()
+        if result is not None:
+            log.info(f"Run {checkpoint.run_id} is finished, load its result")
+            return result
+    if stream:
+        chunks = iter_document_chunks(doc_path, **split_args)
+    else:
+        chunks = split_document(text, **split_args)
+        log.info(f"Split the text into {len(chunks)} chunks")
+    if previous:
+        # the chunk hashes of the whole document are needed to seed the run
+        chunks = list(chunks)
+        seed_checkpoint(
+            checkpoint, RunCheckpoint.existing(previous, checkpoint.root), chunks
+        )
+    # the images of a markdown document are relative to it
+    entities, relationships, images = extract_graph(
+        chunks,
+        LLM(),
+        strategy,
+        checkpoint,
+        image_dir=os.path.dirname(os.path.abspath(doc_path)),
+    )
+    if checkpoint:
+        checkpoint.save_result(entities, relationships, images)
+    return entities, relationships, images
@@ -0,0 +1,220 @@
+"""
+Ingest a batch of markdown and PDF documents into one graph
+1. render the PDF pages and read the markdown files in worker processes
+2. parse the rendered PDF pages to markdown
+3. split the documents into chunks in worker processes, the chunk ids are unique across documents
+4. extract and merge the entities and relationships of all chunks with one shared, rate-limited LLM client
+"""
+
+import os
+import re
+import logging
+import concurrent.futures
+from functools import partial
+from typing import Optional
+
+from ..dataclass import Chunk, Entity, Relationship, Image
+from ..common.llm import LLM
+from ..common.checkpoint import RunCheckpoint
+from ..common.tools import file_digest
+from .extract import split_document, extract_graph, seed_checkpoint
+
+log = logging.getLogger("llmgraph")
+
+DOCUMENT_SUFFIXES = (".md", ".markdown", ".pdf")
+
+_IMAGE_REF_RE = re.compile(r"!\[(.*?)\]\((.*?)\)")
+
+
+def collect_documents(source: str) -> list[str]:
+    """
+    Get the documents of a directory (recursively), or of a manifest file listing one path per line.
+    Relative paths in a manifest are relative to the manifest, lines starting with `#` are ignored.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(DOCUMENT_SUFFIXES):
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = os.path.join(base_dir, line)
+            if not path.lower().endswith(DOCUMENT_SUFFIXES):
+                raise ValueError(f"Unsupported document type: {line}")
+            paths.append(path)
+    return paths
+
+
+def _render_document(
+    path: str, output_dir: str
+) -> tuple[Optional[str], list[tuple[Optional[str], list[str], Optional[str]]]]:
+    """
+    Read a markdown document, or render the pages of a PDF document. Runs in a worker process.
+    """
+    if not path.lower().endswith(".pdf"):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read(), []
+    # the PDF dependencies are only needed by PDF documents
+    from .parse_pdf import _parse_pdf_to_images
+
+    if os.path.exists(os.path.join(output_dir, "output.md")):
+        return None, []
+    os.makedirs(output_dir, exist_ok=True)
+    return None, _parse_pdf_to_images(path, output_dir=output_dir)
+
+
+def _parse_rendered_pdf(
+    image_infos: list[tuple[Optional[str], list[str], Optional[str]]],
+    output_dir: str,
+    gpt_worker: int,
+    llm: "LLM",
+) -> str:
+    """
+    Parse the rendered pages of a PDF document to markdown, reusing the markdown of a previous run
+    """
+    output_path = os.path.join(output_dir, "output.md")
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            return f.read()
+    from .parse_pdf import _gpt_parse_images
+
+    return _gpt_parse_images(
+        image_infos, output_dir=output_dir, gpt_worker=gpt_worker, llm=llm
+    )
+
+
+def _rebase_images(text: str, doc_dir: str, image_dir: str) -> str:
+    """
+    Rewrite the image paths of a document, relative to its directory `doc_dir`,
+    as paths relative to the `image_dir` shared by all documents of the batch
+    """
+
+    def rebase(match: re.Match) -> str:
+        path = os.path.join(doc_dir, match.group(2).strip())
+        if "://" in match.group(2) or not os.path.isfile(path):
+            return match.group(0)
+        return f"![{match.group(1)}]({os.path.relpath(path, image_dir)})"
+
+    return _IMAGE_REF_RE.sub(rebase, text)
+
+
+def ingest_documents(
+    paths: list[str],
+    strategy: str = "gleaning",
+    resume: str = None,
+    processes: int = None,
+    gpt_worker: int = 4,
+    previous: str = None,
+    token_budget: int = None,
+    runs_dir: str = None,
+    chunk_size: int = 4000,
+    over_lap: int = 200,
+    token_overlap: int = 100,
+    image_dir: str = None,
+) -> tuple[list["Entity"], list["Relationship"], list["Image"]]:
+    """
+    Extract the entities and relationships of all documents and merge them into one graph.
+    Reading, PDF rendering and splitting run in `processes` worker processes, all LLM requests
+    share one client and rate limiter. The documents are split as in `pipeline`.
+    With `runs_dir` (or LLMGRAPH_RUN_DIR) the run is checkpointed like `pipeline`, `resume=run_id`
+    resumes a failed run; the result records the chunk id range of each document.
+    `previous=run_id` re-ingests edited documents incrementally, see `seed_checkpoint`.
+    Each PDF is rendered in its own directory, named after its sha256, under `image_dir`: by default
+    the `pdf` directory of the run, or `./pdf` when the run is not checkpointed. The image paths of
+    all documents are rewritten relative to `image_dir`, which the result records.
+    """
+    split_args = {
+        "chunk_size": chunk_size,
+        "over_lap": over_lap,
+        "token_budget": token_budget,
+        "token_overlap": token_overlap,
+    }
+    checkpoint = RunCheckpoint.open(runs_dir, resume)
+    if previous and checkpoint is None:
+        raise ValueError(
+            "Re-ingesting a previous run needs runs_dir or LLMGRAPH_RUN_DIR"
+        )
+    digests = [file_digest(p) for p in paths]
+    if checkpoint:
+        checkpoint.check_source(
+            "\n".join(paths),
+            "\n".join(f"{p}:{digest}" for p, digest in zip(paths, digests)),
+            settings={"strategy": strategy, **split_args},
+        )
+        log.info(
+            f"Run {checkpoint.run_id}, {len(paths)} documents, checkpoints in {checkpoint.run_dir}"
+        )
+        result = checkpoint.load_result()
+        if result is not None:
+            log.info(f"Run {checkpoint.run_id} is finished, load its result")
+            return result
+    if image_dir is None:
+        image_dir = os.path.join(checkpoint.run_dir if checkpoint else ".", "pdf")
+    image_dir = os.path.abspath(image_dir)
+    # the image paths relative to it are resolved through it, it has to exist
+    os.makedirs(image_dir, exist_ok=True)
+
+    llm = LLM()
+    # the region images of every PDF are named <page>_<index>.png, one directory per document
+    output_dirs = [os.path.join(image_dir, digest[:16]) for digest in digests]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        rendered = list(executor.map(_render_document, paths, output_dirs))
+        log.info(f"Read and rendered {len(paths)} documents")
+
+        texts: list[str] = [text for text, _ in rendered]
+        pdf_indexes = [i for i, (text, _) in enumerate(rendered) if text is None]
+        if pdf_indexes:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(pdf_indexes), 8), thread_name_prefix="pdf"
+            ) as pdf_executor:
+                contents = pdf_executor.map(
+                    lambda i: _parse_rendered_pdf(
+                        rendered[i][1], output_dirs[i], gpt_worker, llm
+                    ),
+                    pdf_indexes,
+                )
+                for i, content in zip(pdf_indexes, contents):
+                    texts[i] = content
+            log.info(f"Parsed {len(pdf_indexes)} PDF documents to markdown")
+        texts = [
+            _rebase_images(
+                text,
+                output_dirs[i] if rendered[i][0] is None else os.path.dirname(path),
+                image_dir,
+            )
+            for i, (path, text) in enumerate(zip(paths, texts))
+        ]
+
+        documents_chunks = list(
+            executor.map(partial(split_document, **split_args), texts)
+        )
+
+    chunks: list["Chunk"] = []
+    documents: list[dict] = []
+    for path, doc_chunks in zip(paths, documents_chunks):
+        start = len(chunks)
+        for c in doc_chunks:
+            chunks.append(Chunk(id=len(chunks), text=c.text, length=c.length))
+        documents.append({"path": path, "chunks": [start, len(chunks)]})
+    log.info(f"Split {len(paths)} documents into {len(chunks)} chunks")
+    if previous:
+        seed_checkpoint(
+            checkpoint, RunCheckpoint.existing(previous, checkpoint.root), chunks
+        )
+
+    entities, relationships, images = extract_graph(
+        chunks, llm, strategy, checkpoint, image_dir=image_dir
+    )
+    if checkpoint:
+        checkpoint.save_result(
+            entities, relationships, images, documents=documents, image_dir=image_dir
+        )
+    return entities, relationships, images
@@ -4,71 +4,90 @@ Merge Entities and Relationships By LLM
 2. weekly connected components
 """
 
+import asyncio
 import logging
-import copy
 from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import networkx as nx
 
 from ..dataclass import Entity, Relationship
-from ..common.llm import LLM
+from ..common.llm import LLM, AsyncLLM
 from ..common.tools import remove_duplicates
+from ..common.checkpoint import RunCheckpoint
 from .prompts import MERGE_ER_P
-
+from .candidates import similar_pairs
+from .entity_store import EntityStore
 
 log = logging.getLogger("llmgraph")
 
 
-def get_entity_embedding(es: list["Entity"], llm: "LLM") -> dict[str, list[float]]:
+def get_entity_embedding(
+    es: list["Entity"], llm: "LLM", checkpoint: RunCheckpoint = None
+) -> dict[str, np.ndarray]:
     """
-    Get the embedding of an entity
+    Get the embedding of entities, the names are embedded in batched requests.
+    With a checkpoint, only the names not embedded by a previous run are embedded.
     """
-    results: dict[str, list[float]] = {}
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        features = [executor.submit(llm.embed, e.name) for e in es]
-        for e, future in zip(es, features):
-            e_embedding = future.result()
-            results[e.name] = e_embedding
-    return results
+    names = remove_duplicates([e.name for e in es])
+    embeddings = checkpoint.load_embeddings() if checkpoint else {}
+    missing = [name for name in names if name not in embeddings]
+    if missing:
+        embeddings.update(zip(missing, llm.embed_many(missing)))
+        if checkpoint:
+            checkpoint.save_embeddings(embeddings)
+    return {name: embeddings[name] for name in names}
 
 
-def create_graph(es: list["Entity"]) -> nx.DiGraph:
+async def async_get_entity_embedding(
+    es: list["Entity"], llm: "AsyncLLM"
+) -> dict[str, np.ndarray]:
     """
-    Create a graph from entities and relationships
+    Get the embedding of entities with the async client
     """
+    names = remove_duplicates([e.name for e in es])
+    matrix = await llm.embed_many(names)
+    return dict(zip(names, matrix))
 
-    def calculate_similarity(emb1: list[float], emb2: list[float]) -> float:
-        v1 = np.array(emb1).reshape(1, -1)
-        v2 = np.array(emb2).reshape(1, -1)
-        return cosine_similarity(v1, v2)[0][0]
 
-    entity_embeddings = get_entity_embedding(es, llm=LLM())
+def create_graph(
+    es: list["Entity"],
+    entity_embeddings: dict[str, np.ndarray] = None,
+    threshold: float = 0.9,
+    candidates: Callable[[np.ndarray, float], Iterator[tuple[int, int, float]]] = None,
+) -> nx.DiGraph:
+    """
+    Create a graph from entities, connecting the entities whose name embeddings are similar.
+    `candidates` generates the similar pairs, exact all-pairs search by default,
+    an approximate index such as `RandomProjectionLSH` for large graphs.
+    """
+    if candidates is None:
+        candidates = similar_pairs
+    if entity_embeddings is None:
+        entity_embeddings = get_entity_embedding(es, llm=LLM())
     G = nx.DiGraph()
     for e in es:
         G.add_node(e.name, entity=e)
 
-    for i, _ in enumerate(es):
-        for j in range(i + 1, len(es)):
-            e1_emb, e2_emb = (
-                entity_embeddings[es[i].name],
-                entity_embeddings[es[j].name],
-            )
-            similarity = calculate_similarity(e1_emb, e2_emb)
-            if similarity > 0.9:
-                G.add_edge(es[i].name, es[j].name, similarity=similarity)
+    names = remove_duplicates([e.name for e in es])
+    if names:
+        matrix = np.stack([entity_embeddings[name] for name in names])
+        for i, j, similarity in candidates(matrix, threshold):
+            G.add_edge(names[i], names[j], similarity=similarity)
     log.debug(f"Created graph from ER, nodes {G.nodes()}, edges {G.edges()}")
     return G
 
 
 def get_er_groups(g: nx.Graph) -> list[list["Entity"]]:
     """
-    Get connected components from the graph
+    Get connected components from the graph, the entities of each one in the order of the graph,
+    so that the first entity seen names the merged entity
     """
+    order = {n: i for i, n in enumerate(g.nodes)}
     sub_graphs = []
     for component in nx.weakly_connected_components(g):
-        es = [g.nodes[n]["entity"] for n in component]
+        es = [g.nodes[n]["entity"] for n in sorted(component, key=order.get)]
         sub_graphs.append(es)
 
     sub_graphs_str = "\n".join([", ".join([e.name for e in es]) for es in sub_graphs])
@@ -77,16 +96,21 @@ def get_er_groups(g: nx.Graph) -> list[list["Entity"]]:
     return sub_graphs
 
 
-def merge_e_with_llm(es: list["Entity"], llm: "LLM") -> list["Entity"]:
+def _merge_e_messages(es: list["Entity"]) -> list[dict]:
     """
-    Merge entities by LLM
+    Build the messages to ask the LLM whether to merge the entities
     """
     prompt = ["- " + e.to_origin_text() for e in es]
-    messages = [
+    return [
         {"role": "system", "content": MERGE_ER_P},
         {"role": "user", "content": "\n".join(prompt)},
     ]
-    llm_res = llm.chat(messages, callback=None)
+
+
+def _parse_merged_e(llm_res: str, es: list["Entity"]) -> list["Entity"]:
+    """
+    Merge the entities according to the llm response
+    """
     log.debug(f"Merge ER with LLM, llm response: {llm_res}")
     if "NO" in llm_res.upper():
         return es
@@ -104,46 +128,143 @@ def merge_e_with_llm(es: list["Entity"], llm: "LLM") -> list["Entity"]:
     return [merged_entity]
 
 
-def merge_er_by_llm(
-    es: list["Entity"], rs: list["Relationship"], llm: "LLM"
-) -> tuple[list["Entity"], list["Relationship"]]:
+def merge_e_with_llm(
+    es: list["Entity"], llm: "LLM", checkpoint: RunCheckpoint = None
+) -> list["Entity"]:
     """
-    Merge entities and relationships by LLM
+    Merge entities by LLM.
+    With a checkpoint, the decision is recorded so that a resumed run does not ask again.
     """
+    llm_res = llm.chat(_merge_e_messages(es), callback=None, tag="merge")
+    if checkpoint:
+        checkpoint.append("merge", {"group": [e.name for e in es], "response": llm_res})
+    return _parse_merged_e(llm_res, es)
+
+
+async def async_merge_e_with_llm(es: list["Entity"], llm: "AsyncLLM") -> list["Entity"]:
+    """
+    Merge entities by LLM with the async client
+    """
+    llm_res = await llm.chat(_merge_e_messages(es), callback=None, tag="merge")
+    return _parse_merged_e(llm_res, es)
+
+
+def _merge_groups_by_llm(
+    es: list["Entity"],
+    llm: "LLM",
+    candidates: Callable[[np.ndarray, float], Iterator[tuple[int, int, float]]] = None,
+    checkpoint: RunCheckpoint = None,
+) -> tuple[list[list["Entity"]], list[list["Entity"]]]:
+    """
+    Group the similar entities and ask the LLM whether to merge each group,
+    returning the groups and the merged entities of each group.
+    With a checkpoint, the embeddings and the merge decisions of a previous run are reused.
+    """
+    decisions: dict[frozenset, dict] = {}
+    if checkpoint:
+        for record in checkpoint.records("merge"):
+            decisions[frozenset(record["group"])] = record
 
     def process_group(es_group: list["Entity"]) -> list["Entity"]:
         if len(es_group) == 1:
             return es_group
-        return merge_e_with_llm(es_group, llm)
+        record = decisions.get(frozenset(e.name for e in es_group))
+        if record is not None:
+            # keep the order of the group, the first entity names the merged one
+            order = {name: i for i, name in enumerate(record["group"])}
+            return _parse_merged_e(
+                record["response"], sorted(es_group, key=lambda e: order[e.name])
+            )
+        return merge_e_with_llm(es_group, llm, checkpoint)
 
-    g = create_graph(es)
+    g = create_graph(
+        es, get_entity_embedding(es, llm, checkpoint), candidates=candidates
+    )
     es_groups = get_er_groups(g)
-    merged_es: list["Entity"] = []
-    merged_rs: list["Relationship"] = []
 
     with ThreadPoolExecutor() as executor:
         futures = [executor.submit(process_group, es_group) for es_group in es_groups]
-        for future, group in zip(futures, es_groups):
-            merged_res_es = future.result()
-            if len(merged_res_es) > 1:
-                merged_es.extend(merged_res_es)
-            else:
-                merged_e = merged_res_es[0]
-                group_names = [e.name for e in group]
-                merged_es.append(merged_e)
-                for r in rs:
-                    m_r = copy.deepcopy(r)
-                    if m_r.start in group_names:
-                        m_r.start = merged_e.name
-                    if m_r.end in group_names:
-                        m_r.end = merged_e.name
-                    merged_rs.append(m_r)
-    merged_es_str = "\n".join([str(e.to_dict()) for e in merged_es])
-    merged_rs_str = "\n".join([str(r.to_dict()) for r in merged_rs])
-    log.debug(
-        f"Merged ER by LLM, merged entities: \n{merged_es_str}, relationships: \n{merged_rs_str}"
-    )
-    log.info(
-        f"Merged Entity ly LLM, Entity: {len(merged_es)}, Relationships: {len(merged_rs)}"
+        results = [future.result() for future in futures]
+    return es_groups, results
+
+
+def merge_er_by_llm(
+    es: list["Entity"],
+    rs: list["Relationship"],
+    llm: "LLM",
+    candidates: Callable[[np.ndarray, float], Iterator[tuple[int, int, float]]] = None,
+    checkpoint: RunCheckpoint = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Merge entities and relationships by LLM, see `merge_store_by_llm`.
+    With a checkpoint, the embeddings and the merge decisions of a previous run are reused.
+    """
+    store = EntityStore()
+    store.add(es, rs)
+    merge_store_by_llm(store, llm, candidates, checkpoint)
+    return store.to_er()
+
+
+def merge_store_by_llm(
+    store: EntityStore,
+    llm: "LLM",
+    candidates: Callable[[np.ndarray, float], Iterator[tuple[int, int, float]]] = None,
+    checkpoint: RunCheckpoint = None,
+):
+    """
+    Merge the entities of the store by LLM: the entities of a group the LLM merges are unioned
+    into the first one, the store merges their fields and rewrites the relationship endpoints.
+    """
+    es_groups, results = _merge_groups_by_llm(
+        store.entities(), llm, candidates, checkpoint
     )
-    return merged_es, merged_rs
+    _union_merged_groups(store, es_groups, results)
+
+
+def _union_merged_groups(
+    store: EntityStore,
+    es_groups: list[list["Entity"]],
+    results: list[list["Entity"]],
+):
+    """
+    Union the entities of each group the LLM merged into the first one
+    """
+    merged = 0
+    for group, result in zip(es_groups, results):
+        if len(group) == 1 or len(result) != 1:
+            continue
+        canonical = result[0].name
+        aliases = [e.name for e in group]
+        for alias in aliases:
+            store.union(alias, canonical)
+        for e in store.get(canonical):
+            e.properties["_alias"] = aliases
+        merged += 1
+    log.info(f"Merged {merged} groups of entities by LLM, Entity: {len(store)}")
+
+
+async def async_merge_er_by_llm(
+    es: list["Entity"],
+    rs: list["Relationship"],
+    llm: "AsyncLLM",
+    candidates: Callable[[np.ndarray, float], Iterator[tuple[int, int, float]]] = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Merge entities and relationships by LLM as `merge_er_by_llm`, with the embedding and
+    merge requests running concurrently on one event loop
+    """
+
+    async def process_group(es_group: list["Entity"]) -> list["Entity"]:
+        if len(es_group) == 1:
+            return es_group
+        return await async_merge_e_with_llm(es_group, llm)
+
+    store = EntityStore()
+    store.add(es, rs)
+    es = store.entities()
+    entity_embeddings = await async_get_entity_embedding(es, llm)
+    g = create_graph(es, entity_embeddings, candidates=candidates)
+    es_groups = get_er_groups(g)
+    results = await asyncio.gather(*[process_group(group) for group in es_groups])
+    _union_merged_groups(store, es_groups, results)
+    return store.to_er()
@@ -1,15 +1,26 @@
 import os
-from typing import Optional, Dict
+import re
+import base64
 import logging
+import threading
+import unicodedata
+import concurrent.futures
+from collections import Counter
+from typing import Optional, Dict
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 import fitz
+import numpy as np
 import shapely.geometry as sg
+from shapely.strtree import STRtree
 from shapely.geometry.base import BaseGeometry
 from shapely.validation import explain_validity
-import concurrent.futures
+
+from ..common.llm import LLM
+from ..common.cache import ResponseCache
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
 
 DEFAULT_PROMPT = """Use markdown syntax to convert the text recognized from the image into markdown format. You must adhere to the following guidelines:
 1. Output the text in the same language as recognized in the image. For example, if English text is detected, the output must also be in English.
@@ -20,6 +31,9 @@ Emphasize again: do not provide explanations or unrelated information; simply ou
 """
 DEFAULT_RECT_PROMPT = """Certain areas have been highlighted in red boxes and labeled with the name (%s) in the image. If an area is a table or an image, please insert it into the output using the format ![](), where the brackets should contain the title of the image or table. Otherwise, output the text content directly.
 """
+# fonts of math formulas, e.g. Computer Modern math, AMS and Symbol fonts
+_MATH_FONT_RE = re.compile(r"CMMI|CMSY|CMEX|MSAM|MSBM|Math|Symbol|STIX", re.IGNORECASE)
+
 DEFAULT_ROLE_PROMPT = """You are a PDF document parser. Please output the content of images using Markdown and LaTeX syntax.
 """
 
@@ -57,6 +71,32 @@ def _union_rects(rect1: BaseGeometry, rect2: BaseGeometry) -> BaseGeometry:
     return sg.box(*(rect1.union(rect2).bounds))
 
 
+def _near_mask(
+    rect: np.ndarray,
+    others: np.ndarray,
+    distance: float,
+    horizontal_distance: Optional[float],
+) -> np.ndarray:
+    """
+    Vectorized `_is_near` and `_is_horizontal_near` of a rectangle and other rectangles, as bounds.
+    The distance of the rectangles buffered by 0.1 is their distance minus 0.2.
+    """
+    dx = np.maximum(0, np.maximum(rect[0] - others[:, 2], others[:, 0] - rect[2]))
+    dy = np.maximum(0, np.maximum(rect[1] - others[:, 3], others[:, 1] - rect[3]))
+    near = np.maximum(0, np.hypot(dx, dy) - 0.2) < distance
+    if horizontal_distance:
+        is_line = (abs(rect[3] - rect[1]) < 0.1) | (
+            np.abs(others[:, 3] - others[:, 1]) < 0.1
+        )
+        near |= (
+            is_line
+            & (np.abs(others[:, 0] - rect[0]) < 0.1)
+            & (np.abs(others[:, 2] - rect[2]) < 0.1)
+            & (np.abs(others[:, 3] - rect[3]) < horizontal_distance)
+        )
+    return near
+
+
 def _merge_rects(
     rect_list: list[BaseGeometry],
     distance: float = 20,
@@ -64,24 +104,76 @@ def _merge_rects(
 ) -> list[BaseGeometry]:
     """
     Merge rectangles in the list if the distance between them is less than the target.
+    Each pass takes the rectangles in order and merges into each one the following near rectangles,
+    found with a spatial index instead of scanning the list; the passes repeat until nothing merges.
     """
+    reach = distance + 0.2
+    reach_y = max(reach, horizontal_distance or 0)
+    geoms = list(rect_list)
     merged = True
-    while merged:
+    while merged and geoms:
         merged = False
-        new_rect_list = []
-        while rect_list:
-            rect = rect_list.pop(0)
-            for other_rect in rect_list:
-                if _is_near(rect, other_rect, distance) or (
-                    horizontal_distance
-                    and _is_horizontal_near(rect, other_rect, horizontal_distance)
-                ):
-                    rect = _union_rects(rect, other_rect)
-                    rect_list.remove(other_rect)
-                    merged = True
-            new_rect_list.append(rect)
-        rect_list = new_rect_list
-    return rect_list
+        bounds = np.array([rect.bounds for rect in geoms], dtype=float)
+        tree = STRtree(geoms)
+        n = len(geoms)
+        live = np.ones(n, dtype=bool)
+        # the next live rectangle at or after each position, with path compression
+        next_live = list(range(n + 1))
+
+        def find_live(index: int) -> int:
+            root = index
+            while next_live[root] != root:
+                root = next_live[root]
+            while next_live[index] != root:
+                next_live[index], index = root, next_live[index]
+            return root
+
+        new_geoms: list[BaseGeometry] = []
+        for index in range(n):
+            if not live[index]:
+                continue
+            live[index] = False
+            next_live[index] = index + 1
+            rect = bounds[index].copy()
+            rect_merged = False
+            position = index
+            near = None
+            while True:
+                if near is None:
+                    candidates = tree.query(
+                        sg.box(
+                            rect[0] - reach,
+                            rect[1] - reach_y,
+                            rect[2] + reach,
+                            rect[3] + reach_y,
+                        )
+                    )
+                    candidates = candidates[(candidates > position) & live[candidates]]
+                    near = np.sort(
+                        candidates[
+                            _near_mask(
+                                rect, bounds[candidates], distance, horizontal_distance
+                            )
+                        ]
+                    )
+                start = np.searchsorted(near, position, side="right")
+                if start == len(near):
+                    break
+                other = near[start]
+                lower = np.minimum(rect[:2], bounds[other, :2])
+                upper = np.maximum(rect[2:], bounds[other, 2:])
+                if (lower != rect[:2]).any() or (upper != rect[2:]).any():
+                    # the rectangle grew, the near rectangles have to be found again
+                    rect[:2], rect[2:] = lower, upper
+                    near = None
+                live[other] = False
+                next_live[other] = other + 1
+                rect_merged = merged = True
+                # removing from the list while iterating over it skips the following rectangle
+                position = find_live(other + 1)
+            new_geoms.append(sg.box(*rect) if rect_merged else geoms[index])
+        geoms = new_geoms
+    return geoms
 
 
 def _adsorb_rects_to_rects(
@@ -164,66 +256,190 @@ def _parse_rects(page: fitz.Page) -> list[tuple[float, float, float, float]]:
     return [rect.bounds for rect in merged_rects]
 
 
+def _is_text_only(page_text: dict) -> bool:
+    """
+    Check if the text of a page without figures or tables, its `page.get_text("dict")`, can be used
+    as is: it has text, and no math fonts or math symbols that need the model to be written in LaTeX.
+    """
+    chars = 0
+    math_chars = 0
+    for block in page_text["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                if _MATH_FONT_RE.search(span["font"]):
+                    return False
+                chars += len(span["text"])
+                math_chars += sum(
+                    1 for ch in span["text"] if unicodedata.category(ch) == "Sm"
+                )
+    return chars > 0 and math_chars <= 0.01 * chars
+
+
+def _join_lines(lines: list[str]) -> str:
+    """
+    Join the lines of a text block, removing the hyphenation and the line breaks of CJK text.
+    """
+    text = lines[0]
+    for line in lines[1:]:
+        if text.endswith("-") and len(text) > 1 and text[-2].isalpha():
+            text = text[:-1] + line
+        elif ord(text[-1]) > 0x2E80 and ord(line[0]) > 0x2E80:
+            text += line
+        else:
+            text += " " + line
+    return text
+
+
+def _page_to_markdown(page_text: dict) -> str:
+    """
+    Convert the `page.get_text("dict")` of a text-only page to markdown,
+    the headings are the blocks with a larger or bold font.
+    """
+    blocks = []
+    sizes: Counter = Counter()
+    for block in page_text["blocks"]:
+        lines = []
+        spans = []
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append(text)
+                spans.extend(span for span in line["spans"] if span["text"].strip())
+        if not lines:
+            continue
+        for span in spans:
+            sizes[round(span["size"], 1)] += len(span["text"])
+        blocks.append((lines, spans))
+    if not blocks:
+        return ""
+    body_size = sizes.most_common(1)[0][0]
+
+    parts = []
+    for lines, spans in blocks:
+        text = _join_lines(lines)
+        # 忽略页码
+        if text.isdigit():
+            continue
+        # spans of size 0, e.g. of Type 3 fonts, have no relative size
+        ratio = (
+            max(span["size"] for span in spans) / body_size if body_size > 0 else 1.0
+        )
+        bold = all(span["flags"] & 16 for span in spans)
+        level = 0
+        if len(lines) <= 2 and len(text) < 120:
+            if ratio >= 1.5:
+                level = 1
+            elif ratio >= 1.25:
+                level = 2
+            elif ratio >= 1.1 or (bold and len(lines) == 1):
+                level = 3
+        parts.append("#" * level + " " + text if level else text)
+    return "\n\n".join(parts)
+
+
+def _render_page(
+    page: fitz.Page, page_index: int, output_dir: str, text_fast_path: bool = False
+) -> tuple[Optional[str], list[str], Optional[str]]:
+    """
+    Save the regions of the page and the page with the regions boxed and named as images,
+    and return the page image, the region images and no markdown.
+    With `text_fast_path`, a page without regions whose text is clean is converted to markdown
+    locally instead, saved as `<page_index>.md` and returned with no page image.
+    """
+    logging.info(f"parse page: {page_index}")
+    rect_images = []
+    rects = _parse_rects(page)
+    if text_fast_path and not rects:
+        page_text = page.get_text("dict")
+        if _is_text_only(page_text):
+            page_markdown = os.path.join(output_dir, f"{page_index}.md")
+            with open(page_markdown, "w", encoding="utf-8") as f:
+                f.write(_page_to_markdown(page_text))
+            return None, [], page_markdown
+    for index, rect in enumerate(rects):
+        fitz_rect = fitz.Rect(rect)
+        # 保存页面为图片
+        pix = page.get_pixmap(clip=fitz_rect, matrix=fitz.Matrix(4, 4))
+        name = f"{page_index}_{index}.png"
+        pix.save(os.path.join(output_dir, name))
+        rect_images.append(name)
+        # # 在页面上绘制红色矩形
+        big_fitz_rect = fitz.Rect(
+            fitz_rect.x0 - 1, fitz_rect.y0 - 1, fitz_rect.x1 + 1, fitz_rect.y1 + 1
+        )
+        # 空心矩形
+        page.draw_rect(big_fitz_rect, color=(1, 0, 0), width=1)
+        # 在矩形内的左上角写上矩形的索引name，添加一些偏移量
+        text_x = fitz_rect.x0 + 2
+        text_y = fitz_rect.y0 + 10
+        text_rect = fitz.Rect(text_x, text_y - 9, text_x + 80, text_y + 2)
+        # 绘制白色背景矩形
+        page.draw_rect(text_rect, color=(1, 1, 1), fill=(1, 1, 1))
+        # 插入带有白色背景的文字
+        page.insert_text((text_x, text_y), name, fontsize=10, color=(1, 0, 0))
+    page_image_with_rects = page.get_pixmap(matrix=fitz.Matrix(3, 3))
+    page_image = os.path.join(output_dir, f"{page_index}.png")
+    page_image_with_rects.save(page_image)
+    return page_image, rect_images, None
+
+
+def _render_page_range(
+    pdf_path: str,
+    start: int,
+    stop: int,
+    output_dir: str,
+    text_fast_path: bool = False,
+) -> list[tuple[Optional[str], list[str], Optional[str]]]:
+    """
+    Render the pages [start, stop) of the PDF, in a worker process with its own document.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return [
+            _render_page(
+                pdf_document[page_index], page_index, output_dir, text_fast_path
+            )
+            for page_index in range(start, stop)
+        ]
+
+
 def _parse_pdf_to_images(
-    pdf_path: str, output_dir: str = "./"
-) -> list[tuple[str, list[str]]]:
+    pdf_path: str,
+    output_dir: str = "./",
+    render_worker: int = 1,
+    text_fast_path: bool = False,
+) -> list[tuple[Optional[str], list[str], Optional[str]]]:
     """
     Parse PDF to images and save to output_dir.
+    With `render_worker` > 1, ranges of pages are rendered in parallel by worker processes.
+    With `text_fast_path`, text-only pages are converted to markdown instead, see `_render_page`.
     """
-    # 打开PDF文件
-    pdf_document = fitz.open(pdf_path)
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+    if render_worker <= 1 or page_count <= 1:
+        return _render_page_range(pdf_path, 0, page_count, output_dir, text_fast_path)
+
+    # several small ranges per worker, so that pages with many regions do not leave workers idle
+    step = max(1, -(-page_count // (render_worker * 4)))
+    starts = list(range(0, page_count, step))
+    stops = [min(start + step, page_count) for start in starts]
     image_infos = []
-
-    for page_index, page in enumerate(pdf_document):
-        logging.info(f"parse page: {page_index}")
-        rect_images = []
-        rects = _parse_rects(page)
-        for index, rect in enumerate(rects):
-            fitz_rect = fitz.Rect(rect)
-            # 保存页面为图片
-            pix = page.get_pixmap(clip=fitz_rect, matrix=fitz.Matrix(4, 4))
-            name = f"{page_index}_{index}.png"
-            pix.save(os.path.join(output_dir, name))
-            rect_images.append(name)
-            # # 在页面上绘制红色矩形
-            big_fitz_rect = fitz.Rect(
-                fitz_rect.x0 - 1, fitz_rect.y0 - 1, fitz_rect.x1 + 1, fitz_rect.y1 + 1
-            )
-            # 空心矩形
-            page.draw_rect(big_fitz_rect, color=(1, 0, 0), width=1)
-            # 在矩形内的左上角写上矩形的索引name，添加一些偏移量
-            text_x = fitz_rect.x0 + 2
-            text_y = fitz_rect.y0 + 10
-            text_rect = fitz.Rect(text_x, text_y - 9, text_x + 80, text_y + 2)
-            # 绘制白色背景矩形
-            page.draw_rect(text_rect, color=(1, 1, 1), fill=(1, 1, 1))
-            # 插入带有白色背景的文字
-            page.insert_text((text_x, text_y), name, fontsize=10, color=(1, 0, 0))
-        page_image_with_rects = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-        page_image = os.path.join(output_dir, f"{page_index}.png")
-        page_image_with_rects.save(page_image)
-        image_infos.append((page_image, rect_images))
-
-    pdf_document.close()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=render_worker) as executor:
+        for infos in executor.map(
+            _render_page_range,
+            [pdf_path] * len(starts),
+            starts,
+            stops,
+            [output_dir] * len(starts),
+            [text_fast_path] * len(starts),
+        ):
+            image_infos.extend(infos)
     return image_infos
 
 
-def _gpt_parse_images(
-    image_infos: list[tuple[str, list[str]]],
-    prompt_dict: Optional[Dict] = None,
-    output_dir: str = "./",
-    api_key: Optional[str] = None,
-    base_url: Optional[str] = None,
-    model: str = "gpt-4o",
-    verbose: bool = False,
-    gpt_worker: int = 1,
-    **args,
-) -> str:
+def _resolve_prompts(prompt_dict: Optional[Dict]) -> tuple[str, str, str]:
     """
-    Parse images to markdown content.
+    Get the page, rect and role prompts, the user prompts override the default ones.
     """
-    from GeneralAgent import Agent
-
     if isinstance(prompt_dict, dict) and "prompt" in prompt_dict:
         prompt = prompt_dict["prompt"]
         logging.info("prompt is provided, using user prompt.")
@@ -242,44 +458,92 @@ def _gpt_parse_images(
     else:
         role_prompt = DEFAULT_ROLE_PROMPT
         logging.info("role_prompt is not provided, using default prompt.")
+    return prompt, rect_prompt, role_prompt
 
-    def _process_page(index: int, image_info: tuple[str, list[str]]) -> tuple[int, str]:
-        logging.info(f"gpt parse page: {index}")
-        agent = Agent(
-            role=role_prompt,
-            api_key=api_key,
-            base_url=base_url,
-            disable_python_run=True,
-            model=model,
-            **args,
-        )
-        page_image, rect_images = image_info
-        local_prompt = prompt
-        if rect_images:
-            local_prompt += rect_prompt + ", ".join(rect_images)
-        content = agent.run([local_prompt, {"image": page_image}], display=verbose)
-        return index, content
-
-    contents = [None] * len(image_infos)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=gpt_worker) as executor:
-        futures = [
-            executor.submit(_process_page, index, image_info)
-            for index, image_info in enumerate(image_infos)
-        ]
-        for future in concurrent.futures.as_completed(futures):
-            index, content = future.result()
-
-            # 在某些情况下大模型还是会输出 ```markdown ```字符串
-            if "```markdown" in content:
-                content = content.replace("```markdown\n", "")
-                last_backticks_pos = content.rfind("```")
-                if last_backticks_pos != -1:
-                    content = (
-                        content[:last_backticks_pos] + content[last_backticks_pos + 3 :]
-                    )
 
-            contents[index] = content
+def _image_url(image_path: str) -> str:
+    """
+    The data URL of a PNG image
+    """
+    with open(image_path, "rb") as f:
+        return "data:image/png;base64," + base64.b64encode(f.read()).decode("utf-8")
+
 
+def _gpt_parse_page(
+    index: int,
+    image_info: tuple[Optional[str], list[str], Optional[str]],
+    prompts: tuple[str, str, str],
+    llm: "LLM",
+    model: str = "gpt-4o",
+    verbose: bool = False,
+    use_cache: bool = True,
+    refresh: bool = False,
+) -> str:
+    """
+    Parse a page image to markdown content, the text-only pages are already converted locally.
+    The request is cached by the response cache of `llm`, if it has one, see `LLM.chat`.
+    """
+    page_image, rect_images, page_markdown = image_info
+    if page_markdown:
+        with open(page_markdown, "r", encoding="utf-8") as f:
+            return f.read()
+
+    logging.info(f"gpt parse page: {index}")
+    prompt, rect_prompt, role_prompt = prompts
+    local_prompt = prompt
+    if rect_images:
+        local_prompt += rect_prompt + ", ".join(rect_images)
+    messages = [
+        {"role": "system", "content": role_prompt},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": local_prompt},
+                {"type": "image_url", "image_url": {"url": _image_url(page_image)}},
+            ],
+        },
+    ]
+    content = llm.chat(
+        messages,
+        callback=(lambda token: print(token, end="", flush=True)) if verbose else None,
+        model=model,
+        use_cache=use_cache,
+        refresh=refresh,
+        tag="pdf:page",
+    )
+
+    # 在某些情况下大模型还是会输出 ```markdown ```字符串
+    if "```markdown" in content:
+        content = content.replace("```markdown\n", "")
+        last_backticks_pos = content.rfind("```")
+        if last_backticks_pos != -1:
+            content = content[:last_backticks_pos] + content[last_backticks_pos + 3 :]
+    return content
+
+
+def _page_llm(
+    llm: Optional["LLM"],
+    api_key: Optional[str],
+    base_url: Optional[str],
+    cache: Optional[ResponseCache],
+) -> "LLM":
+    """
+    The client of the page requests, `cache` is the response cache of the default client
+    """
+    if llm is None:
+        return LLM(api_key=api_key, base_url=base_url, cache=cache)
+    if cache is not None:
+        raise ValueError("cache is for the default client, configure the cache of llm")
+    return llm
+
+
+def _remove_files(*paths: Optional[str]):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _write_output(contents: list[str], output_dir: str) -> str:
     output_path = os.path.join(output_dir, "output.md")
     with open(output_path, "w", encoding="utf-8") as f:
         f.write("\n\n".join(contents))
@@ -287,6 +551,108 @@ def _gpt_parse_images(
     return "\n\n".join(contents)
 
 
+def _gpt_parse_images(
+    image_infos: list[tuple[Optional[str], list[str], Optional[str]]],
+    prompt_dict: Optional[Dict] = None,
+    output_dir: str = "./",
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    model: str = "gpt-4o",
+    verbose: bool = False,
+    gpt_worker: int = 1,
+    llm: Optional["LLM"] = None,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+    refresh: bool = False,
+) -> str:
+    """
+    Parse images to markdown content.
+    The pages are requested with `llm`, by default a client of `api_key`, `base_url` and `cache`,
+    so they share its rate limiter and response cache with the other requests of the client.
+    With a response cache, a rerun after a failure only requests the pages that are not parsed yet;
+    `use_cache=False` bypasses it and `refresh=True` requests every page again.
+    """
+    llm = _page_llm(llm, api_key, base_url, cache)
+    prompts = _resolve_prompts(prompt_dict)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=gpt_worker) as executor:
+        futures = [
+            executor.submit(
+                _gpt_parse_page,
+                index,
+                image_info,
+                prompts,
+                llm,
+                model,
+                verbose,
+                use_cache,
+                refresh,
+            )
+            for index, image_info in enumerate(image_infos)
+        ]
+        contents = [future.result() for future in futures]
+
+    return _write_output(contents, output_dir)
+
+
+def _stream_parse_pdf(
+    pdf_path: str,
+    prompt_dict: Optional[Dict] = None,
+    output_dir: str = "./",
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    model: str = "gpt-4o",
+    verbose: bool = False,
+    gpt_worker: int = 1,
+    queue_depth: Optional[int] = None,
+    text_fast_path: bool = False,
+    llm: Optional["LLM"] = None,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+    refresh: bool = False,
+) -> tuple[str, list[tuple[Optional[str], list[str], Optional[str]]]]:
+    """
+    Render the pages and parse each one as soon as it is rendered.
+    At most `queue_depth` pages are rendered and not yet parsed, so rendering waits for the model
+    instead of filling the disk; the page images are removed once parsed unless `verbose`.
+    The pages are requested and cached as in `_gpt_parse_images`.
+    """
+    llm = _page_llm(llm, api_key, base_url, cache)
+    prompts = _resolve_prompts(prompt_dict)
+    slots = threading.BoundedSemaphore(queue_depth or 2 * gpt_worker)
+
+    def parse(
+        index: int, image_info: tuple[Optional[str], list[str], Optional[str]]
+    ) -> str:
+        try:
+            return _gpt_parse_page(
+                index,
+                image_info,
+                prompts,
+                llm,
+                model,
+                verbose,
+                use_cache,
+                refresh,
+            )
+        finally:
+            if not verbose:
+                _remove_files(image_info[0], image_info[2])
+            slots.release()
+
+    image_infos = []
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=gpt_worker) as executor:
+        with fitz.open(pdf_path) as pdf_document:
+            for page_index, page in enumerate(pdf_document):
+                slots.acquire()
+                image_info = _render_page(page, page_index, output_dir, text_fast_path)
+                image_infos.append(image_info)
+                futures.append(executor.submit(parse, page_index, image_info))
+        contents = [future.result() for future in futures]
+
+    return _write_output(contents, output_dir), image_infos
+
+
 def parse_pdf(
     pdf_path: str,
     output_dir: str = "./",
@@ -296,32 +662,79 @@ def parse_pdf(
     model: str = "gpt-4o",
     verbose: bool = False,
     gpt_worker: int = 1,
-    **args,
+    render_worker: int = 1,
+    stream: bool = False,
+    queue_depth: Optional[int] = None,
+    text_fast_path: bool = False,
+    llm: Optional["LLM"] = None,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+    refresh: bool = False,
 ) -> tuple[str, list[str]]:
     """
     Parse a PDF file to a markdown file.
+    With `stream`, each page is parsed as soon as it is rendered, see `_stream_parse_pdf`;
+    the pages are rendered one by one, `render_worker` is only for the batch mode.
+    With `text_fast_path`, the pages without figures, tables or equations are converted locally
+    and only the other pages are parsed by the model.
+    The pages are requested with `llm`, by default a client of `api_key`, `base_url` and `cache`.
+    With a response cache, parsing the PDF again only requests the changed pages;
+    `use_cache=False` bypasses the cache and `refresh=True` requests every page again.
     """
+    if stream and render_worker > 1:
+        raise ValueError("render_worker is not supported with stream")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    image_infos = _parse_pdf_to_images(pdf_path, output_dir=output_dir)
-    content = _gpt_parse_images(
-        image_infos=image_infos,
-        output_dir=output_dir,
-        prompt_dict=prompt,
-        api_key=api_key,
-        base_url=base_url,
-        model=model,
-        verbose=verbose,
-        gpt_worker=gpt_worker,
-        **args,
-    )
+    if stream:
+        content, image_infos = _stream_parse_pdf(
+            pdf_path,
+            prompt_dict=prompt,
+            output_dir=output_dir,
+            api_key=api_key,
+            base_url=base_url,
+            model=model,
+            verbose=verbose,
+            gpt_worker=gpt_worker,
+            queue_depth=queue_depth,
+            text_fast_path=text_fast_path,
+            llm=llm,
+            cache=cache,
+            use_cache=use_cache,
+            refresh=refresh,
+        )
+    else:
+        image_infos = _parse_pdf_to_images(
+            pdf_path,
+            output_dir=output_dir,
+            render_worker=render_worker,
+            text_fast_path=text_fast_path,
+        )
+        content = _gpt_parse_images(
+            image_infos=image_infos,
+            output_dir=output_dir,
+            prompt_dict=prompt,
+            api_key=api_key,
+            base_url=base_url,
+            model=model,
+            verbose=verbose,
+            gpt_worker=gpt_worker,
+            llm=llm,
+            cache=cache,
+            use_cache=use_cache,
+            refresh=refresh,
+        )
+
+    if text_fast_path:
+        local_pages = sum(1 for _, _, page_markdown in image_infos if page_markdown)
+        logging.info(
+            f"converted {local_pages}/{len(image_infos)} text-only pages without the model"
+        )
 
     all_rect_images = []
     # remove all rect images
     if not verbose:
-        for page_image, rect_images in image_infos:
-            if os.path.exists(page_image):
-                os.remove(page_image)
+        for page_image, rect_images, page_markdown in image_infos:
+            _remove_files(page_image, page_markdown)
             all_rect_images.extend(rect_images)
     return content, all_rect_images
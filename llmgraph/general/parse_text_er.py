@@ -5,28 +5,43 @@
 import re
 import json
 import logging
-
+from typing import Any, Callable, Iterator, Union
 
 from ..dataclass import Entity, Relationship
-from ..common.tools import shorten_string, remove_duplicates
+from ..common.tools import shorten_string
+from .entity_store import EntityStore
 
 log = logging.getLogger("llmgraph")
 
 
+_ACRONYM_RE = re.compile(r"\b([A-Za-z\s]+)\s?\(([A-Z]+)\)")
+_ACRONYM_STOP_WORDS = {"of", "is", "the", "and", "in", "on", "at", "to"}
+
+_ENTITY_P = r"<([^,]+),\s?([^,]+),\s?(\{[^\}]*\}),\s?(\[[^\]]*\])>"
+_RELATIONSHIP_P = r"<([^,]+),\s?([^,]+),\s?([^,]+),\s?(\{[^\}]*\}),\s?(\[[^\]]*\])>"
+_ENTITY_RE = re.compile(_ENTITY_P, re.MULTILINE)
+_RELATIONSHIP_RE = re.compile(_RELATIONSHIP_P, re.MULTILINE)
+
+# one scanner over the whole response: section headers, relationship and entity tuples
+_ER_TOKEN_RE = re.compile(
+    r"(?P<entities>Entities:)|(?P<relationships>Relationships:)"
+    + f"|(?P<relationship>{_RELATIONSHIP_P})|(?P<entity>{_ENTITY_P})",
+    re.MULTILINE,
+)
+_RELATIONSHIP_GROUP = _ER_TOKEN_RE.groupindex["relationship"]
+_ENTITY_GROUP = _ER_TOKEN_RE.groupindex["entity"]
+
+
 def extract_acronym(text: str) -> list[tuple[str, str]]:
     """
     Extract acronyms from text
     """
-    pattern = r"\b([A-Za-z\s]+)\s?\(([A-Z]+)\)"
-
-    matches = re.findall(pattern, text)
-
     result = []
-    for full_text, acronym in matches:
+    for full_text, acronym in _ACRONYM_RE.findall(text):
         words = [
             word
             for word in full_text.split()
-            if word.lower() not in {"of", "is", "the", "and", "in", "on", "at", "to"}
+            if word.lower() not in _ACRONYM_STOP_WORDS
         ]
 
         if len(words) >= len(acronym):
@@ -35,102 +50,168 @@ def extract_acronym(text: str) -> list[tuple[str, str]]:
     return result
 
 
+def _loads(raw: str, kind: str):
+    """
+    Load the JSON properties ("{...}") or references ("[...]") of a tuple, empty ones are not parsed
+    """
+    raw = raw.strip()
+    empty = {} if raw[0] == "{" else []
+    if raw in ("{}", "[]"):
+        return empty
+    try:
+        return json.loads(raw)
+    except (json.JSONDecodeError, TypeError) as e:
+        log.warning("Invalid %s: %s, exception: %s", kind, raw, e)
+        return empty
+
+
+def _to_entity(groups: tuple) -> "Entity":
+    name, label, properties, references = groups
+    return Entity(
+        name=name.replace('"', "").strip(),
+        label=label.replace('"', "").strip(),
+        properties=_loads(properties, "entity properties"),
+        references=_loads(references, "entity references"),
+    )
+
+
+def _to_relationship(groups: tuple) -> "Relationship":
+    start, relationship_type, end, properties, references = groups
+    return Relationship(
+        start=start.replace('"', "").strip(),
+        end=end.replace('"', "").strip(),
+        type=relationship_type.replace('"', "").strip(),
+        properties=_loads(properties, "rel properties"),
+        references=_loads(references, "rel references"),
+    )
+
+
 def e_raw_parse(text: str) -> list["Entity"]:
     """
     Extract entities from raw text
     """
-    entities: list["Entity"] = []
-    entity_pattern = r"<([^,]+),\s?([^,]+),\s?(\{[^\}]*\}),\s?(\[[^\]]*\])>"
-    matches = re.finditer(entity_pattern, text, re.MULTILINE)
-
-    for _, match in enumerate(matches, start=1):
-        if len(match.groups()) < 4:
-            log.warning(f"Invalid entity: {match}")
-            continue
-        name: str = match.group(1).replace('"', "").strip()
-        label: str = match.group(2).replace('"', "").strip()
-        properties: str = match.group(3).strip()
-        references: str = match.group(4).strip()
-        try:
-            properties = json.loads(properties)
-        except (json.JSONDecodeError, TypeError) as e:
-            log.warning("Invalid entity properties: %s exception: %s", properties, e)
-            properties = {}
-        try:
-            references: list[str] = json.loads(references)
-        except (json.JSONDecodeError, TypeError) as e:
-            log.warning("Invalid entity references: %s, exception: %s", references, e)
-            references = []
-
-        entities.append(
-            Entity(name=name, label=label, properties=properties, references=references)
-        )
-    return entities
+    return [_to_entity(match.groups()) for match in _ENTITY_RE.finditer(text)]
 
 
 def r_raw_parse(text: str) -> list["Relationship"]:
     """
     Extract relationships from raw text
     """
-    relationships: list["Relationship"] = []
-    relationship_pattern = (
-        r"<([^,]+),\s?([^,]+),\s?([^,]+),\s?(\{[^\}]*\}),\s?(\[[^\]]*\])>"
-    )
-    matches = re.finditer(relationship_pattern, text, re.MULTILINE)
-
-    for _, match in enumerate(matches, start=1):
-        if len(match.groups()) < 5:
-            log.warning(f"Invalid relationship: {match}")
-            continue
-        start: str = match.group(1).replace('"', "").strip()
-        relationship_type: str = match.group(2).replace('"', "").strip()
-        end: str = match.group(3).replace('"', "").strip()
-        properties: str = match.group(4).strip()
-        references: str = match.group(5).strip()
-        try:
-            properties = json.loads(properties)
-        except Exception as e:
-            log.warning("Invalid rel properties: %s, exception: %s", properties, e)
-            properties = {}
-        try:
-            references: list[str] = json.loads(references)
-        except Exception as e:
-            log.warning("Invalid rel references: %s, exception: %s", references, e)
-            references = []
-
-        relationships.append(
-            Relationship(
-                start=start, end=end, type=relationship_type, properties=properties
+    return [
+        _to_relationship(match.groups()) for match in _RELATIONSHIP_RE.finditer(text)
+    ]
+
+
+def iter_rawtext_er(rawtext: str) -> Iterator[Union["Entity", "Relationship"]]:
+    """
+    Scan rawtext once and yield entities found under "Entities:" and relationships found under
+    "Relationships:". Responses concatenated from several turns may repeat the sections.
+    """
+    section = None
+    for match in _ER_TOKEN_RE.finditer(rawtext):
+        kind = match.lastgroup
+        if kind in ("entities", "relationships"):
+            section = kind
+        elif kind == "entity" and section == "entities":
+            yield _to_entity(match.groups()[_ENTITY_GROUP : _ENTITY_GROUP + 4])
+        elif kind == "relationship" and section == "relationships":
+            yield _to_relationship(
+                match.groups()[_RELATIONSHIP_GROUP : _RELATIONSHIP_GROUP + 5]
             )
+
+
+class StreamingERParser:
+    """
+    Incremental parser to pass as the `callback` of `LLM.chat`. Tokens are buffered and every
+    entity or relationship is emitted through `on_item` as soon as its `<...>` tuple closes.
+    A parser can be fed several responses, e.g. the turns of a gleaning conversation: `mark`
+    is called when a response starts and `reset` drops only the items of that response.
+    """
+
+    def __init__(
+        self, on_item: Callable[[Union["Entity", "Relationship"]], Any] = None
+    ):
+        self.on_item = on_item
+        self.entities: list["Entity"] = []
+        self.relationships: list["Relationship"] = []
+        self._section = None
+        self._buffer = ""
+        self._mark = (0, 0, None, "")
+
+    def __call__(self, token: str):
+        self._buffer += token
+        if ">" not in token and ":" not in token:
+            return
+        last_end = 0
+        for match in _ER_TOKEN_RE.finditer(self._buffer):
+            last_end = match.end()
+            kind = match.lastgroup
+            if kind in ("entities", "relationships"):
+                self._section = kind
+            elif kind == "entity" and self._section == "entities":
+                self._emit(
+                    _to_entity(match.groups()[_ENTITY_GROUP : _ENTITY_GROUP + 4])
+                )
+            elif kind == "relationship" and self._section == "relationships":
+                self._emit(
+                    _to_relationship(
+                        match.groups()[_RELATIONSHIP_GROUP : _RELATIONSHIP_GROUP + 5]
+                    )
+                )
+        rest = self._buffer[last_end:]
+        # keep a possibly unfinished tuple or section header, drop the text in between
+        start = rest.rfind("<")
+        self._buffer = rest[start:] if start >= 0 else rest[-len("Relationships:") :]
+
+    def _emit(self, item: Union["Entity", "Relationship"]):
+        if isinstance(item, Entity):
+            self.entities.append(item)
+        else:
+            self.relationships.append(item)
+        if self.on_item:
+            self.on_item(item)
+
+    def mark(self):
+        """
+        Remember the items parsed so far, before a response is streamed
+        """
+        self._mark = (
+            len(self.entities),
+            len(self.relationships),
+            self._section,
+            self._buffer,
         )
-    return relationships
+
+    def reset(self):
+        """
+        Forget the tokens of the response since the last `mark`, before it is streamed again
+        """
+        entities, relationships, self._section, self._buffer = self._mark
+        self.entities = self.entities[:entities]
+        self.relationships = self.relationships[:relationships]
+
+    def result(self) -> tuple[list["Entity"], list["Relationship"]]:
+        return self.entities, self.relationships
 
 
 def parse_rawtext_to_er(rawtext: str) -> tuple[list["Entity"], list["Relationship"]]:
     """
     Parse rawtext to entities and relationships
     """
-    regex = r"Entities:\s*([\s\S]*?)Relationships:\s*([\s\S]*)"
-    match = re.search(regex, rawtext, re.DOTALL | re.MULTILINE)
-
-    raw_e = ""
-    raw_r = ""
+    es: list["Entity"] = []
+    rs: list["Relationship"] = []
+    for item in iter_rawtext_er(rawtext):
+        if isinstance(item, Entity):
+            es.append(item)
+        else:
+            rs.append(item)
 
-    if match and len(match.groups()) > 1:
-        raw_e = match.group(1)
-        raw_r = match.group(2)
-    else:
+    if "Entities:" not in rawtext or "Relationships:" not in rawtext:
         log.error(f"Can not parse entities and relationships from rawtext: {rawtext}")
         log.warning(
             f"Can not parse entity and rel from rawtext: {shorten_string(rawtext, 10,10)}"
         )
 
-    es: list["Entity"] = []
-    rs: list["Relationship"] = []
-
-    es.extend(e_raw_parse(raw_e))
-    rs.extend(r_raw_parse(raw_r))
-
     return es, rs
 
 
@@ -138,58 +219,9 @@ def merge_er(
     es: list["Entity"], rs: list["Relationship"]
 ) -> tuple[list["Entity"], list["Relationship"]]:
     """
-    Merge entities and relationships
+    Merge entities and relationships with an `EntityStore`, the inputs are left untouched
     Delete invalid relationships
     """
-
-    def merge_deduplicate(l1: list, l2: list) -> list:
-        result = l1 + l2
-        result = remove_duplicates(result)
-        return result
-
-    # Merge entities
-    me: dict[tuple, "Entity"] = {}
-    for entity in es:
-        key = (entity.name.upper(), entity.label.upper())
-        if key not in me:
-            me[key] = entity
-        else:
-            log.info(f"Merge entity: (name, label) = {key}")
-            me[key].properties.update(entity.properties)
-            me[key].references = merge_deduplicate(
-                me[key].references, entity.references
-            )
-
-            me[key].images = merge_deduplicate(me[key].images, entity.images)
-            me[key].chunks = merge_deduplicate(me[key].chunks, entity.chunks)
-
-    entity_names = [entity.name for entity in list(me.values())]
-    # Merge relationships
-    mr: dict[tuple, "Relationship"] = {}
-    for relationship in rs:
-        if (
-            relationship.start not in entity_names
-            or relationship.end not in entity_names
-        ):
-            log.warning(
-                "Invalid relationship, start or end not in existing entities: "
-                + f"(start, type, end) = {relationship.start, relationship.type, relationship.end}"
-            )
-            continue
-        key = (
-            relationship.start.upper(),
-            relationship.type.upper(),
-            relationship.end.upper(),
-        )
-        if key not in mr:
-            mr[key] = relationship
-        else:
-            # log.debug(f"Merge relationship: (start, type, end) = {key}")
-            mr[key].properties.update(relationship.properties)
-            mr[key].references = merge_deduplicate(
-                mr[key].references, relationship.references
-            )
-            mr[key].images = merge_deduplicate(mr[key].images, relationship.images)
-            mr[key].chunks = merge_deduplicate(mr[key].chunks, relationship.chunks)
-
-    return list(me.values()), list(mr.values())
+    store = EntityStore()
+    store.add(es, rs)
+    return store.to_er()
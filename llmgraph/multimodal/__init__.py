@@ -2,5 +2,7 @@ from .img import (
     extract_images_from_chunk,
     batch_extract_image_attri,
     batch_extract_er_from_images,
+    async_batch_extract_image_attri,
+    async_batch_extract_er_from_images,
 )
 from .text_parse import merge_images
@@ -2,11 +2,15 @@
 This module contains functions for processing images.
 """
 
+import asyncio
 import logging
 import concurrent.futures
+from functools import partial
 
 from ..common.tools import encode_image, merge_nearby_text
-from ..common.llm import LLM
+from ..common.llm import LLM, AsyncLLM
+from ..common.concurrency import AdaptiveConcurrency
+from ..common.checkpoint import RunCheckpoint
 from ..general.parse_text_er import parse_rawtext_to_er
 from ..dataclass import Image, Chunk, Entity, Relationship
 
@@ -16,7 +20,6 @@ from .prompts import (
     EXTRACT_IMAGE_ATTRS_P,
 )
 
-
 log = logging.getLogger("llmgraph")
 
 
@@ -44,16 +47,14 @@ def extract_images_from_chunk(
     return imgs
 
 
-def extract_image_attri(
-    image: "Image",
-    context_text: str,
-    llm: "LLM",
-) -> "Image":
+def _image_attri_messages(
+    image: "Image", context_text: str, image_dir: str = None
+) -> list[dict]:
     """
-    Extracts the attributes of images in context text
+    Build the messages to extract the attributes of an image, its path is relative to `image_dir`
     """
-    image_base64 = encode_image(image.path)
-    messages = [
+    image_base64 = encode_image(image.path, image_dir)
+    return [
         {"role": "system", "content": EXTRACT_IMAGE_ATTRS_P},
         {
             "role": "user",
@@ -67,7 +68,12 @@ def extract_image_attri(
             ],
         },
     ]
-    res = llm.chat(messages, callback=None, model="gpt-4o-mini")
+
+
+def _parse_image_attri(res: str, image: "Image") -> "Image":
+    """
+    Parse the llm response of image attributes into the image
+    """
     log.debug(f"Extracted image attributes: image = {image}, llm res = {res}")
     image = parse_attris_from_rawtext(res, image)
     log.info(
@@ -77,42 +83,111 @@ def extract_image_attri(
     return image
 
 
+def extract_image_attri(
+    image: "Image",
+    context_text: str,
+    llm: "LLM",
+    image_dir: str = None,
+) -> "Image":
+    """
+    Extracts the attributes of images in context text
+    """
+    messages = _image_attri_messages(image, context_text, image_dir)
+    res = llm.chat(messages, callback=None, model="gpt-4o-mini", tag="image:attri")
+    return _parse_image_attri(res, image)
+
+
+async def async_extract_image_attri(
+    image: "Image",
+    context_text: str,
+    llm: "AsyncLLM",
+    image_dir: str = None,
+) -> "Image":
+    """
+    Extracts the attributes of images in context text with the async client
+    """
+    messages = _image_attri_messages(image, context_text, image_dir)
+    res = await llm.chat(
+        messages, callback=None, model="gpt-4o-mini", tag="image:attri"
+    )
+    return _parse_image_attri(res, image)
+
+
 def batch_extract_image_attri(
     images: list["Image"],
     chunks: list["Chunk"],
     llm: "LLM",
     batch_size: int = 5,
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
+    image_dir: str = None,
 ) -> list["Image"]:
     """
-    Batch extract attributes of images in context text
+    Batch extract attributes of images in context text, the image paths are relative to `image_dir`.
+    With a controller, the concurrency adapts up to its max limit instead of the fixed `batch_size`.
+    With a checkpoint, the images done by a previous run are not extracted again.
     """
     results: list["Image"] = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
+    done: dict[str, dict] = {}
+    if checkpoint:
+        done = {r["path"]: r["image"] for r in checkpoint.records("image_attri")}
+    max_workers = controller.max_limit if controller else batch_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = []
         for img in images:
+            if img.path in done:
+                results.append(Image.from_dict(done[img.path]))
+                continue
             context_text = get_image_context_text(img, chunks)
-            futures.append(executor.submit(extract_image_attri, img, context_text, llm))
+            task = partial(extract_image_attri, img, context_text, llm, image_dir)
+            if controller:
+                task = partial(controller.run, task)
+            futures.append(executor.submit(task))
 
         for future in concurrent.futures.as_completed(futures):
             img = future.result()
+            if checkpoint:
+                checkpoint.append(
+                    "image_attri", {"path": img.path, "image": img.to_dict()}
+                )
             results.append(img)
     return results
 
 
-def extract_er_from_image(
-    image: "Image",
+async def async_batch_extract_image_attri(
+    images: list["Image"],
     chunks: list["Chunk"],
-    llm: "LLM",
-) -> tuple[list["Entity"], list["Relationship"]]:
+    llm: "AsyncLLM",
+    image_dir: str = None,
+) -> list["Image"]:
     """
-    Extract entities, relationships and images from an image
+    Extract attributes of all images concurrently on one event loop
+    """
+    return list(
+        await asyncio.gather(
+            *[
+                async_extract_image_attri(
+                    img, get_image_context_text(img, chunks), llm, image_dir
+                )
+                for img in images
+            ]
+        )
+    )
+
+
+def _image_er_messages(
+    image: "Image", chunks: list["Chunk"], image_dir: str = None
+) -> list[dict]:
     """
-    image_encode = encode_image(image.path)
+    Build the messages to extract entities and relationships from an image,
+    its path is relative to `image_dir`
+    """
+    image_encode = encode_image(image.path, image_dir)
     image_context_text = get_image_context_text(image, chunks)
     prompt = "The following is the context of the image:\n" + image_context_text
     prompt += "\nImage Attributes: \n" + str(image.to_dict())
 
-    messages = [
+    return [
         {"role": "system", "content": EXTRACT_IMAGE_ER_P},
         {
             "role": "user",
@@ -125,7 +200,14 @@ def extract_er_from_image(
             ],
         },
     ]
-    res = llm.chat(messages, callback=None, model="gpt-4o-mini")
+
+
+def _parse_image_er(
+    res: str, image: "Image"
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Parse the llm response of image ER extraction
+    """
     log.debug(f"Extracted ER from image {image}, llm res = {res}")
     es, rs = parse_rawtext_to_er(res)
     for e in es:
@@ -135,23 +217,81 @@ def extract_er_from_image(
     return es, rs
 
 
+def extract_er_from_image(
+    image: "Image",
+    chunks: list["Chunk"],
+    llm: "LLM",
+    image_dir: str = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities, relationships and images from an image
+    """
+    messages = _image_er_messages(image, chunks, image_dir)
+    res = llm.chat(messages, callback=None, model="gpt-4o-mini", tag="image:er")
+    return _parse_image_er(res, image)
+
+
+async def async_extract_er_from_image(
+    image: "Image",
+    chunks: list["Chunk"],
+    llm: "AsyncLLM",
+    image_dir: str = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities, relationships and images from an image with the async client
+    """
+    messages = _image_er_messages(image, chunks, image_dir)
+    res = await llm.chat(messages, callback=None, model="gpt-4o-mini", tag="image:er")
+    return _parse_image_er(res, image)
+
+
 def batch_extract_er_from_images(
     images: list["Image"],
     chunks: list["Chunk"],
     llm: "LLM",
     batch_size: int = 5,
+    controller: AdaptiveConcurrency = None,
+    checkpoint: RunCheckpoint = None,
+    image_dir: str = None,
 ) -> tuple[list["Entity"], list["Relationship"]]:
     """
-    Batch extract entities and relationships from images
+    Batch extract entities and relationships from images, the image paths are relative to `image_dir`.
+    With a controller, the concurrency adapts up to its max limit instead of the fixed `batch_size`.
+    With a checkpoint, the images done by a previous run are not extracted again.
     """
     results: list[tuple[list["Entity"], list["Relationship"]]] = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
-        futures = []
+    done: set[str] = set()
+    if checkpoint:
+        for record in checkpoint.records("image_er"):
+            done.add(record["path"])
+            results.append(
+                (
+                    [Entity.from_dict(e) for e in record["entities"]],
+                    [Relationship.from_dict(r) for r in record["relationships"]],
+                )
+            )
+    max_workers = controller.max_limit if controller else batch_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
         for img in images:
-            futures.append(executor.submit(extract_er_from_image, img, chunks, llm))
+            if img.path in done:
+                continue
+            task = partial(extract_er_from_image, img, chunks, llm, image_dir)
+            if controller:
+                task = partial(controller.run, task)
+            futures[executor.submit(task)] = img
 
         for future in concurrent.futures.as_completed(futures):
             result = future.result()
+            if checkpoint:
+                checkpoint.append(
+                    "image_er",
+                    {
+                        "path": futures[future].path,
+                        "entities": [e.to_dict() for e in result[0]],
+                        "relationships": [r.to_dict() for r in result[1]],
+                    },
+                )
             results.append(result)
     entities: list["Entity"] = []
     relationships: list["Relationship"] = []
@@ -160,3 +300,24 @@ def batch_extract_er_from_images(
         relationships.extend(rs)
 
     return entities, relationships
+
+
+async def async_batch_extract_er_from_images(
+    images: list["Image"],
+    chunks: list["Chunk"],
+    llm: "AsyncLLM",
+    image_dir: str = None,
+) -> tuple[list["Entity"], list["Relationship"]]:
+    """
+    Extract entities and relationships from all images concurrently on one event loop
+    """
+    results = await asyncio.gather(
+        *[async_extract_er_from_image(img, chunks, llm, image_dir) for img in images]
+    )
+    entities: list["Entity"] = []
+    relationships: list["Relationship"] = []
+    for es, rs in results:
+        entities.extend(es)
+        relationships.extend(rs)
+
+    return entities, relationships
@@ -0,0 +1,10 @@
+"""
+Unit tests, run from the repository root:
+
+    python -m unittest discover -s tests -t . -p "*_test.py"
+"""
+
+import os
+
+# llmgraph logs to logs/ in the working directory
+os.makedirs("logs", exist_ok=True)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+from llmgraph.common.cache import ResponseCache, make_cache_key
+
+from .fakes import fake_llm
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+
+    def test_key_covers_model_and_messages(self):
+        messages = [{"role": "user", "content": "hi"}]
+        key = make_cache_key("gpt-4o-mini", messages)
+        self.assertEqual(key, make_cache_key("gpt-4o-mini", [dict(messages[0])]))
+        self.assertNotEqual(key, make_cache_key("gpt-4o", messages))
+        self.assertNotEqual(
+            key, make_cache_key("gpt-4o-mini", [{"role": "user", "content": "hi!"}])
+        )
+
+    def test_least_recently_used_is_evicted(self):
+        # each entry takes len('{"content": "xx"}') = 17 bytes
+        cache = ResponseCache(self.cache_dir, max_bytes=40)
+        cache.set("a" * 64, "aa")
+        cache.set("b" * 64, "bb")
+        self.assertEqual(cache.get("a" * 64), "aa")
+        cache.set("c" * 64, "cc")
+        self.assertIsNone(cache.get("b" * 64))
+        self.assertEqual(cache.get("a" * 64), "aa")
+        self.assertEqual(
+            cache.stats(), {"hits": 2, "misses": 1, "entries": 2, "bytes": 34}
+        )
+
+    def test_entries_persist_across_instances(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.set("a" * 64, "知识图谱")
+        reopened = ResponseCache(self.cache_dir)
+        self.assertEqual(reopened.get("a" * 64), "知识图谱")
+        reopened.invalidate("a" * 64)
+        self.assertIsNone(ResponseCache(self.cache_dir).get("a" * 64))
+
+    def test_invalid_entry_is_a_miss(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.set("a" * 64, "aa")
+        with open(cache._path("a" * 64), "w", encoding="utf-8") as f:
+            f.write("{")
+        with self.assertLogs("llmgraph", level="WARNING"):
+            self.assertIsNone(cache.get("a" * 64))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class CachedChatTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "hi"}]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.answers = iter(["first", "second", "third"])
+        self.llm = fake_llm(
+            lambda messages: next(self.answers), cache=ResponseCache(self.tmp.name)
+        )
+
+    def chat(self, **kwargs) -> str:
+        tokens = []
+        content = self.llm.chat(self.messages, callback=tokens.append, **kwargs)
+        self.assertEqual("".join(tokens), content)
+        return content
+
+    def test_cached_response_is_not_requested(self):
+        self.assertEqual(self.chat(), "first")
+        self.assertEqual(self.chat(), "first")
+        self.assertEqual(len(self.llm.client.chat.completions.requests), 1)
+        usage = self.llm.usage.get("chat")
+        self.assertEqual((usage.calls, usage.cached_calls), (2, 1))
+
+    def test_bypass_and_refresh(self):
+        self.chat()
+        # bypassed, the cached response is neither read nor overwritten
+        self.assertEqual(self.chat(use_cache=False), "second")
+        self.assertEqual(self.chat(), "first")
+        self.assertEqual(self.chat(refresh=True), "third")
+        self.assertEqual(self.chat(), "third")
+        self.assertEqual(len(self.llm.client.chat.completions.requests), 3)
+
+    def test_other_model_is_not_shared(self):
+        self.chat()
+        self.assertEqual(self.chat(model="gpt-4o"), "second")
+
+
+if __name__ == "__main__":
+    unittest.main()
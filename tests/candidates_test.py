@@ -0,0 +1,118 @@
+import unittest
+
+import numpy as np
+
+from llmgraph.dataclass import Entity
+from llmgraph.general.candidates import (
+    RandomProjectionLSH,
+    recall_against_exact,
+    similar_pairs,
+)
+from llmgraph.general.merge_er import create_graph
+
+
+def clustered_embeddings(n: int, dim: int = 16, clusters: int = 8, seed: int = 0):
+    """
+    Rows scattered around a few random centers, so that many pairs are similar
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    rows = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim))
+    return rows.astype(np.float32)
+
+
+def brute_force_pairs(matrix: np.ndarray, threshold: float) -> dict:
+    pairs = {}
+    for i in range(len(matrix)):
+        for j in range(i + 1, len(matrix)):
+            a, b = matrix[i].astype(np.float64), matrix[j].astype(np.float64)
+            norm = np.linalg.norm(a) * np.linalg.norm(b)
+            sim = float(a @ b / norm) if norm else 0.0
+            if sim > threshold:
+                pairs[(i, j)] = sim
+    return pairs
+
+
+class SimilarPairsTest(unittest.TestCase):
+    def assert_same_pairs(self, matrix: np.ndarray, threshold: float, **kwargs):
+        expected = brute_force_pairs(matrix, threshold)
+        found = {
+            (i, j): sim for i, j, sim in similar_pairs(matrix, threshold, **kwargs)
+        }
+        self.assertEqual(sorted(found), sorted(expected))
+        for pair, sim in found.items():
+            self.assertAlmostEqual(sim, expected[pair], places=5)
+
+    def test_same_pairs_as_brute_force(self):
+        matrix = clustered_embeddings(70)
+        for threshold in (0.5, 0.9):
+            for block_size in (1, 7, 64, 1024):
+                self.assert_same_pairs(matrix, threshold, block_size=block_size)
+
+    def test_each_pair_once_across_blocks(self):
+        matrix = clustered_embeddings(30, seed=1)
+        pairs = [(i, j) for i, j, _ in similar_pairs(matrix, 0.5, block_size=4)]
+        self.assertTrue(pairs)
+        self.assertTrue(all(i < j for i, j in pairs))
+        self.assertEqual(len(pairs), len(set(pairs)))
+
+    def test_zero_and_duplicate_rows(self):
+        matrix = np.array([[1, 0], [0, 0], [1, 0], [0, 1]], dtype=np.float32)
+        self.assertEqual([(i, j) for i, j, _ in similar_pairs(matrix, 0.9)], [(0, 2)])
+        self.assert_same_pairs(matrix, 0.9, block_size=3)
+        self.assertEqual(list(similar_pairs(np.empty((0, 2)), 0.9)), [])
+
+
+class CreateGraphTest(unittest.TestCase):
+    def test_edges_are_the_similar_pairs(self):
+        matrix = clustered_embeddings(20, seed=2)
+        es = [Entity(name=f"e{i}") for i in range(20)]
+        embeddings = {e.name: row for e, row in zip(es, matrix)}
+        g = create_graph(es, embeddings, threshold=0.8)
+        self.assertEqual(list(g.nodes), [e.name for e in es])
+        self.assertEqual(
+            sorted(g.edges),
+            sorted((f"e{i}", f"e{j}") for i, j in brute_force_pairs(matrix, 0.8)),
+        )
+
+
+class RandomProjectionLSHTest(unittest.TestCase):
+    matrix = clustered_embeddings(400, dim=32, clusters=40)
+
+    def test_recall_against_exact(self):
+        lsh = RandomProjectionLSH(top_k=1000)
+        self.assertGreaterEqual(recall_against_exact(self.matrix, lsh, 0.9), 0.95)
+        # a single table misses most of the pairs
+        single = RandomProjectionLSH(num_tables=1, top_k=1000)
+        self.assertLess(recall_against_exact(self.matrix, single, 0.9), 0.5)
+
+    def test_pairs_are_exact_pairs(self):
+        exact = brute_force_pairs(self.matrix, 0.9)
+        pairs = list(RandomProjectionLSH(top_k=1000)(self.matrix, 0.9))
+        self.assertEqual(pairs, sorted(pairs))
+        for i, j, sim in pairs:
+            self.assertAlmostEqual(sim, exact[(i, j)], places=5)
+
+    def test_top_k_neighbours_are_kept(self):
+        found = list(RandomProjectionLSH(top_k=1000)(self.matrix, 0.9))
+        neighbours = {}
+        for i, j, sim in found:
+            neighbours.setdefault(i, []).append((sim, j))
+            neighbours.setdefault(j, []).append((sim, i))
+        # a pair is kept if it is among the two most similar of one of its rows
+        expected = {
+            (min(i, j), max(i, j))
+            for i, ns in neighbours.items()
+            for _, j in sorted(ns, reverse=True)[:2]
+        }
+        pairs = [(i, j) for i, j, _ in RandomProjectionLSH(top_k=2)(self.matrix, 0.9)]
+        self.assertEqual(pairs, sorted(expected))
+        self.assertLess(len(pairs), len(found))
+
+    def test_no_exact_pairs(self):
+        matrix = np.eye(4, dtype=np.float32)
+        self.assertEqual(recall_against_exact(matrix, RandomProjectionLSH(), 0.9), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
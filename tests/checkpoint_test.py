@@ -0,0 +1,222 @@
+import os
+import re
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import fitz
+
+from llmgraph.common.checkpoint import RunCheckpoint
+from llmgraph.general.extract import pipeline, split_document
+from llmgraph.general.ingest import ingest_documents
+from llmgraph.general.prompts import MERGE_ER_P
+from llmgraph.multimodal.prompts import EXTRACT_IMAGE_ATTRS_P, EXTRACT_IMAGE_ER_P
+
+from .extract_test import sample_document
+from .fakes import fake_llm
+
+
+class ExtractionResponder:
+    """
+    Answers one entity per chunk, named after its section, and fails from the `fail_at`-th chunk on
+    """
+
+    def __init__(self, fail_at: int = None):
+        self.fail_at = fail_at
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, messages: list) -> str:
+        if messages[0]["content"] in (MERGE_ER_P, EXTRACT_IMAGE_ER_P):
+            return "NO"
+        if messages[0]["content"] == EXTRACT_IMAGE_ATTRS_P:
+            return "Title: Figure\nText Snippets: []\nDescription: a figure"
+        with self._lock:
+            self.calls += 1
+            if self.fail_at is not None and self.calls >= self.fail_at:
+                raise RuntimeError("extraction failed")
+        section = re.search(r"Section (\d+)", messages[1]["content"])
+        name = f"Topic {section.group(1) if section else 'none'}"
+        return f'Entities:\n<{name}, Concept, {{}}, ["{name}"]>\nRelationships:\n'
+
+
+class RunCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        env = mock.patch.dict(os.environ)
+        env.start()
+        self.addCleanup(env.stop)
+        os.environ.pop("LLMGRAPH_RUN_DIR", None)
+
+    def test_disabled_without_runs_dir(self):
+        self.assertIsNone(RunCheckpoint.open())
+        with self.assertRaises(ValueError):
+            RunCheckpoint.open(resume="20240101120000-1a2b3c")
+        os.environ["LLMGRAPH_RUN_DIR"] = self.root.name
+        checkpoint = RunCheckpoint.open()
+        self.assertEqual(os.path.dirname(checkpoint.run_dir), self.root.name)
+
+    def test_resume_refuses_other_settings(self):
+        checkpoint = RunCheckpoint.open(self.root.name)
+        settings = {"strategy": "gleaning", "token_budget": None}
+        checkpoint.check_source("doc.md", "text", settings=settings)
+        resumed = RunCheckpoint.open(self.root.name, checkpoint.run_id)
+        resumed.check_source("doc.md", "text", settings=dict(settings))
+        with self.assertRaisesRegex(ValueError, "token_budget=None, now 300"):
+            resumed.check_source(
+                "doc.md", "text", settings={**settings, "token_budget": 300}
+            )
+        with self.assertRaisesRegex(ValueError, "different document"):
+            resumed.check_source("doc.md", "edited", settings=settings)
+
+    def test_records_are_not_synced_by_default(self):
+        checkpoint = RunCheckpoint.open(self.root.name)
+        with mock.patch("os.fsync") as fsync:
+            checkpoint.append("chunks", {"chunk": 0})
+            self.assertEqual(fsync.call_count, 0)
+            RunCheckpoint(root=self.root.name, fsync=True).append(
+                "chunks", {"chunk": 0}
+            )
+            self.assertEqual(fsync.call_count, 1)
+        self.assertEqual(checkpoint.records("chunks"), [{"chunk": 0}])
+
+
+class PipelineResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.runs_dir = os.path.join(self.tmp.name, "runs")
+        self.doc_path = os.path.join(self.tmp.name, "doc.md")
+        with open(self.doc_path, "w", encoding="utf-8") as f:
+            f.write(sample_document(6, images=False))
+        self.chunk_count = len(
+            split_document(sample_document(6, images=False), chunk_size=1000)
+        )
+
+    def run_pipeline(self, respond, **kwargs):
+        llm = fake_llm(respond)
+        with mock.patch("llmgraph.general.extract.LLM", return_value=llm):
+            result = pipeline(
+                self.doc_path,
+                strategy="single_shot",
+                runs_dir=self.runs_dir,
+                chunk_size=1000,
+                **kwargs,
+            )
+        return llm, result
+
+    def test_resume_skips_completed_chunks(self):
+        with self.assertRaises(RuntimeError):
+            self.run_pipeline(ExtractionResponder(fail_at=4))
+        (run_id,) = os.listdir(self.runs_dir)
+        done = len(RunCheckpoint.existing(run_id, self.runs_dir).records("chunks"))
+        # the chunks finished before and after the failure are recorded
+        self.assertEqual(done, 3)
+
+        llm, (entities, _, _) = self.run_pipeline(ExtractionResponder(), resume=run_id)
+        self.assertEqual(
+            llm.usage.get("extract:single_shot").calls, self.chunk_count - done
+        )
+        # the chunks continuing a section have no heading
+        self.assertEqual(
+            sorted(e.name for e in entities),
+            [f"Topic {i}" for i in range(6)] + ["Topic none"],
+        )
+        # a finished run returns its result without any request
+        llm, (resumed, _, _) = self.run_pipeline(ExtractionResponder(), resume=run_id)
+        self.assertEqual(llm.usage.get("extract:single_shot").calls, 0)
+        self.assertEqual(len(resumed), len(entities))
+
+    def test_resume_refuses_other_split(self):
+        with self.assertRaises(RuntimeError):
+            self.run_pipeline(ExtractionResponder(fail_at=1))
+        (run_id,) = os.listdir(self.runs_dir)
+        with self.assertRaises(ValueError):
+            self.run_pipeline(ExtractionResponder(), resume=run_id, token_budget=300)
+
+    def test_not_checkpointed_without_runs_dir(self):
+        llm = fake_llm(ExtractionResponder())
+        with mock.patch.dict(os.environ), mock.patch(
+            "llmgraph.general.extract.LLM", return_value=llm
+        ):
+            os.environ.pop("LLMGRAPH_RUN_DIR", None)
+            entities, _, _ = pipeline(
+                self.doc_path, strategy="single_shot", chunk_size=1000
+            )
+        self.assertEqual(len(entities), 7)
+        self.assertFalse(os.path.exists(self.runs_dir))
+
+
+class ReingestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.runs_dir = os.path.join(self.tmp.name, "runs")
+        os.makedirs(os.path.join(self.tmp.name, "images"))
+        for i in (1, 3):
+            fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 4, 4), False).save(
+                os.path.join(self.tmp.name, "images", f"fig_{i}.png")
+            )
+
+    def write(self, name: str, sections: list[int], images: dict = ()) -> str:
+        """
+        One chunk per section, with the image of `images[section]` if there is one
+        """
+        parts = []
+        for i in sections:
+            image = f"![Figure](images/fig_{images[i]}.png)\n" if i in images else ""
+            parts.append(
+                f"# Section {i}\n{image}" + f"A sentence about topic {i}. " * 25
+            )
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(parts))
+        return path
+
+    def ingest(self, paths: list[str], **kwargs):
+        llm = fake_llm(ExtractionResponder())
+        with mock.patch("llmgraph.general.ingest.LLM", return_value=llm):
+            result = ingest_documents(
+                paths,
+                strategy="single_shot",
+                runs_dir=self.runs_dir,
+                chunk_size=1000,
+                **kwargs,
+            )
+        return llm, result
+
+    def test_reingest_reuses_unchanged_chunks(self):
+        paths = [
+            self.write("doc.md", [0, 1, 2, 3, 4], images={1: 1, 3: 3}),
+            self.write("other.md", [5, 6]),
+        ]
+        _, (entities, _, images) = self.ingest(paths)
+        (previous,) = os.listdir(self.runs_dir)
+        self.assertEqual(len(entities), 7)
+        self.assertEqual(len(images), 2)
+
+        # a new first section shifts the chunk ids, section 3 is rewritten as section 7
+        # and the other document is removed
+        path = self.write("doc.md", [8, 0, 1, 2, 7, 4], images={1: 1, 7: 3})
+        llm, (entities, _, images) = self.ingest([path], previous=previous)
+
+        self.assertEqual(llm.usage.get("extract:single_shot").calls, 2)
+        chunks = {e.name: e.chunks for e in entities}
+        # the entities of the removed and rewritten chunks are retracted
+        self.assertEqual(sorted(chunks), [f"Topic {i}" for i in (0, 1, 2, 4, 7, 8)])
+        # the reused entities refer to the new ids of their chunks
+        self.assertEqual(chunks["Topic 0"], [1])
+        self.assertEqual(chunks["Topic 4"], [5])
+        self.assertEqual(chunks["Topic 7"], [4])
+        # the image of an unchanged chunk is reused, the one of the rewritten chunk is not
+        self.assertEqual(llm.usage.get("image:attri").calls, 1)
+        self.assertEqual(
+            sorted((os.path.basename(img.path), img.chunks) for img in images),
+            [("fig_1.png", [2]), ("fig_3.png", [4])],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
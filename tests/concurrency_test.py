@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+
+from llmgraph.common.concurrency import AdaptiveConcurrency
+
+from .fakes import fake_llm
+
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"retries": self.retries}
+
+
+def run_tasks(controller: AdaptiveConcurrency, tasks: list, workers: int = 32):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(controller.run, task) for task in tasks]
+        for future in futures:
+            future.result()
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+    def test_grows_under_mixed_latencies(self):
+        rng = random.Random(0)
+        # short and long tasks, the latency does not depend on the load
+        latencies = [rng.choice([0.002, 0.02]) for _ in range(300)]
+        controller = AdaptiveConcurrency(initial=4, rate_limiter=FakeRateLimiter())
+        run_tasks(controller, [lambda d=d: time.sleep(d) for d in latencies])
+        stats = controller.stats()
+        self.assertEqual(stats["decreases"], 0)
+        self.assertGreater(stats["limit"], 4)
+
+    def test_shrinks_on_429(self):
+        limiter = FakeRateLimiter()
+        controller = AdaptiveConcurrency(initial=16, rate_limiter=limiter)
+
+        def throttled_task():
+            limiter.retry()
+            time.sleep(0.01)
+
+        for _ in range(3):
+            run_tasks(controller, [throttled_task] * 16)
+            time.sleep(0.05)
+        stats = controller.stats()
+        self.assertGreater(stats["decreases"], 0)
+        self.assertLess(stats["limit"], 16)
+
+    def test_shrinks_on_failure(self):
+        controller = AdaptiveConcurrency(initial=8)
+
+        def failing_task():
+            raise TimeoutError("request timed out")
+
+        with self.assertRaises(TimeoutError):
+            controller.run(failing_task)
+        stats = controller.stats()
+        self.assertEqual(stats["failures"], 1)
+        self.assertEqual(stats["limit"], 4)
+
+    def test_shrinks_on_retried_timeout(self):
+        request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+        # the first request times out mid-stream, the rate limiter retries it
+        llm = fake_llm(
+            lambda messages: "answer",
+            stream_errors=[openai.APITimeoutError(request=request)],
+        )
+        controller = AdaptiveConcurrency(initial=8, rate_limiter=llm.rate_limiter)
+        messages = [{"role": "user", "content": "hi"}]
+        self.assertEqual(controller.run(llm.chat, messages, callback=None), "answer")
+        stats = controller.stats()
+        self.assertEqual((stats["failures"], stats["decreases"]), (0, 1))
+        self.assertEqual(stats["limit"], 4)
+        # a request that is not retried grows the limit again
+        controller.run(llm.chat, messages, callback=None)
+        self.assertEqual(controller.stats()["decreases"], 1)
+
+    def test_limit_bounds_in_flight(self):
+        controller = AdaptiveConcurrency(initial=3, max_limit=3)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def task():
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.005)
+            with lock:
+                in_flight[0] -= 1
+
+        run_tasks(controller, [task] * 50)
+        self.assertLessEqual(in_flight[1], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
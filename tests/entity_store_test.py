@@ -0,0 +1,143 @@
+import unittest
+
+from llmgraph.dataclass import Entity, Relationship
+from llmgraph.general.entity_store import EntityStore
+from llmgraph.general.merge_er import merge_store_by_llm
+
+from .fakes import fake_llm
+
+
+class EntityStoreTest(unittest.TestCase):
+    def test_canonical_names_ignore_case(self):
+        store = EntityStore()
+        store.add(
+            [
+                Entity(name="OpenAI", label="Org", references=["a"], chunks=[0]),
+                Entity(name="OPENAI", label="ORG", references=["a", "b"], chunks=[1]),
+                Entity(name="openai", label="Product", chunks=[2]),
+            ],
+            [],
+        )
+        entities = store.entities()
+        self.assertEqual(len(entities), 2)
+        org = store.get("openai")[0]
+        # the first name seen is displayed
+        self.assertEqual(org.name, "OpenAI")
+        self.assertEqual(org.references, ["a", "b"])
+        self.assertEqual(org.chunks, [0, 1])
+        self.assertEqual([e.name for e in store.get("OpenAI")], ["OpenAI", "OpenAI"])
+
+    def test_inputs_are_not_modified(self):
+        store = EntityStore()
+        first = Entity(name="Graph", label="Concept", chunks=[0], properties={"a": 1})
+        second = Entity(name="GRAPH", label="Concept", chunks=[1], properties={"b": 2})
+        alias = Entity(name="Graphs", label="Concept", chunks=[2])
+        store.add([first, second, alias], [])
+        store.union("Graphs", "Graph")
+        self.assertEqual(first.chunks, [0])
+        self.assertEqual(first.properties, {"a": 1})
+        self.assertEqual(alias.name, "Graphs")
+        self.assertEqual(store.get("graph")[0].chunks, [0, 1, 2])
+
+    def test_union_aliases(self):
+        store = EntityStore()
+        store.add(
+            [
+                Entity(name="New York City", label="City", chunks=[0]),
+                Entity(name="NYC", label="City", chunks=[1], images=["a.png"]),
+            ],
+            [],
+        )
+        store.union("NYC", "New York City")
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.find("nyc"), store.find("New York City"))
+        city = store.get("NYC")[0]
+        self.assertEqual(city.name, "New York City")
+        self.assertEqual(city.chunks, [0, 1])
+        self.assertEqual(city.images, ["a.png"])
+        # entities added after the union resolve to the canonical entity
+        store.add_entity(Entity(name="nyc", label="City", chunks=[5]))
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get("New York City")[0].chunks, [0, 1, 5])
+
+    def test_relationship_endpoints_are_rewritten(self):
+        store = EntityStore()
+        store.add(
+            [
+                Entity(name="New York City", label="City"),
+                Entity(name="NYC", label="City"),
+                Entity(name="USA", label="Country"),
+            ],
+            [
+                Relationship(start="NYC", end="USA", type="IN", chunks=[0]),
+                Relationship(start="New York City", end="usa", type="in", chunks=[1]),
+                Relationship(start="Atlantis", end="USA", type="IN"),
+            ],
+        )
+        self.assertEqual(len(store.relationships()), 2)
+        store.union("NYC", "New York City")
+        relationships = store.relationships()
+        # the relationships of the alias merge into those of the canonical entity
+        self.assertEqual(len(relationships), 1)
+        r = relationships[0]
+        self.assertEqual(
+            (r.start, r.type.upper(), r.end), ("New York City", "IN", "USA")
+        )
+        self.assertEqual(sorted(r.chunks), [0, 1])
+
+    def test_add_image_deduplicates(self):
+        store = EntityStore()
+        store.add([Entity(name="Graph", label="Concept", images=["a.png"])], [])
+        self.assertTrue(store.add_image("graph", "a.png"))
+        self.assertTrue(store.add_image("Graph", "b.png"))
+        self.assertFalse(store.add_image("Tree", "b.png"))
+        self.assertEqual(store.get("Graph")[0].images, ["a.png", "b.png"])
+
+
+class MergeStoreByLLMTest(unittest.TestCase):
+    def test_merge_decisions_union_entities(self):
+        store = EntityStore()
+        store.add(
+            [
+                Entity(name="New York City", label="City", chunks=[0]),
+                Entity(name="NYC", label="City", chunks=[1]),
+                Entity(name="USA", label="Country", chunks=[0]),
+            ],
+            [Relationship(start="NYC", end="USA", type="IN")],
+        )
+        llm = fake_llm(lambda messages: "YES")
+
+        def candidates(matrix, threshold):
+            # the names are embedded in order: New York City, NYC, USA
+            yield 0, 1, 1.0
+
+        merge_store_by_llm(store, llm, candidates=candidates)
+        entities, relationships = store.to_er()
+        self.assertEqual(sorted(e.name for e in entities), ["New York City", "USA"])
+        city = store.get("NYC")[0]
+        self.assertEqual(city.chunks, [0, 1])
+        self.assertEqual(city.properties["_alias"], ["New York City", "NYC"])
+        self.assertEqual(
+            [(r.start, r.end) for r in relationships], [("New York City", "USA")]
+        )
+        self.assertEqual(llm.usage.get("merge").calls, 1)
+
+    def test_rejected_merge_keeps_entities(self):
+        store = EntityStore()
+        store.add(
+            [
+                Entity(name="Java", label="Language"),
+                Entity(name="JavaScript", label="Language"),
+            ],
+            [],
+        )
+        merge_store_by_llm(
+            store,
+            fake_llm(lambda messages: "NO"),
+            candidates=lambda matrix, threshold: iter([(0, 1, 1.0)]),
+        )
+        self.assertEqual(len(store), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
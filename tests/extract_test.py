@@ -0,0 +1,137 @@
+import io
+import re
+import threading
+import unittest
+
+from llmgraph.common.tools import estimate_tokens
+from llmgraph.general.extract import (
+    extract_graph,
+    iter_document_chunks,
+    split_document,
+)
+
+from .fakes import fake_llm
+
+
+def sample_document(sections: int = 40, images: bool = True) -> str:
+    parts = []
+    for i in range(sections):
+        parts.append(f"# Section {i}\n")
+        parts.append(
+            " ".join(f"Sentence {j} of section {i} is about graphs." for j in range(30))
+        )
+        if images:
+            parts.append(f"![Figure {i}](images/figure_{i}.png)")
+        parts.append("知识图谱由实体和关系组成。" * 20)
+    return "\n\n".join(parts)
+
+
+class IterDocumentChunksTest(unittest.TestCase):
+    def assert_same_chunks(self, text: str, **kwargs):
+        expected = split_document(text, **kwargs)
+        chunks = list(iter_document_chunks(io.StringIO(text), **kwargs))
+        self.assertEqual(
+            [(c.id, c.text) for c in chunks], [(c.id, c.text) for c in expected]
+        )
+
+    def test_same_chunks_as_split_document(self):
+        self.assert_same_chunks(sample_document(), chunk_size=1000, over_lap=100)
+
+    def test_same_chunks_as_split_document_by_tokens(self):
+        self.assert_same_chunks(sample_document(), token_budget=300, token_overlap=30)
+
+
+class TokenBudgetTest(unittest.TestCase):
+    image_ref = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+
+    def document(self) -> str:
+        # long headings over unbroken English and CJK text, which is split by words and characters
+        parts = []
+        for i in range(5):
+            parts.append(f"## A rather long heading of section {i}")
+            parts.append(" ".join(f"word{j}" for j in range(200)))
+            parts.append(
+                "知识图谱由实体和关系组成" * 30
+                + f"![Figure {i}](images/a_long_figure_name_{i}.png)"
+                + "实体" * 20
+            )
+        return "\n\n".join(parts)
+
+    def test_chunks_are_within_budget(self):
+        text = self.document()
+        refs = self.image_ref.findall(text)
+        for token_budget in (20, 30, 60, 100, 150):
+            chunks = split_document(
+                text, token_budget=token_budget, token_overlap=token_budget // 5
+            )
+            for chunk in chunks:
+                self.assertLessEqual(estimate_tokens(chunk.text), token_budget)
+                # an image reference is whole, or not in the chunk at all
+                self.assertEqual(
+                    chunk.text.count("!["), len(self.image_ref.findall(chunk.text))
+                )
+            found = [ref for c in chunks for ref in self.image_ref.findall(c.text)]
+            self.assertEqual(sorted(set(found)), sorted(refs))
+            # the headings are kept with the text following them
+            for chunk in chunks:
+                self.assertNotRegex(chunk.text.strip(), r"^## [^\n]*$")
+            self.assertEqual(
+                [
+                    c.text
+                    for c in iter_document_chunks(
+                        io.StringIO(text),
+                        token_budget=token_budget,
+                        token_overlap=token_budget // 5,
+                    )
+                ],
+                [c.text for c in chunks],
+            )
+
+
+class ExtractGraphTest(unittest.TestCase):
+    def run_with_timeout(self, fn, timeout: float = 10.0) -> Exception:
+        errors = []
+
+        def target():
+            try:
+                fn()
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), "extract_graph did not return")
+        self.assertEqual(len(errors), 1)
+        return errors[0]
+
+    def test_unknown_strategy_of_lazy_chunks(self):
+        chunks = iter(split_document(sample_document(2), chunk_size=500))
+        error = self.run_with_timeout(
+            lambda: extract_graph(chunks, fake_llm(), strategy="bogus")
+        )
+        self.assertIsInstance(error, ValueError)
+
+    def test_failed_text_stage_of_lazy_chunks(self):
+        def respond(messages):
+            raise RuntimeError("extraction failed")
+
+        chunks = iter(split_document(sample_document(2, images=False), chunk_size=500))
+        error = self.run_with_timeout(
+            lambda: extract_graph(chunks, fake_llm(respond), strategy="single_shot")
+        )
+        self.assertIsInstance(error, RuntimeError)
+
+    def test_failed_split_of_lazy_chunks(self):
+        def broken_chunks():
+            raise OSError("unreadable document")
+            yield  # pylint: disable=unreachable
+
+        error = self.run_with_timeout(
+            lambda: extract_graph(broken_chunks(), fake_llm(), strategy="single_shot")
+        )
+        self.assertIsInstance(error, OSError)
+
+
+if __name__ == "__main__":
+    unittest.main()
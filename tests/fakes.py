@@ -0,0 +1,175 @@
+"""
+Fake OpenAI clients, so the LLM wrappers run without network access.
+"""
+
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import Callable, Sequence
+
+import httpx
+import openai
+
+from llmgraph.common.llm import LLM, AsyncLLM
+from llmgraph.common.ratelimit import RateLimiter
+
+
+def _chunk(content: str = None, usage=None) -> SimpleNamespace:
+    choices = (
+        []
+        if content is None
+        else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    )
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeChatCompletions:
+    """
+    Streams the answer of `respond(messages)` in pieces of `piece_size` characters.
+    The n-th stream raises `stream_errors[n]` after its first piece, if there is one and not None.
+    With `reject_stream_options`, a request with `stream_options` fails with a 400.
+    """
+
+    def __init__(
+        self,
+        respond: Callable[[list], str],
+        piece_size: int = 3,
+        stream_errors: Sequence[Exception] = (),
+        reject_stream_options: bool = False,
+    ):
+        self.respond = respond
+        self.piece_size = piece_size
+        self.stream_errors = list(stream_errors)
+        self.reject_stream_options = reject_stream_options
+        self.requests: list[dict] = []
+        self.rejected: list[dict] = []
+
+    def create(self, **kwargs):
+        if self.reject_stream_options and "stream_options" in kwargs:
+            self.rejected.append(kwargs)
+            request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+            raise openai.BadRequestError(
+                "Unrecognized request argument supplied: stream_options",
+                response=httpx.Response(400, request=request),
+                body=None,
+            )
+        self.requests.append(kwargs)
+        content = self.respond(kwargs["messages"])
+        chunks = [
+            _chunk(content[i : i + self.piece_size])
+            for i in range(0, len(content), self.piece_size)
+        ]
+        if kwargs.get("stream_options", {}).get("include_usage"):
+            chunks.append(
+                _chunk(
+                    usage=SimpleNamespace(
+                        prompt_tokens=10, completion_tokens=len(chunks)
+                    )
+                )
+            )
+        if len(self.requests) <= len(self.stream_errors):
+            error = self.stream_errors[len(self.requests) - 1]
+            if error is not None:
+                return self._broken_stream(chunks, error)
+        return iter(chunks)
+
+    @staticmethod
+    def _broken_stream(chunks: list, error: Exception):
+        yield chunks[0]
+        raise error
+
+
+class FakeAsyncChatCompletions(FakeChatCompletions):
+    """
+    Async variant of `FakeChatCompletions`, which counts the streams in flight
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        chunks = super().create(**kwargs)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return self._async_stream(chunks)
+
+    async def _async_stream(self, chunks):
+        try:
+            for chunk in chunks:
+                # let the other requests of the loop run between the chunks
+                await asyncio.sleep(0)
+                yield chunk
+        finally:
+            self.in_flight -= 1
+
+
+class FakeEmbeddings:
+    """
+    Embeds a text as [len(text), index of the request], the data is returned shuffled
+    """
+
+    def __init__(self):
+        self.requests: list[list[str]] = []
+
+    def create(self, model: str, input: list[str]):
+        self.requests.append(list(input))
+        data = [
+            SimpleNamespace(
+                index=i, embedding=[float(len(text)), float(len(self.requests))]
+            )
+            for i, text in enumerate(input)
+        ]
+        random.Random(len(self.requests)).shuffle(data)
+        return SimpleNamespace(
+            data=data, usage=SimpleNamespace(prompt_tokens=len(input))
+        )
+
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    async def create(self, model: str, input: list[str]):
+        return super().create(model, input)
+
+
+def fake_llm(
+    respond: Callable[[list], str] = lambda messages: "",
+    stream_errors: Sequence[Exception] = (),
+    reject_stream_options: bool = False,
+    **kwargs,
+) -> LLM:
+    """
+    An LLM whose client is fake, with its own unlimited rate limiter
+    """
+    kwargs.setdefault("rate_limiter", RateLimiter(base_delay=0.0))
+    llm = LLM(api_key="test", **kwargs)
+    llm.client = SimpleNamespace(
+        chat=SimpleNamespace(
+            completions=FakeChatCompletions(
+                respond,
+                stream_errors=stream_errors,
+                reject_stream_options=reject_stream_options,
+            )
+        ),
+        embeddings=FakeEmbeddings(),
+    )
+    return llm
+
+
+def fake_async_llm(
+    respond: Callable[[list], str] = lambda messages: "",
+    stream_errors: Sequence[Exception] = (),
+    **kwargs,
+) -> AsyncLLM:
+    """
+    An async LLM whose client is fake, with its own unlimited rate limiter
+    """
+    kwargs.setdefault("rate_limiter", RateLimiter(base_delay=0.0))
+    llm = AsyncLLM(api_key="test", **kwargs)
+    llm.client = SimpleNamespace(
+        chat=SimpleNamespace(
+            completions=FakeAsyncChatCompletions(respond, stream_errors=stream_errors)
+        ),
+        embeddings=FakeAsyncEmbeddings(),
+    )
+    return llm
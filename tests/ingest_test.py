@@ -0,0 +1,85 @@
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+import fitz
+
+from llmgraph.general.ingest import ingest_documents
+from llmgraph.general.parse_pdf import DEFAULT_ROLE_PROMPT
+from llmgraph.multimodal.prompts import EXTRACT_IMAGE_ATTRS_P
+
+from .fakes import fake_llm
+
+
+def write_pdf(path: str, title: str):
+    with fitz.open() as pdf:
+        page = pdf.new_page()
+        page.insert_text((72, 72), title, fontsize=14)
+        page.draw_rect(fitz.Rect(72, 100, 300, 300), color=(0, 0, 1), width=2)
+        pdf.save(path)
+
+
+def respond(messages: list) -> str:
+    if messages[0]["content"] == DEFAULT_ROLE_PROMPT:
+        # the page markdown references the regions named in the prompt
+        names = re.findall(r"\d+_\d+\.png", messages[1]["content"][0]["text"])
+        return "# Report\n\n" + "\n\n".join(f"![Figure]({name})" for name in names)
+    if messages[0]["content"] == EXTRACT_IMAGE_ATTRS_P:
+        return "Title: Figure\nText Snippets: []\nDescription: a figure"
+    return "NO"
+
+
+class IngestImagesTest(unittest.TestCase):
+    def test_images_of_each_document_are_namespaced(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name in ("a", "b"):
+                paths.append(os.path.join(tmp, f"{name}.pdf"))
+                write_pdf(paths[-1], f"Document {name}")
+            os.makedirs(os.path.join(tmp, "notes", "images"))
+            with open(os.path.join(tmp, "notes", "images", "0_0.png"), "wb") as f:
+                f.write(
+                    fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 4, 4), False).tobytes()
+                )
+            paths.append(os.path.join(tmp, "notes", "notes.md"))
+            with open(paths[-1], "w", encoding="utf-8") as f:
+                f.write("# Notes\n\n![Sketch](images/0_0.png)\n")
+
+            llm = fake_llm(respond)
+            with mock.patch("llmgraph.general.ingest.LLM", return_value=llm):
+                _, _, images = ingest_documents(
+                    paths, strategy="single_shot", runs_dir=os.path.join(tmp, "runs")
+                )
+
+            (run_id,) = os.listdir(os.path.join(tmp, "runs"))
+            image_dir = os.path.join(tmp, "runs", run_id, "pdf")
+            image_paths = sorted(img.path for img in images)
+            # the two PDFs have a region 0_0.png each, and the markdown an image of the same name
+            self.assertEqual(len(image_paths), 3)
+            self.assertEqual(len({os.path.basename(p) for p in image_paths}), 1)
+            for path in image_paths:
+                self.assertFalse(os.path.isabs(path))
+                self.assertTrue(os.path.isfile(os.path.join(image_dir, path)))
+            self.assertEqual(llm.usage.get("image:attri").calls, 3)
+
+    def test_images_of_a_run_without_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ):
+            os.environ.pop("LLMGRAPH_RUN_DIR", None)
+            path = os.path.join(tmp, "a.pdf")
+            write_pdf(path, "Document a")
+            image_dir = os.path.join(tmp, "images")
+            with mock.patch(
+                "llmgraph.general.ingest.LLM", return_value=fake_llm(respond)
+            ):
+                _, _, images = ingest_documents(
+                    [path], strategy="single_shot", image_dir=image_dir
+                )
+            self.assertEqual(len(images), 1)
+            self.assertTrue(os.path.isfile(os.path.join(image_dir, images[0].path)))
+            self.assertEqual(sorted(os.listdir(tmp)), ["a.pdf", "images"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import tempfile
+import unittest
+
+import httpx
+import openai
+
+from llmgraph.common.cache import ResponseCache
+from llmgraph.dataclass import Entity
+from llmgraph.general.merge_er import async_get_entity_embedding, get_entity_embedding
+
+from .fakes import fake_llm, fake_async_llm
+
+
+class EmbedManyTest(unittest.TestCase):
+    texts = [f"entity {'x' * i}" for i in range(10)]
+
+    def test_batches_in_input_order(self):
+        llm = fake_llm()
+        matrix = llm.embed_many(self.texts, batch_size=4)
+        requests = llm.client.embeddings.requests
+        self.assertEqual(requests, [self.texts[0:4], self.texts[4:8], self.texts[8:10]])
+        # the rows follow the inputs although the data of each response is shuffled
+        self.assertEqual(matrix.shape, (10, 2))
+        self.assertEqual(matrix[:, 0].tolist(), [float(len(t)) for t in self.texts])
+        self.assertEqual(matrix[:, 1].tolist(), [1.0] * 4 + [2.0] * 4 + [3.0] * 2)
+        self.assertEqual(llm.usage.get("embed").calls, 3)
+
+    def test_empty_input(self):
+        llm = fake_llm()
+        matrix = llm.embed_many([])
+        self.assertEqual(matrix.shape, (0, 0))
+        self.assertEqual(llm.client.embeddings.requests, [])
+        self.assertEqual(get_entity_embedding([], llm), {})
+
+    def test_async_batches_in_input_order(self):
+        llm = fake_async_llm()
+        matrix = asyncio.run(llm.embed_many(self.texts, batch_size=4))
+        self.assertEqual(len(llm.client.embeddings.requests), 3)
+        self.assertEqual(matrix.shape, (10, 2))
+        self.assertEqual(matrix[:, 0].tolist(), [float(len(t)) for t in self.texts])
+
+    def test_async_empty_input(self):
+        llm = fake_async_llm()
+        self.assertEqual(asyncio.run(llm.embed_many([])).shape, (0, 0))
+        self.assertEqual(asyncio.run(async_get_entity_embedding([], llm)), {})
+
+    def test_entity_embedding_of_duplicate_names(self):
+        llm = fake_llm()
+        es = [Entity(name="A"), Entity(name="B"), Entity(name="A")]
+        embeddings = get_entity_embedding(es, llm)
+        self.assertEqual(list(embeddings), ["A", "B"])
+        self.assertEqual(llm.client.embeddings.requests, [["A", "B"]])
+
+
+class StreamUsageTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "hi"}]
+
+    def test_usage_is_requested_when_enabled(self):
+        llm = fake_llm(lambda messages: "hello")
+        self.assertEqual(llm.chat(self.messages, callback=None), "hello")
+        request = llm.client.chat.completions.requests[0]
+        self.assertEqual(request["stream_options"], {"include_usage": True})
+        self.assertEqual(llm.usage.get("chat").prompt_tokens, 10)
+
+    def test_usage_is_not_requested_when_disabled(self):
+        llm = fake_llm(lambda messages: "hello", stream_usage=False)
+        self.assertEqual(llm.chat(self.messages, callback=None), "hello")
+        self.assertNotIn("stream_options", llm.client.chat.completions.requests[0])
+        self.assertEqual(llm.usage.get("chat").calls, 1)
+
+    def test_falls_back_when_stream_options_is_rejected(self):
+        llm = fake_llm(lambda messages: "hello", reject_stream_options=True)
+        with self.assertLogs("llmgraph", level="WARNING"):
+            self.assertEqual(llm.chat(self.messages, callback=None), "hello")
+        self.assertEqual(llm.chat(self.messages, callback=None), "hello")
+        completions = llm.client.chat.completions
+        # rejected once, the later requests are sent without stream_options
+        self.assertEqual(len(completions.rejected), 1)
+        self.assertEqual(len(completions.requests), 2)
+        self.assertFalse(llm.stream_usage)
+        self.assertEqual(llm.usage.get("chat").calls, 2)
+
+
+class AsyncChatTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def chat_many(self, llm, n: int) -> list[str]:
+        return await asyncio.gather(
+            *[
+                llm.chat([{"role": "user", "content": str(i)}], callback=None)
+                for i in range(n)
+            ]
+        )
+
+    def test_streams_to_the_callback(self):
+        llm = fake_async_llm(lambda messages: "hello world")
+        tokens = []
+        content = asyncio.run(llm.chat(self.messages, callback=tokens.append))
+        self.assertEqual(content, "hello world")
+        self.assertEqual(tokens, ["hel", "lo ", "wor", "ld"])
+        usage = llm.usage.get("chat")
+        self.assertEqual((usage.calls, usage.prompt_tokens), (1, 10))
+
+    def test_concurrency_is_bounded_in_every_loop(self):
+        llm = fake_async_llm(
+            lambda messages: "answer " + messages[-1]["content"], max_concurrency=2
+        )
+        # a semaphore bound to the first loop would fail in the second one
+        for _ in range(2):
+            answers = asyncio.run(self.chat_many(llm, 5))
+            self.assertEqual(answers, [f"answer {i}" for i in range(5)])
+        completions = llm.client.chat.completions
+        self.assertEqual(len(completions.requests), 10)
+        self.assertEqual(completions.max_in_flight, 2)
+
+    def test_cached_response_is_not_requested(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            answers = iter(["first", "second"])
+            llm = fake_async_llm(
+                lambda messages: next(answers), cache=ResponseCache(tmp)
+            )
+            self.assertEqual(asyncio.run(llm.chat(self.messages, None)), "first")
+            self.assertEqual(asyncio.run(llm.chat(self.messages, None)), "first")
+        self.assertEqual(len(llm.client.chat.completions.requests), 1)
+        usage = llm.usage.get("chat")
+        self.assertEqual((usage.calls, usage.cached_calls), (2, 1))
+
+    def test_failed_stream_is_sent_again(self):
+        request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+        llm = fake_async_llm(
+            lambda messages: "hello",
+            stream_errors=[openai.APIConnectionError(request=request)],
+        )
+        tokens = []
+        with self.assertLogs("llmgraph", level="WARNING"):
+            content = asyncio.run(llm.chat(self.messages, callback=tokens.append))
+        self.assertEqual(content, "hello")
+        # the piece of the failed stream is passed to the callback, then the whole response
+        self.assertEqual(tokens, ["hel", "hel", "lo"])
+        self.assertEqual(len(llm.client.chat.completions.requests), 2)
+        self.assertEqual(llm.rate_limiter.stats()["retries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from llmgraph.dataclass import Entity, Relationship
+from llmgraph.general.merge_er import async_merge_er_by_llm, merge_er_by_llm
+
+from .fakes import fake_async_llm, fake_llm
+
+
+def respond(messages: list) -> str:
+    # merge the cities, keep the languages apart
+    return "YES" if "NYC" in messages[-1]["content"] else "NO"
+
+
+def candidates(matrix, threshold):
+    # the names are embedded in order: New York City, NYC, New York, USA, Java, JavaScript
+    yield 0, 1, 0.95
+    yield 1, 2, 0.95
+    yield 4, 5, 0.95
+
+
+class MergeErByLLMTest(unittest.TestCase):
+    def setUp(self):
+        self.es = [
+            Entity(name="New York City", label="City", chunks=[0]),
+            Entity(name="NYC", label="City", chunks=[1]),
+            Entity(name="New York", label="City", chunks=[2]),
+            Entity(name="USA", label="Country", chunks=[0]),
+            Entity(name="Java", label="Language", chunks=[3]),
+            Entity(name="JavaScript", label="Language", chunks=[3]),
+        ]
+        self.rs = [
+            Relationship(start="NYC", end="USA", type="IN", chunks=[1]),
+            Relationship(start="New York", end="USA", type="IN", chunks=[2]),
+            Relationship(start="Java", end="JavaScript", type="INSPIRED", chunks=[3]),
+        ]
+
+    def assert_merged(self, es: list, rs: list):
+        self.assertEqual(
+            sorted(e.name for e in es),
+            ["Java", "JavaScript", "New York City", "USA"],
+        )
+        city = next(e for e in es if e.name == "New York City")
+        self.assertEqual(city.chunks, [0, 1, 2])
+        self.assertEqual(
+            city.properties["_alias"], ["New York City", "NYC", "New York"]
+        )
+        # both aliases are rewritten once, their relationships merge into one
+        self.assertEqual(
+            sorted((r.start, r.type, r.end, tuple(r.chunks)) for r in rs),
+            [
+                ("Java", "INSPIRED", "JavaScript", (3,)),
+                ("New York City", "IN", "USA", (1, 2)),
+            ],
+        )
+        # the inputs are left untouched
+        self.assertEqual([r.start for r in self.rs], ["NYC", "New York", "Java"])
+        self.assertEqual(self.es[0].chunks, [0])
+
+    def test_aliases_are_rewritten(self):
+        llm = fake_llm(respond)
+        es, rs = merge_er_by_llm(self.es, self.rs, llm, candidates=candidates)
+        self.assert_merged(es, rs)
+        self.assertEqual(llm.usage.get("merge").calls, 2)
+
+    def test_async_aliases_are_rewritten(self):
+        llm = fake_async_llm(respond)
+        es, rs = asyncio.run(
+            async_merge_er_by_llm(self.es, self.rs, llm, candidates=candidates)
+        )
+        self.assert_merged(es, rs)
+        self.assertEqual(llm.usage.get("merge").calls, 2)
+        self.assertEqual(len(llm.client.embeddings.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import random
+import unittest
+
+import shapely.geometry as sg
+
+from llmgraph.general.parse_pdf import (
+    _is_horizontal_near,
+    _is_near,
+    _merge_rects,
+    _union_rects,
+)
+
+
+def reference_merge_rects(rect_list, distance=20, horizontal_distance=None):
+    """
+    The pairwise implementation `_merge_rects` replaced
+    """
+    rect_list = list(rect_list)
+    merged = True
+    while merged:
+        merged = False
+        new_rect_list = []
+        while rect_list:
+            rect = rect_list.pop(0)
+            for other_rect in rect_list:
+                if _is_near(rect, other_rect, distance) or (
+                    horizontal_distance
+                    and _is_horizontal_near(rect, other_rect, horizontal_distance)
+                ):
+                    rect = _union_rects(rect, other_rect)
+                    rect_list.remove(other_rect)
+                    merged = True
+            new_rect_list.append(rect)
+        rect_list = new_rect_list
+    return rect_list
+
+
+def random_page(rng: random.Random, num_paths: int) -> list:
+    """
+    Short paths clustered in a few charts, table lines of equal width and scattered marks
+    """
+    rects = []
+    charts = [(rng.uniform(20, 350), rng.uniform(20, 650)) for _ in range(3)]
+    for _ in range(num_paths):
+        x, y = rng.choice(charts)
+        x0, y0 = x + rng.uniform(0, 200), y + rng.uniform(0, 150)
+        rects.append(sg.box(x0, y0, x0 + rng.uniform(0, 8), y0 + rng.uniform(0, 8)))
+    for row in range(rng.randint(0, 12)):
+        y = 700 + row * rng.uniform(4, 40)
+        rects.append(sg.box(60, y, 540, y))
+    for _ in range(rng.randint(0, 20)):
+        x0, y0 = rng.uniform(0, 580), rng.uniform(0, 830)
+        rects.append(sg.box(x0, y0, x0 + rng.uniform(0, 30), y0 + rng.uniform(0, 10)))
+    rng.shuffle(rects)
+    return rects
+
+
+class MergeRectsTest(unittest.TestCase):
+    def assert_same_merge(self, rects: list, **kwargs):
+        expected = [r.bounds for r in reference_merge_rects(rects, **kwargs)]
+        self.assertEqual([r.bounds for r in _merge_rects(rects, **kwargs)], expected)
+
+    def test_same_as_pairwise_merge(self):
+        rng = random.Random(0)
+        for _ in range(10):
+            rects = random_page(rng, rng.randint(0, 60))
+            self.assert_same_merge(rects, distance=10, horizontal_distance=100)
+            self.assert_same_merge(rects, distance=10)
+            self.assert_same_merge(rects)
+
+    def test_table_lines_merge_horizontally(self):
+        lines = [sg.box(60, 100 + i * 50, 540, 100 + i * 50) for i in range(4)]
+        merged = _merge_rects(lines, distance=10, horizontal_distance=100)
+        self.assertEqual(
+            [r.bounds for r in merged],
+            [(60.0, 100.0, 540.0, 150.0), (60.0, 200.0, 540.0, 250.0)],
+        )
+        self.assert_same_merge(lines, distance=10, horizontal_distance=100)
+        self.assertEqual(len(_merge_rects(lines, distance=10)), 4)
+
+    def test_untouched_rects_are_kept(self):
+        rects = [sg.box(0, 0, 10, 10), sg.box(100, 100, 110, 110)]
+        merged = _merge_rects(rects)
+        self.assertIs(merged[0], rects[0])
+        self.assertIs(merged[1], rects[1])
+        self.assertEqual(_merge_rects([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
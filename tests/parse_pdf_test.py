@@ -0,0 +1,224 @@
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+
+import fitz
+
+from llmgraph.common.cache import ResponseCache
+from llmgraph.general.parse_pdf import (
+    _gpt_parse_images,
+    _page_to_markdown,
+    _parse_pdf_to_images,
+    _render_page,
+    parse_pdf,
+)
+
+from .fakes import fake_llm
+
+
+class GptParseImagesTest(unittest.TestCase):
+    def test_pages_are_requested_with_the_llm(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            image_infos = []
+            for i in range(2):
+                page_image = os.path.join(output_dir, f"{i}.png")
+                fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), False).save(page_image)
+                image_infos.append((page_image, [f"{i}_0.png"] if i else [], None))
+            llm = fake_llm(lambda messages: "```markdown\n# Page\n```")
+
+            content = _gpt_parse_images(image_infos, output_dir=output_dir, llm=llm)
+
+            self.assertEqual(content, "# Page\n\n\n# Page\n")
+            requests = llm.client.chat.completions.requests
+            self.assertEqual(len(requests), 2)
+            self.assertEqual(requests[0]["model"], "gpt-4o")
+            parts = requests[1]["messages"][1]["content"]
+            self.assertTrue(parts[0]["text"].endswith("1_0.png"))
+            self.assertTrue(
+                parts[1]["image_url"]["url"].startswith("data:image/png;base64,")
+            )
+            self.assertEqual(llm.usage.get("pdf:page").calls, 2)
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.page_image = os.path.join(self.tmp.name, "0.png")
+        fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), False).save(self.page_image)
+
+    def parse(self, llm, **kwargs) -> str:
+        return _gpt_parse_images(
+            [(self.page_image, [], None)], output_dir=self.tmp.name, llm=llm, **kwargs
+        )
+
+    def test_pages_are_cached_by_the_response_cache(self):
+        cache = ResponseCache(os.path.join(self.tmp.name, "cache"), max_bytes=1 << 20)
+        answers = iter(["# First", "# Second"])
+        llm = fake_llm(lambda messages: next(answers), cache=cache)
+        self.assertEqual(self.parse(llm), "# First")
+        self.assertEqual(self.parse(llm), "# First")
+        self.assertEqual(self.parse(llm, use_cache=False), "# Second")
+        self.assertEqual(len(llm.client.chat.completions.requests), 2)
+        self.assertEqual(llm.usage.get("pdf:page").cached_calls, 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_refresh_requests_the_pages_again(self):
+        cache = ResponseCache(os.path.join(self.tmp.name, "cache"))
+        answers = iter(["# First", "# Second"])
+        llm = fake_llm(lambda messages: next(answers), cache=cache)
+        self.parse(llm)
+        self.assertEqual(self.parse(llm, refresh=True), "# Second")
+        self.assertEqual(self.parse(llm), "# Second")
+        self.assertEqual(len(llm.client.chat.completions.requests), 2)
+
+    def test_not_cached_without_a_response_cache(self):
+        llm = fake_llm(lambda messages: "# Page")
+        self.parse(llm)
+        self.parse(llm)
+        self.assertEqual(len(llm.client.chat.completions.requests), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "page_cache")))
+
+
+def write_pdf(path: str, pages: int):
+    """
+    A PDF whose pages have a figure each, so every page is parsed by the model
+    """
+    with fitz.open() as pdf:
+        for i in range(pages):
+            page = pdf.new_page()
+            page.insert_text((72, 72), f"Page {i}", fontsize=14)
+            page.draw_rect(fitz.Rect(72, 100, 300, 300), color=(0, 0, 1), width=2)
+        pdf.save(path)
+
+
+class StreamParsePdfTest(unittest.TestCase):
+    pages = 6
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pdf_path = os.path.join(self.tmp.name, "doc.pdf")
+        self.output_dir = os.path.join(self.tmp.name, "out")
+        write_pdf(self.pdf_path, self.pages)
+        self.lock = threading.Lock()
+        self.max_pending = 0
+
+    def respond(self, messages: list) -> str:
+        # the page images rendered and not parsed yet, this one included
+        pending = [
+            name
+            for name in os.listdir(self.output_dir)
+            if re.fullmatch(r"\d+\.png", name)
+        ]
+        with self.lock:
+            self.max_pending = max(self.max_pending, len(pending))
+        index = int(re.search(r"(\d+)_0\.png", messages[1]["content"][0]["text"])[1])
+        # the first pages take the longest, so they finish after the later ones
+        time.sleep(0.02 * (self.pages - index))
+        return f"# Page {index}"
+
+    def test_pages_in_order_with_bounded_queue(self):
+        content, rect_images = parse_pdf(
+            self.pdf_path,
+            output_dir=self.output_dir,
+            llm=fake_llm(self.respond),
+            stream=True,
+            gpt_worker=2,
+            queue_depth=3,
+        )
+        self.assertEqual(content, "\n\n".join(f"# Page {i}" for i in range(self.pages)))
+        self.assertLessEqual(self.max_pending, 3)
+        self.assertGreater(self.max_pending, 1)
+        # the page images are removed, the region images are kept for the image extraction
+        self.assertEqual(rect_images, [f"{i}_0.png" for i in range(self.pages)])
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            sorted(rect_images + ["output.md"]),
+        )
+
+    def test_render_worker_is_refused(self):
+        with self.assertRaises(ValueError):
+            parse_pdf(
+                self.pdf_path,
+                output_dir=self.output_dir,
+                llm=fake_llm(self.respond),
+                stream=True,
+                render_worker=2,
+            )
+
+
+class ParallelRenderTest(unittest.TestCase):
+    def test_same_pages_as_serial_render(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = os.path.join(tmp, "doc.pdf")
+            with fitz.open() as pdf:
+                for i in range(7):
+                    page = pdf.new_page()
+                    page.insert_text((72, 72), f"Page {i}", fontsize=14)
+                    if i % 3:
+                        page.draw_rect(fitz.Rect(72, 100, 300, 300), color=(0, 0, 1))
+                pdf.save(pdf_path)
+
+            rendered = {}
+            for render_worker in (1, 3):
+                output_dir = os.path.join(tmp, str(render_worker))
+                os.makedirs(output_dir)
+                infos = _parse_pdf_to_images(
+                    pdf_path,
+                    output_dir=output_dir,
+                    render_worker=render_worker,
+                    text_fast_path=True,
+                )
+                files = {}
+                for name in sorted(os.listdir(output_dir)):
+                    with open(os.path.join(output_dir, name), "rb") as f:
+                        files[name] = f.read()
+                pages = [
+                    (
+                        page_image and os.path.basename(page_image),
+                        rect_images,
+                        page_markdown and os.path.basename(page_markdown),
+                    )
+                    for page_image, rect_images, page_markdown in infos
+                ]
+                rendered[render_worker] = (pages, files)
+            self.assertEqual(rendered[3], rendered[1])
+            self.assertEqual(len(rendered[1][0]), 7)
+            # the pages without a figure are converted locally
+            self.assertEqual(len([p for p in rendered[1][0] if p[2]]), 3)
+
+
+class TextFastPathTest(unittest.TestCase):
+    def test_text_only_page_is_converted_locally(self):
+        with tempfile.TemporaryDirectory() as output_dir, fitz.open() as pdf:
+            page = pdf.new_page()
+            page.insert_text((72, 72), "Introduction", fontsize=20)
+            page.insert_text((72, 120), "Plain body text of the page.", fontsize=11)
+            page_image, rect_images, page_markdown = _render_page(
+                page, 0, output_dir, text_fast_path=True
+            )
+            self.assertIsNone(page_image)
+            self.assertEqual(rect_images, [])
+            self.assertEqual(page_markdown, os.path.join(output_dir, "0.md"))
+
+            llm = fake_llm()
+            content = _gpt_parse_images(
+                [(page_image, rect_images, page_markdown)],
+                output_dir=output_dir,
+                llm=llm,
+            )
+            self.assertEqual(content, "# Introduction\n\nPlain body text of the page.")
+            self.assertEqual(llm.client.chat.completions.requests, [])
+
+    def test_spans_of_size_zero(self):
+        span = {"text": "Heading", "size": 0.0, "flags": 0}
+        page_text = {"blocks": [{"lines": [{"spans": [span]}]}]}
+        self.assertEqual(_page_to_markdown(page_text), "Heading")
+
+
+if __name__ == "__main__":
+    unittest.main()
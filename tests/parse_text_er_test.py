@@ -0,0 +1,339 @@
+import asyncio
+import random
+import threading
+import unittest
+
+import httpx
+import openai
+
+from llmgraph.dataclass import Chunk, Entity, Relationship
+from llmgraph.general.extract import (
+    _glean_er_from_chunk,
+    async_batch_extract_er_execute,
+    batch_extract_er_execute,
+    extract_er_from_chunk,
+    extract_er_from_chunk_single_shot,
+)
+from llmgraph.general.entity_store import EntityStore
+from llmgraph.general.parse_text_er import (
+    StreamingERParser,
+    merge_er,
+    parse_rawtext_to_er,
+)
+from llmgraph.general.prompts import CONTINUE_EXTRACT_P, IF_COTINUE_P
+
+from .fakes import fake_async_llm, fake_llm
+
+RESPONSE = (
+    "Entities:\n"
+    '<Knowledge Graph, Concept, {"field": "AI"}, ["a knowledge graph"]>\n'
+    "<LLM, Model, {}, []>\n"
+    "Some text in between, with a > and a : in it.\n"
+    "Relationships:\n"
+    '<LLM, BUILDS, Knowledge Graph, {"weight": 1}, ["LLMs build graphs"]>\n'
+    "<Knowledge Graph, STORES, Entity, {}, []>\n"
+)
+
+
+def fragments(text: str, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    pieces, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 7)
+        pieces.append(text[i : i + size])
+        i += size
+    return pieces
+
+
+class StreamingERParserTest(unittest.TestCase):
+    def test_fragments_emit_the_parsed_items(self):
+        expected_es, expected_rs = parse_rawtext_to_er(RESPONSE)
+        for seed in range(20):
+            items = []
+            parser = StreamingERParser(on_item=items.append)
+            for piece in fragments(RESPONSE, seed):
+                parser(piece)
+            self.assertEqual(items, expected_es + expected_rs)
+            self.assertEqual(parser.result(), (expected_es, expected_rs))
+        self.assertEqual(
+            [(e.name, e.label, e.properties) for e in expected_es],
+            [
+                ("Knowledge Graph", "Concept", {"field": "AI"}),
+                ("LLM", "Model", {}),
+            ],
+        )
+        self.assertEqual(
+            [(r.start, r.type, r.end) for r in expected_rs],
+            [
+                ("LLM", "BUILDS", "Knowledge Graph"),
+                ("Knowledge Graph", "STORES", "Entity"),
+            ],
+        )
+
+    def test_item_is_emitted_when_its_tuple_closes(self):
+        items = []
+        parser = StreamingERParser(on_item=items.append)
+        first_end = RESPONSE.index(">") + 1
+        for piece in fragments(RESPONSE[:first_end], 0):
+            parser(piece)
+        self.assertEqual(len(items), 1)
+        self.assertIsInstance(items[0], Entity)
+        self.assertEqual(items[0].references, ["a knowledge graph"])
+        parser(RESPONSE[first_end : RESPONSE.index("Relationships:")])
+        self.assertEqual(len(items), 2)
+        parser(RESPONSE[RESPONSE.index("Relationships:") :])
+        self.assertIsInstance(items[-1], Relationship)
+        self.assertEqual(len(items), 4)
+
+    def test_reset_drops_only_the_current_response(self):
+        parser = StreamingERParser()
+        parser.mark()
+        parser(RESPONSE)
+        parser.mark()
+        parser("Entities:\n<Gamma, Concept, {}, []>\n<Del")
+        parser.reset()
+        parser("Entities:\n<Delta, Concept, {}, []>\n")
+        entities, relationships = parser.result()
+        self.assertEqual(
+            [e.name for e in entities], ["Knowledge Graph", "LLM", "Delta"]
+        )
+        self.assertEqual(len(relationships), 2)
+
+
+class MergeErTest(unittest.TestCase):
+    def test_duplicates_are_merged(self):
+        es = [
+            Entity(name="Graph", label="Concept", references=["a"], chunks=[0]),
+            Entity(name="Tree", label="Concept", chunks=[0]),
+            Entity(name="GRAPH", label="concept", references=["b", "a"], chunks=[1]),
+            Entity(name="Graph", label="Journal", chunks=[2]),
+        ]
+        rs = [
+            Relationship(start="Tree", end="Graph", type="IS_A", chunks=[0]),
+            Relationship(start="tree", end="graph", type="is_a", chunks=[1, 0]),
+            Relationship(start="Tree", end="Forest", type="IN", chunks=[1]),
+        ]
+        with self.assertLogs("llmgraph", level="WARNING") as logs:
+            merged_es, merged_rs = merge_er(es, rs)
+        self.assertIn("Forest", logs.output[0])
+        # entities of the same name and label merge into the first one seen, in order
+        self.assertEqual(
+            [(e.name, e.label, e.references, e.chunks) for e in merged_es],
+            [
+                ("Graph", "Concept", ["a", "b"], [0, 1]),
+                ("Tree", "Concept", [], [0]),
+                ("Graph", "Journal", [], [2]),
+            ],
+        )
+        self.assertEqual(
+            [(r.start, r.type, r.end, r.chunks) for r in merged_rs],
+            [("Tree", "IS_A", "Graph", [0, 1])],
+        )
+        # the inputs are left untouched
+        self.assertEqual((es[0].references, es[0].chunks), (["a"], [0]))
+        self.assertEqual(rs[1].start, "tree")
+
+    def test_many_duplicates(self):
+        es = [
+            Entity(name=f"Entity {i % 100}", label="Concept", chunks=[i])
+            for i in range(5000)
+        ]
+        rs = [
+            Relationship(
+                start=f"Entity {i % 100}", end=f"Entity {(i + 1) % 100}", type="NEXT"
+            )
+            for i in range(5000)
+        ]
+        merged_es, merged_rs = merge_er(es, rs)
+        self.assertEqual(
+            [e.name for e in merged_es], [f"Entity {i}" for i in range(100)]
+        )
+        self.assertEqual(merged_es[7].chunks, list(range(7, 5000, 100)))
+        self.assertEqual(len(merged_rs), 100)
+
+
+class GleaningRetryTest(unittest.TestCase):
+    first = (
+        "Entities:\n<Alpha, Concept, {}, []>\n<Beta, Concept, {}, []>\n"
+        "Relationships:\n<Alpha, KNOWS, Beta, {}, []>\n"
+    )
+    more = "Entities:\n<Gamma, Concept, {}, []>\nRelationships:\n"
+
+    def respond(self, messages: list) -> str:
+        if messages[-1]["content"] == CONTINUE_EXTRACT_P:
+            return self.more
+        if messages[-1]["content"] == IF_COTINUE_P:
+            return "NO"
+        return self.first
+
+    def test_failure_in_a_later_turn_keeps_the_earlier_turns(self):
+        request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+        # the continue turn is cut off after its first piece, and sent again
+        llm = fake_llm(
+            self.respond,
+            stream_errors=[None, openai.APIConnectionError(request=request)],
+        )
+        text = "Alpha knows Beta and Gamma."
+        parser = _glean_er_from_chunk(
+            Chunk(id=0, text=text, length=len(text)), llm, loop_num=1
+        )
+        entities, relationships = parser.result()
+        self.assertEqual([e.name for e in entities], ["Alpha", "Beta", "Gamma"])
+        self.assertEqual(
+            [(r.start, r.type, r.end) for r in relationships],
+            [("Alpha", "KNOWS", "Beta")],
+        )
+        self.assertEqual(len(llm.client.chat.completions.requests), 4)
+
+
+class StreamedExtractionTest(unittest.TestCase):
+    text = "Large Language Model (LLM) builds a knowledge graph."
+
+    def test_single_shot_streams_resolved_items(self):
+        items = []
+        llm = fake_llm(lambda messages: RESPONSE)
+        es, rs = extract_er_from_chunk_single_shot(
+            Chunk(id=7, text=self.text, length=len(self.text)),
+            llm,
+            on_item=items.append,
+        )
+        # the streamed items are the returned ones: with the chunk id and the acronym resolved
+        self.assertEqual(items, es + rs)
+        self.assertEqual(
+            [e.name for e in es], ["Knowledge Graph", "Large Language Model"]
+        )
+        self.assertEqual(rs[0].start, "Large Language Model")
+        self.assertTrue(all(item.chunks == [7] for item in items))
+
+    def test_batch_streams_into_the_store(self):
+        store = EntityStore()
+        added = []
+        add_entity = store.add_entity
+
+        def spy(entity):
+            added.append(entity.name)
+            add_entity(entity)
+
+        store.add_entity = spy
+        chunks = [Chunk(id=i, text=self.text, length=len(self.text)) for i in range(3)]
+        es, rs = batch_extract_er_execute(
+            chunks,
+            fake_llm(lambda messages: RESPONSE),
+            store=store,
+            strategy="single_shot",
+        )
+        # each entity is added while streamed and again with the result of its chunk
+        self.assertEqual(len(added), 2 * 2 * len(chunks))
+        self.assertEqual(
+            sorted(e.name for e in es), ["Knowledge Graph", "Large Language Model"]
+        )
+        self.assertEqual(len(rs), 1)
+        self.assertEqual(sorted(store.get("LLM")[0].chunks), [0, 1, 2])
+
+
+ACRONYM_TEXT = "Large Language Model (LLM) helps Alpha."
+
+
+def is_acronym_request(messages: list) -> bool:
+    return messages[-1]["content"].startswith("Full name and acronym")
+
+
+def respond_with_acronym(messages: list) -> str:
+    if is_acronym_request(messages):
+        return "Entities:\n<LLM, Model, {}, []>\nRelationships:\n"
+    if messages[-1]["content"] == IF_COTINUE_P:
+        return "NO"
+    if messages[-1]["content"] == CONTINUE_EXTRACT_P:
+        return "Entities:\nRelationships:\n"
+    return (
+        "Entities:\n<LLM, Model, {}, []>\n<Alpha, Concept, {}, []>\n"
+        "Relationships:\n<LLM, HELPS, Alpha, {}, []>\n"
+    )
+
+
+class ConcurrentAcronymTest(unittest.TestCase):
+    chunk = Chunk(id=3, text=ACRONYM_TEXT, length=len(ACRONYM_TEXT))
+
+    def test_acronym_runs_with_the_gleaning(self):
+        # the acronym and the first gleaning request only answer once both are in flight
+        barrier = threading.Barrier(2, timeout=5)
+
+        def respond(messages: list) -> str:
+            if is_acronym_request(messages) or len(messages) == 2:
+                barrier.wait()
+            return respond_with_acronym(messages)
+
+        llm = fake_llm(respond)
+        es, rs = extract_er_from_chunk(self.chunk, llm)
+        self.assertEqual(
+            [(e.name, e.chunks) for e in es],
+            [
+                ("Large Language Model", [3]),
+                ("Alpha", [3]),
+                ("Large Language Model", [3]),
+            ],
+        )
+        self.assertEqual(
+            [(r.start, r.end) for r in rs], [("Large Language Model", "Alpha")]
+        )
+        self.assertEqual(len(llm.client.chat.completions.requests), 4)
+        self.assertEqual(llm.usage.get("extract:gleaning").calls, 4)
+
+    def test_failed_acronym_is_raised(self):
+        def respond(messages: list) -> str:
+            if is_acronym_request(messages):
+                raise ValueError("acronym failed")
+            return respond_with_acronym(messages)
+
+        with self.assertRaisesRegex(ValueError, "acronym failed"):
+            extract_er_from_chunk(self.chunk, fake_llm(respond))
+
+
+class AsyncBatchExtractionTest(unittest.TestCase):
+    def test_gleaning_of_every_chunk(self):
+        llm = fake_async_llm(respond_with_acronym, max_concurrency=2)
+        chunks = [
+            Chunk(id=i, text=ACRONYM_TEXT, length=len(ACRONYM_TEXT)) for i in range(3)
+        ]
+        es, rs = asyncio.run(async_batch_extract_er_execute(chunks, llm))
+        # per chunk, the gleaned entities with the acronym resolved, then the acronym entity
+        self.assertEqual(
+            [(e.name, e.chunks) for e in es],
+            [
+                (name, [i])
+                for i in range(3)
+                for name in ["Large Language Model", "Alpha", "Large Language Model"]
+            ],
+        )
+        self.assertEqual(
+            [(r.start, r.end, r.chunks) for r in rs],
+            [("Large Language Model", "Alpha", [i]) for i in range(3)],
+        )
+        # three gleaning turns and the acronym request per chunk, at most two at a time
+        completions = llm.client.chat.completions
+        self.assertEqual(len(completions.requests), 12)
+        self.assertEqual(completions.max_in_flight, 2)
+
+    def test_single_shot_of_every_chunk(self):
+        llm = fake_async_llm(lambda messages: RESPONSE)
+        chunks = [
+            Chunk(id=i, text=ACRONYM_TEXT, length=len(ACRONYM_TEXT)) for i in range(2)
+        ]
+        es, rs = asyncio.run(
+            async_batch_extract_er_execute(chunks, llm, strategy="single_shot")
+        )
+        self.assertEqual(
+            [(e.name, e.chunks) for e in es],
+            [("Knowledge Graph", [0]), ("Large Language Model", [0])]
+            + [("Knowledge Graph", [1]), ("Large Language Model", [1])],
+        )
+        self.assertEqual(
+            [(r.start, r.end) for r in rs],
+            [("Large Language Model", "Knowledge Graph"), ("Knowledge Graph", "Entity")]
+            * 2,
+        )
+        self.assertEqual(len(llm.client.chat.completions.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+
+import httpx
+import openai
+
+from llmgraph.common.ratelimit import RateLimiter, TokenBucket, default_rate_limiter
+from llmgraph.general.parse_text_er import StreamingERParser
+
+from .fakes import fake_llm
+
+REQUEST = httpx.Request("POST", "https://api.test/v1/chat/completions")
+
+
+def rate_limit_error(retry_after: str = None) -> openai.RateLimitError:
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(429, headers=headers, request=REQUEST)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class FakeClock:
+    """
+    A clock that only moves when the limiter sleeps
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_reserve_and_refill(self):
+        bucket = TokenBucket(60, now=0.0)
+        self.assertEqual(bucket.reserve(60, 0.0), 0.0)
+        # the balance is negative, the caller waits for one unit at one unit per second
+        self.assertAlmostEqual(bucket.reserve(1, 0.0), 1.0)
+        self.assertAlmostEqual(bucket.reserve(1, 0.0), 2.0)
+        # refilled for 30 seconds, the balance is back to 28
+        self.assertEqual(bucket.reserve(28, 30.0), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1, 30.0), 1.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(60, now=0.0)
+        bucket.reserve(10, 0.0)
+        self.assertEqual(bucket.reserve(0, 3600.0), 0.0)
+        self.assertEqual(bucket.balance, 60)
+
+    def test_large_amount_waits_for_one_capacity(self):
+        bucket = TokenBucket(60, now=0.0)
+        self.assertEqual(bucket.reserve(600, 0.0), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1, 0.0), 1.0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_requests_per_minute(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rpm=2, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            limiter.call(lambda: None)
+        # two requests at once, then one every 30 seconds
+        self.assertEqual(clock.sleeps, [30.0, 30.0])
+        self.assertEqual(limiter.stats()["waits"], 2)
+
+    def test_tokens_per_minute(self):
+        clock = FakeClock()
+        limiter = RateLimiter(tpm=600, clock=clock, sleep=clock.sleep)
+        limiter.call(lambda: None, tokens=600)
+        limiter.call(lambda: None, tokens=300)
+        self.assertEqual(clock.sleeps, [30.0])
+        # the actual usage of the last request was larger than estimated
+        limiter.adjust(300)
+        limiter.call(lambda: None, tokens=0)
+        self.assertEqual(clock.sleeps, [30.0, 30.0])
+
+    def test_retry_after_pauses_every_caller(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep, base_delay=0.0)
+        errors = [rate_limit_error("5")]
+
+        def request():
+            if errors:
+                raise errors.pop()
+            return "ok"
+
+        self.assertEqual(limiter.call(request), "ok")
+        self.assertEqual(clock.sleeps, [5.0])
+        stats = limiter.stats()
+        self.assertEqual((stats["throttled"], stats["retries"]), (1, 1))
+        # a request started during the pause waits for its end
+        clock.now = 2.0
+        limiter.call(lambda: None)
+        self.assertEqual(clock.sleeps, [5.0, 3.0])
+
+    def test_gives_up_after_max_retries(self):
+        clock = FakeClock()
+        limiter = RateLimiter(
+            max_retries=2, base_delay=1.0, clock=clock, sleep=clock.sleep
+        )
+
+        def request():
+            raise openai.APIConnectionError(request=REQUEST)
+
+        with self.assertRaises(openai.APIConnectionError):
+            limiter.call(request)
+        self.assertEqual(len(clock.sleeps), 2)
+        # exponential backoff with jitter
+        self.assertTrue(0.5 <= clock.sleeps[0] <= 1.0)
+        self.assertTrue(1.0 <= clock.sleeps[1] <= 2.0)
+
+    def test_default_limiter_per_endpoint_and_key(self):
+        a = default_rate_limiter("https://a.test/v1", "key-1")
+        self.assertIs(a, default_rate_limiter("https://a.test/v1", "key-1"))
+        self.assertIsNot(a, default_rate_limiter("https://a.test/v1", "key-2"))
+        self.assertIsNot(a, default_rate_limiter("https://b.test/v1", "key-1"))
+
+
+class StreamRetryTest(unittest.TestCase):
+    answer = (
+        'Entities:\n<Graph, Concept, {}, ["a graph"]>\n<Node, Concept, {}, []>\n'
+        'Relationships:\n<Graph, HAS, Node, {}, ["nodes"]>\n'
+    )
+
+    def test_retries_on_error_mid_stream(self):
+        llm = fake_llm(
+            lambda messages: self.answer,
+            stream_errors=[
+                rate_limit_error(),
+                openai.APIConnectionError(request=REQUEST),
+            ],
+        )
+        parser = StreamingERParser()
+        content = llm.chat([{"role": "user", "content": "text"}], callback=parser)
+        self.assertEqual(content, self.answer)
+        self.assertEqual(len(llm.client.chat.completions.requests), 3)
+        # the parser is reset before each retry, the items are not duplicated
+        entities, relationships = parser.result()
+        self.assertEqual([e.name for e in entities], ["Graph", "Node"])
+        self.assertEqual([(r.start, r.end) for r in relationships], [("Graph", "Node")])
+        self.assertEqual(llm.rate_limiter.stats()["retries"], 2)
+        self.assertEqual(llm.usage.get("chat").calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
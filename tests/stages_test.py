@@ -0,0 +1,69 @@
+import threading
+import unittest
+
+from llmgraph.common.stages import run_stages
+
+
+class RunStagesTest(unittest.TestCase):
+    def test_stages_run_after_their_dependencies(self):
+        events = []
+        lock = threading.Lock()
+        # the two middle stages only finish once both are running
+        barrier = threading.Barrier(2, timeout=5)
+
+        def stage(name: str, concurrent: bool = False):
+            def fn(**inputs):
+                with lock:
+                    events.append(name)
+                if concurrent:
+                    barrier.wait()
+                return name + "(" + ",".join(sorted(inputs.values())) + ")"
+
+            return fn
+
+        results = run_stages(
+            {
+                "join": (stage("join"), ["left", "right"]),
+                "left": (stage("left", concurrent=True), ["split"]),
+                "right": (stage("right", concurrent=True), ["split"]),
+                "split": (stage("split"), []),
+            }
+        )
+        self.assertEqual(events[0], "split")
+        self.assertEqual(sorted(events[1:3]), ["left", "right"])
+        self.assertEqual(events[3], "join")
+        self.assertEqual(results["join"], "join(left(split()),right(split()))")
+        self.assertEqual(set(results), {"split", "left", "right", "join"})
+
+    def test_failure_is_raised_and_dependents_do_not_run(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError("stage failed")
+
+        with self.assertRaisesRegex(RuntimeError, "stage failed"):
+            run_stages(
+                {
+                    "fail": (fail, []),
+                    "dependent": (lambda fail: ran.append("dependent"), ["fail"]),
+                    "independent": (lambda: ran.append("independent"), []),
+                }
+            )
+        # the stage started with the failed one is finished, its dependent is not started
+        self.assertEqual(ran, ["independent"])
+
+    def test_invalid_dependencies(self):
+        with self.assertRaisesRegex(ValueError, "Unknown dependencies"):
+            run_stages({"a": (lambda: None, ["b"])})
+        with self.assertRaisesRegex(ValueError, "Cyclic dependencies"):
+            run_stages(
+                {
+                    "a": (lambda b: None, ["b"]),
+                    "b": (lambda a: None, ["a"]),
+                }
+            )
+        self.assertEqual(run_stages({}), {})
+
+
+if __name__ == "__main__":
+    unittest.main()